@@ -1,14 +1,24 @@
 import asyncio
+import base64
+import json
 import os
 import re
+import time
 import logging
 import traceback
 from aiohttp import web
 from datetime import datetime
-from src.ingestion import GmailClient, TokenExpiredError, detect_original_source
+from functools import partial
+from typing import Optional
+from src.ingestion import AsyncGmailClient, GmailClient, TokenExpiredError, detect_original_source
 from src.parser import TransactionParser, Classifier
+from src.template_cache import TemplateCache
 from src.bot import TransactionsBot
 from src.loader import SheetsLoader
+from src.recurring import RecurringConfigProvider
+from src.ledger import EmailLedger, FAILED, PROMPTED, REJECTED, SAVED, SKIPPED
+from src.scheduler import TaskScheduler
+from src.gate import RelevanceGate, detect_bank
 from dotenv import load_dotenv
 
 # Configure logging
@@ -29,7 +39,37 @@ except Exception as e:
 
 load_dotenv()
 
-async def process_email_task(email_data: dict, bots: dict, gmail: GmailClient, parser: TransactionParser, loader: SheetsLoader, processing_emails: set):
+# Fire-and-forget tasks (e.g. notification emails), referenced until done so they are not garbage-collected
+_background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+
+    def finished(t):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception():
+            logger.error(f"Background task failed: {t.exception()}")
+
+    task.add_done_callback(finished)
+    return task
+
+def route_email(bots: dict, target_user: str, chat_id_key: str):
+    """Returns (bot, target chat id) for the user an email belongs to."""
+    target_chat_id = None
+    if chat_id_key:
+        cid_str = os.getenv(chat_id_key)
+        if cid_str:
+            target_chat_id = int(cid_str)
+    
+    # Select the correct bot
+    current_bot = bots.get(target_user)
+    if not current_bot:
+        logger.warning(f"No specific bot found for {target_user}. Falling back to Juanma.")
+        current_bot = bots.get("Juanma")
+    return current_bot, target_chat_id
+
+async def process_email_task(email_data: dict, bots: dict, gmail: AsyncGmailClient, parser: TransactionParser, loader: SheetsLoader, ledger: EmailLedger, scheduler: TaskScheduler = None):
     email_id = email_data['id']
     try:
         logger.info(f"Processing email {email_id}")
@@ -38,22 +78,11 @@ async def process_email_task(email_data: dict, bots: dict, gmail: GmailClient, p
         original_sender, target_user, chat_id_key = detect_original_source(email_data)
         logger.info(f"Detected Source: {original_sender} | Target: {target_user} ({chat_id_key})")
         
-        target_chat_id = None
-        if chat_id_key:
-            cid_str = os.getenv(chat_id_key)
-            if cid_str:
-                target_chat_id = int(cid_str)
-        
-        # Select the correct bot
-        current_bot = bots.get(target_user)
-        if not current_bot:
-            logger.warning(f"No specific bot found for {target_user}. Falling back to Juanma.")
-            current_bot = bots.get("Juanma")
-        
         # 2. Parse
         # Prefer body, fallback to snippet
         text_to_parse = email_data.get('body') or email_data.get('snippet', '')
-        transaction = parser.parse(text_to_parse)
+        bank = detect_bank(email_data)
+        transaction = await parser.parse_async(text_to_parse, bank=bank)
         
         # Log deep warning if parsing is incomplete or ambiguous
         if transaction.get('merchant') == 'UNKNOWN' or transaction.get('amount', 0.0) == 0.0:
@@ -71,10 +100,38 @@ async def process_email_task(email_data: dict, bots: dict, gmail: GmailClient, p
             logger.warning(f"Could not parse transaction from email {email_id}")
             # Mark as read to avoid loop? Or skip?
             # If we can't parse, maybe it's spam or irrelevant.
-            # For now, let's mark read so we don't get stuck.
-            gmail.mark_as_read(email_id)
+            # For now, let's mark it processed so we don't get stuck.
+            gmail.mark_processed(email_id)
+            ledger.update(email_id, SKIPPED, error="unparseable")
             return
 
+        # Parsed once: a restart resumes from here without reparsing
+        ledger.update(email_id, PROMPTED, transaction=transaction, target_user=target_user, chat_id_key=chat_id_key)
+        await hand_off_prompt(scheduler, email_id, transaction, target_user, chat_id_key, bots, gmail, loader, ledger, snippet=email_data.get('snippet'))
+
+    except TokenExpiredError as e:
+        logger.error(f"Token naturally expired while processing email {email_id}: {e}")
+        ledger.update(email_id, FAILED, error=str(e))
+    except Exception as e:
+        logger.error(f"Error in process_email_task for email {email_id}: {e}")
+        ledger.update(email_id, FAILED, error=str(e))
+
+async def hand_off_prompt(scheduler: Optional[TaskScheduler], email_id: str, transaction: dict, target_user: str, chat_id_key: str, bots: dict, gmail: AsyncGmailClient, loader: SheetsLoader, ledger: EmailLedger, snippet: str = None):
+    """
+    Runs prompt_and_save. With a scheduler it runs in the background once the chat has a free prompt slot
+    (parked until then), so the worker is free again right away.
+    """
+    prompt = partial(prompt_and_save, email_id, transaction, target_user, chat_id_key, bots, gmail, loader, ledger, snippet=snippet)
+    if scheduler is None:
+        await prompt()
+    else:
+        await scheduler.start_prompt(target_user, prompt)
+
+async def prompt_and_save(email_id: str, transaction: dict, target_user: str, chat_id_key: str, bots: dict, gmail: AsyncGmailClient, loader: SheetsLoader, ledger: EmailLedger, snippet: str = None):
+    """Asks the user to classify a parsed transaction, then saves the answer."""
+    try:
+        current_bot, target_chat_id = route_email(bots, target_user, chat_id_key)
+
         # 3. Classify / Human-in-the-Loop
         # We pass routing info to bot
         logger.info(f"Asking {target_user} about transaction: {transaction}")
@@ -82,70 +139,114 @@ async def process_email_task(email_data: dict, bots: dict, gmail: GmailClient, p
         
         if not splits:
             logger.info("Transaction ignored or skipped by user.")
-            gmail.mark_as_read(email_id)
+            gmail.mark_processed(email_id)
+            ledger.update(email_id, SKIPPED)
             return
 
         logger.info(f"User confirmed splits: {splits}")
+        # Keep the answer so a failed save is retried without asking again
+        ledger.update(email_id, PROMPTED, splits=splits, message_id=message_id)
+        await save_splits(email_id, transaction, splits, message_id, current_bot, target_chat_id, gmail, loader, ledger, snippet=snippet)
+    except Exception as e:
+        logger.error(f"Error prompting for email {email_id}: {e}")
+        ledger.update(email_id, FAILED, error=str(e))
+
+async def save_splits(email_id: str, transaction: dict, splits: list, message_id: Optional[int], current_bot, target_chat_id: Optional[int], gmail: AsyncGmailClient, loader: SheetsLoader, ledger: EmailLedger, snippet: str = None):
+    # 4. Save all splits in one Sheets request: either every split is written or none is,
+    # so a retry never duplicates the splits that did make it
+    t_copies = []
+    entries = []
+    for category, scope, split_amount, user_who_paid, tx_type in splits:
+         # Create a copy or modify amount
+         t_copy = transaction.copy()
+         t_copy['amount'] = split_amount
+         t_copies.append(t_copy)
+         entries.append((t_copy, category, scope, user_who_paid, tx_type))
 
-        all_saved = True
-        for category, scope, split_amount, user_who_paid, tx_type in splits:
-             # Create a copy or modify amount
-             t_copy = transaction.copy()
-             t_copy['amount'] = split_amount
-             
-             success = loader.append_transaction(t_copy, category, scope=scope, user_who_paid=user_who_paid, transaction_type=tx_type)
-             if not success:
-                 logger.error(f"Failed to save transaction split to Sheets: {t_copy}")
-                 all_saved = False
+    results = await loader.append_many(entries)
+
+    all_saved = True
+    for t_copy, success in zip(t_copies, results):
+         if not success:
+             logger.error(f"Failed to save transaction split to Sheets: {t_copy}")
+             all_saved = False
+    
+    # 5. Mark as processed only if ALL saved successfully
+    if all_saved:
+        # Mark email as processed (batched with other processed emails)
+        gmail.mark_processed(email_id)
+        ledger.update(email_id, SAVED)
         
-        # 5. Mark as read only if ALL saved successfully
-        if all_saved:
-            # Mark email as read
-            gmail.mark_as_read(email_id)
-            
-            # Update Telegram Message to Success
-            if message_id and current_bot and current_bot.application:
-                try:
-                    msg_text = "💾 *Guardado Exitoso* en Google Sheets."
-                    
-                    # Append details and accumulation
-                    for category, scope, split_amount, user_who_paid, tx_type in splits:
-                         try:
-                             # Optimistic accumulation REMOVED: Sheets is fast enough.
-                             accumulated = loader.get_accumulated_total(category, scope, tx_type, user=user_who_paid)
-                             # accumulated += split_amount
-                             msg_text += f"\n• *{category}*: ${split_amount:,.2f}\n   📊 Acumulado: ${accumulated:,.2f}"
-                         except Exception as exc:
-                             logger.error(f"Error calculating accumulation for UI: {exc}")
-                             msg_text += f"\n• *{category}*: ${split_amount:,.2f}"
-
-                    await current_bot.application.bot.edit_message_text(chat_id=target_chat_id, message_id=message_id, text=msg_text, parse_mode='Markdown')
-                    # Effectively send the 'guardado' message so a notification is triggered
-                    await current_bot.application.bot.send_message(chat_id=target_chat_id, text="guardado")
-                except Exception as e:
-                    logger.error(f"Failed to edit completion message or send guardado: {e}")
+        # Update Telegram Message to Success
+        if message_id and current_bot and current_bot.application:
+            try:
+                msg_text = "💾 *Guardado Exitoso* en Google Sheets."
+                
+                # Append details and accumulation
+                for category, scope, split_amount, user_who_paid, tx_type in splits:
+                     try:
+                         # Served from the loader's in-memory index, which already includes the splits saved above.
+                         accumulated = await loader.accumulated(category, scope, tx_type, user=user_who_paid)
+                         msg_text += f"\n• *{category}*: ${split_amount:,.2f}\n   📊 Acumulado: ${accumulated:,.2f}"
+                     except Exception as exc:
+                         logger.error(f"Error calculating accumulation for UI: {exc}")
+                         msg_text += f"\n• *{category}*: ${split_amount:,.2f}"
 
-        else:
-            logger.warning(f"Skipping mark_as_read for email {email_id} due to save failure.")
-            # Notify user via Edit if possible
-            if current_bot and current_bot.application:
-                 err_text = f"⚠️ Error guardando transacción de {email_data.get('snippet', 'unknown')}. No se marcará como leído."
-                 try:
-                     if message_id:
-                         await current_bot.application.bot.edit_message_text(chat_id=target_chat_id, message_id=message_id, text=err_text)
-                     else:
-                         await current_bot.application.bot.send_message(chat_id=current_bot.chat_id, text=err_text)
-                 except Exception as e:
-                     logger.error(f"Failed to edit error message: {e}")
+                await current_bot.application.bot.edit_message_text(chat_id=target_chat_id, message_id=message_id, text=msg_text, parse_mode='Markdown')
+                # Effectively send the 'guardado' message so a notification is triggered
+                await current_bot.application.bot.send_message(chat_id=target_chat_id, text="guardado")
+            except Exception as e:
+                logger.error(f"Failed to edit completion message or send guardado: {e}")
 
-    except TokenExpiredError as e:
-        logger.error(f"Token naturally expired while processing email {email_id}: {e}")
+    else:
+        logger.warning(f"Not marking email {email_id} as processed due to save failure.")
+        ledger.update(email_id, FAILED, error="save failed")
+        # Notify user via Edit if possible
+        if current_bot and current_bot.application:
+             err_text = f"⚠️ Error guardando transacción de {snippet or 'unknown'}. Se reintentará automáticamente."
+             try:
+                 if message_id:
+                     await current_bot.application.bot.edit_message_text(chat_id=target_chat_id, message_id=message_id, text=err_text)
+                 else:
+                     await current_bot.application.bot.send_message(chat_id=current_bot.chat_id, text=err_text)
+             except Exception as e:
+                 logger.error(f"Failed to edit error message: {e}")
+
+async def resume_email_task(entry: dict, bots: dict, gmail: AsyncGmailClient, parser: TransactionParser, loader: SheetsLoader, ledger: EmailLedger, scheduler: TaskScheduler = None):
+    """
+    Picks up an email from the ledger where it stopped: retries the save if the user already answered,
+    asks again if it was parsed but never answered, or refetches it by ID and parses it again.
+    """
+    email_id = entry["id"]
+    try:
+        if entry["splits"]:
+            logger.info(f"Resuming email {email_id}: retrying save.")
+            ledger.update(email_id, PROMPTED)
+            current_bot, target_chat_id = route_email(bots, entry["target_user"], entry["chat_id_key"])
+            await save_splits(email_id, entry["transaction"], entry["splits"], entry["message_id"], current_bot, target_chat_id, gmail, loader, ledger, snippet=entry["snippet"])
+        elif entry["transaction"]:
+            logger.info(f"Resuming email {email_id}: asking again.")
+            ledger.update(email_id, PROMPTED)
+            await hand_off_prompt(scheduler, email_id, entry["transaction"], entry["target_user"], entry["chat_id_key"], bots, gmail, loader, ledger, snippet=entry["snippet"])
+        else:
+            logger.info(f"Resuming email {email_id}: refetching and parsing.")
+            emails = await gmail.get_messages([email_id])
+            if not emails:
+                # Deleted from the mailbox, or the get failed: counts as an attempt
+                ledger.update(email_id, FAILED, error="could not refetch")
+                return
+            await process_email_task(emails[0], bots, gmail, parser, loader, ledger, scheduler)
     except Exception as e:
-        logger.error(f"Error in process_email_task for email {email_id}: {e}")
-    finally:
-        processing_emails.discard(email_id)
+        logger.error(f"Error resuming email {email_id}: {e}")
+        ledger.update(email_id, FAILED, error=str(e))
+
+def give_up(ledger: EmailLedger, max_attempts: int):
+    """Stops retrying emails that failed `max_attempts` times; they stay unprocessed in Gmail."""
+    for email_id in ledger.give_up(max_attempts):
+        logger.error(f"Email {email_id} failed {max_attempts} times. Giving up; it is left unprocessed in Gmail.")
 
 async def tasker_webhook_handler(request):
+    received_at = time.monotonic()
     try:
         logger.info("Received request on /tasker webhook.")
         
@@ -178,7 +279,7 @@ async def tasker_webhook_handler(request):
             parser = request.app.get("parser")
             if parser:
                 try:
-                    parsed = parser.parse(str(texto))
+                    parsed = await parser.parse_async(str(texto), interactive=True)
                     amount = parsed.get("amount")
                     merchant = parsed.get("merchant")
                 except Exception as e:
@@ -211,7 +312,8 @@ async def tasker_webhook_handler(request):
             logger.error("Bot subsystem not ready inside /tasker webhook handler.")
             return web.json_response({"error": "Bot subsystem not ready"}, status=503)
             
-        asyncio.create_task(bot_juanma.process_manual_transaction(transaction_data))
+        # Interactive lane: goes ahead of any email backlog
+        await bot_juanma.start_manual_transaction(transaction_data, received_at=received_at)
         logger.info(f"Successfully processed Tasker transaction: {transaction_data}")
         
         return web.json_response({"status": "success", "message": "Transaction sent to bot", "data": transaction_data})
@@ -220,11 +322,42 @@ async def tasker_webhook_handler(request):
         logger.error(f"Error in tasker webhook general handler: {e}", exc_info=True)
         return web.json_response({"error": str(e)}, status=500)
 
-async def start_web_server(bots, parser=None):
+async def gmail_push_handler(request):
+    """
+    Pub/Sub push endpoint for Gmail users.watch notifications.
+    Wakes the ETL loop so the incremental fetch runs right away. Always acks (2xx) valid pushes,
+    otherwise Pub/Sub keeps redelivering them.
+    """
+    token = os.getenv("GMAIL_PUSH_TOKEN")
+    if token and request.query.get("token") != token:
+        logger.warning("Unauthorized Gmail push notification.")
+        return web.json_response({"error": "Unauthorized"}, status=401)
+
+    try:
+        envelope = await request.json()
+        notification = json.loads(base64.b64decode(envelope["message"]["data"]))
+        history_id = notification["historyId"]
+    except Exception as e:
+        logger.warning(f"Malformed Gmail push payload: {e}")
+        return web.json_response({"error": "Malformed payload"}, status=400)
+
+    logger.info(f"Gmail push for {notification.get('emailAddress')} (historyId {history_id}). Waking ETL loop.")
+    wakeup = request.app.get("gmail_wakeup")
+    if wakeup:
+        wakeup.set()
+    return web.Response(status=204)
+
+def create_web_app(bots, parser=None, gmail_wakeup: asyncio.Event = None) -> web.Application:
     app = web.Application()
     app["bot_juanma"] = bots.get("Juanma")
     app["parser"] = parser
+    app["gmail_wakeup"] = gmail_wakeup
     app.router.add_post('/tasker', tasker_webhook_handler)
+    app.router.add_post('/gmail/push', gmail_push_handler)
+    return app
+
+async def start_web_server(bots, parser=None, gmail_wakeup: asyncio.Event = None):
+    app = create_web_app(bots, parser, gmail_wakeup)
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -237,11 +370,26 @@ async def start_web_server(bots, parser=None):
         logger.error(f"Failed to start Tasker Webhook on port 8080: {e}")
         return None
 
-async def etl_loop(bots: dict, gmail: GmailClient, parser: TransactionParser, loader: SheetsLoader):
+async def etl_loop(bots: dict, gmail: AsyncGmailClient, parser: TransactionParser, loader: SheetsLoader, wakeup: asyncio.Event = None, ledger: EmailLedger = None, scheduler: TaskScheduler = None, gate: RelevanceGate = None):
     """
     Main ETL loop.
+    Every fetched email is recorded in the `ledger`: known emails are skipped, emails left in flight by a
+    previous run are resumed at startup, and failed emails are retried after EMAIL_RETRY_SECONDS, up to
+    EMAIL_MAX_ATTEMPTS times.
+    Emails are handed to the `scheduler`'s bounded queue; new emails are downloaded EMAIL_QUEUE_SIZE at a
+    time and only as fast as the workers drain the queue. The relevance `gate` looks at headers and snippet
+    first: emails that are not transaction notices are neither parsed nor marked processed (they stay unread),
+    only recorded as rejected in the ledger so later syncs do not download them again.
+    With `wakeup` (set by the /gmail/push endpoint) it fetches as soon as Gmail notifies us.
+    If GMAIL_PUBSUB_TOPIC is set, the mailbox watch is kept registered and the poll slows down to
+    GMAIL_SAFETY_POLL_SECONDS as a backstop; otherwise it polls every 60s.
     """
     try:
+        watch_topic = os.getenv("GMAIL_PUBSUB_TOPIC")
+        watch_renew_at = 0.0
+        # Pushes only arrive if a watch is registered; otherwise keep the regular poll
+        poll_interval = float(os.getenv("GMAIL_SAFETY_POLL_SECONDS", "600")) if (wakeup and watch_topic) else 60
+
         sender_env = os.getenv("AUTHORIZED_SENDER_EMAIL", "")
         # Handle multiple senders (comma separated)
         senders = [s.strip() for s in sender_env.split(",") if s.strip()]
@@ -259,33 +407,71 @@ async def etl_loop(bots: dict, gmail: GmailClient, parser: TransactionParser, lo
         else:
             base_query = "" # risky, fetches all unread?
 
-        processing_emails = set()
+        if ledger is None:
+            ledger = EmailLedger()
+        ledger.prune()
+        retry_after = float(os.getenv("EMAIL_RETRY_SECONDS", "300"))
+        max_attempts = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+
+        if scheduler is None:
+            scheduler = TaskScheduler()
+        scheduler.start()
+        if gate is None:
+            gate = RelevanceGate()
+
+        # Resume whatever the previous run left half-done
+        give_up(ledger, max_attempts)
+        for entry in ledger.in_flight(max_attempts=max_attempts):
+            await scheduler.submit(partial(resume_email_task, entry, bots, gmail, parser, loader, ledger, scheduler))
 
         while True:
             logger.info("Checking for new emails...")
             try:
-                # Use custom_query to combine sender + unread
-                full_query = f"{base_query} is:unread newer_than:3d" if base_query else "is:unread newer_than:3d"
+                # users.watch expires after 7 days; renew daily
+                if watch_topic and time.time() >= watch_renew_at:
+                    try:
+                        await gmail.watch(watch_topic)
+                        watch_renew_at = time.time() + 24 * 3600
+                    except Exception as e:
+                        logger.error(f"Failed to register Gmail watch on {watch_topic}: {e}")
+                        watch_renew_at = time.time() + 300
+
+                # Use custom_query to combine sender + not yet processed (unread, or missing the processed label)
+                pending_filter = f"{gmail.unprocessed_filter} newer_than:3d"
+                full_query = f"{base_query} {pending_filter}" if base_query else pending_filter
                 
                 try:
-                    emails = gmail.fetch_unread_emails(custom_query=full_query)
+                    # Incremental (History API); falls back to the full query when needed
+                    message_ids = await gmail.new_message_ids(custom_query=full_query)
+                    # Emails already in the ledger are never downloaded again
+                    message_ids = [m for m in message_ids if ledger.state(m) is None]
+
+                    for start in range(0, len(message_ids), scheduler.queue_size):
+                        emails = await gmail.get_messages(message_ids[start:start + scheduler.queue_size], wants_body=gate.wants_body)
+                        for email_data in emails:
+                            email_id = email_data['id']
+                            if not ledger.claim(email_id, snippet=email_data.get('snippet')):
+                                continue
+                            if not gate.admit(email_data):
+                                # Not a transaction notice: no parse or prompt, but left unprocessed in case the gate is wrong
+                                ledger.update(email_id, REJECTED, error="not a transaction notice")
+                                continue
+                            # Waits while the queue is full (backpressure on the fetch)
+                            await scheduler.submit(partial(process_email_task, email_data, bots, gmail, parser, loader, ledger, scheduler))
                 except Exception as e:
                     # If it looks like invalid_grant, we might want to trigger the alert
                     if "invalid_grant" in str(e) or "Token has been expired" in str(e):
                          raise TokenExpiredError(f"Runtime token expiry: {e}")
                     raise e
-                
-                for email_data in emails:
-                    email_id = email_data['id']
-                    if email_id in processing_emails:
-                        continue
-                        
-                    processing_emails.add(email_id)
-                    
-                    # Process each email independently
-                    asyncio.create_task(
-                        process_email_task(email_data, bots, gmail, parser, loader, processing_emails)
-                    )
+
+                # Retry failed emails (bounded, so a poisoned email does not loop forever)
+                give_up(ledger, max_attempts)
+                for entry in ledger.in_flight(states=(FAILED,), older_than=retry_after, max_attempts=max_attempts):
+                    ledger.update(entry["id"], PROMPTED) # Not picked again while queued
+                    await scheduler.submit(partial(resume_email_task, entry, bots, gmail, parser, loader, ledger, scheduler))
+
+                logger.info(f"Email ledger backlog: {ledger.counts()} | Gate: {gate.stats()} | Scheduler: {scheduler.stats()}"
+                            + (f" | Templates: {parser.template_cache.stats()}" if parser.template_cache else ""))
             
             except TokenExpiredError as tee:
                 raise tee # Escalate to main handler
@@ -297,8 +483,15 @@ async def etl_loop(bots: dict, gmail: GmailClient, parser: TransactionParser, lo
                 # We can't alert easily if we don't know which bot. Pick Juanma.
                 pass
 
-            # Wait before next poll
-            await asyncio.sleep(60)
+            # Wait for a push notification (or the next poll)
+            if wakeup:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+            else:
+                await asyncio.sleep(poll_interval)
 
     except TokenExpiredError as e:
         raise e # Escalate to main
@@ -315,7 +508,9 @@ async def main():
     try:
         # interactive=False is default, ensuring it raises TokenExpiredError on fail
         gmail = GmailClient(interactive=False) 
-        parser = TransactionParser()
+        # LLM results replayed for emails with an already-seen template (survives restarts)
+        template_cache = TemplateCache()
+        parser = TransactionParser(template_cache=template_cache)
         classifier = Classifier() 
         loader = SheetsLoader(credentials=gmail.creds)
     except TokenExpiredError as e:
@@ -325,14 +520,22 @@ async def main():
         logger.critical(f"Fatal Init Error: {e}\n{traceback.format_exc()}")
         return
 
-    # Define Notifier Callback (Now closes over 'gmail' variable correctly)
+    # Gmail calls run on their own worker pool, off the event loop
+    gmail_async = AsyncGmailClient(gmail)
+
+    # Durable per-email state (survives restarts)
+    ledger = EmailLedger()
+    # Bounded worker pool with priority lanes: manual/Tasker ahead of emails
+    scheduler = TaskScheduler()
+
+    # Define Notifier Callback (Now closes over 'gmail_async' variable correctly)
     def notify_user(subject, message):
-         # Send to Juanma and Leydi explicitly
+         # Send to Juanma and Leydi explicitly (in the background; send_email logs its own failures)
          recipients = ["juanbarco92@gmail.com", "lejom_0721@hotmail.com"]
          
          for email_to in recipients:
              try:
-                gmail.send_email(to=email_to, subject=f"[AutoTrx] {subject}", message_text=message)
+                run_in_background(gmail_async.send_email(to=email_to, subject=f"[AutoTrx] {subject}", message_text=message))
              except Exception as ex:
                 logger.error(f"Failed to send email to {email_to}: {ex}")
 
@@ -340,8 +543,12 @@ async def main():
     token_juanma = os.getenv("TELEGRAM_TOKEN_JUANMA")
     token_leydi = os.getenv("TELEGRAM_TOKEN_LEY")
     
+    # One cached recurring config for both bots, warmed up so the first /fijos opens instantly
+    recurring = RecurringConfigProvider(loader)
+    recurring_warmup = asyncio.create_task(recurring.refresh())
+
     # Pass notifier to bot
-    bot_juanma = TransactionsBot(token=token_juanma, loader=loader, notifier=notify_user)
+    bot_juanma = TransactionsBot(token=token_juanma, loader=loader, notifier=notify_user, recurring=recurring, scheduler=scheduler)
     bot_leydi = None
     
     # Start Polling
@@ -352,7 +559,7 @@ async def main():
     bots = {"Juanma": bot_juanma}
 
     if token_leydi:
-        bot_leydi = TransactionsBot(token=token_leydi, loader=loader) # Leydi relies on Juanma's stability or separate handler?
+        bot_leydi = TransactionsBot(token=token_leydi, loader=loader, recurring=recurring, scheduler=scheduler) # Leydi relies on Juanma's stability or separate handler?
         await bot_leydi.start_polling()
         bots["Leydi"] = bot_leydi
         logger.info("Bot Leydi started.")
@@ -362,10 +569,11 @@ async def main():
     webhook_runner = None
     try:
         # Start Tasker Webhook
-        webhook_runner = await start_web_server(bots, parser)
+        gmail_wakeup = asyncio.Event()
+        webhook_runner = await start_web_server(bots, parser, gmail_wakeup)
 
-        # Run ETL loop
-        await etl_loop(bots, gmail, parser, loader)
+        # Run ETL loop (woken by /gmail/push when a watch is configured)
+        await etl_loop(bots, gmail_async, parser, loader, wakeup=gmail_wakeup if webhook_runner else None, ledger=ledger, scheduler=scheduler)
 
         
     except TokenExpiredError as e:
@@ -399,7 +607,20 @@ async def main():
                 await webhook_runner.cleanup()
             except Exception as e:
                 logger.error(f"Error cleaning up webhook runner: {e}")
+
+        # Stop the email workers (unfinished emails are resumed from the ledger next start)
+        await scheduler.close()
+
+        # The recurring config warm-up may still be reading the sheet
+        recurring_warmup.cancel()
+        await asyncio.gather(recurring_warmup, return_exceptions=True)
                 
+        # Write out anything still waiting in the Sheets write-behind queue
+        loader.close()
+        gmail_async.close()
+        ledger.close()
+        template_cache.close()
+
         # Stop all bots
         await bot_juanma.stop()
         if bot_leydi:
@@ -1,11 +1,14 @@
 import asyncio
 import os
+from functools import partial
 from typing import Dict, Optional, List, Tuple
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ApplicationBuilder, ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters
 from telegram.error import NetworkError, TimedOut
 import logging
-from src.config import CATEGORIES_CONFIG, RECURRING_EXPENSES
+from src.config import CATEGORIES_CONFIG
+from src.recurring import RecurringConfigProvider
+from src.scheduler import INTERACTIVE
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,10 +32,14 @@ def escape_md(text):
 from telegram.request import HTTPXRequest
 
 class TransactionsBot:
-    def __init__(self, loader=None, token=None, notifier=None):
+    def __init__(self, loader=None, token=None, notifier=None, recurring=None, scheduler=None):
         self.token = token or TOKEN
         self.notifier = notifier # Callback for notifications (e.g., email)
         self.loader = loader
+        # Recurring expenses (config.py + 'Config_Fijos'), cached. Can be shared between bots.
+        self.recurring = recurring or RecurringConfigProvider(loader)
+        # Shared TaskScheduler: manual entries run on its interactive lane
+        self.scheduler = scheduler
         
         self.pending_futures: Dict[str, asyncio.Future] = {}
         self.flow_data: Dict[str, Dict] = {} 
@@ -115,7 +122,7 @@ class TransactionsBot:
                     }
                     
                     await self._retry_request(update.message.reply_text, f"💰 Monto: ${amount:,.2f}\n✅ Descripción: {desc}. Clasificando...", parse_mode='Markdown')
-                    asyncio.create_task(self.process_manual_transaction(transaction_data))
+                    await self.start_manual_transaction(transaction_data)
                     return
                 else:
                     self.manual_sessions[user_id] = {
@@ -138,15 +145,8 @@ class TransactionsBot:
         user_id = update.effective_user.id
         self.chat_id = update.effective_chat.id # Ensure we grab chat_id locally
         
-        # Load from Sheet if Loader available
-        queue = []
-        if self.loader:
-            # We want expenses for this Chat ID
-            recurring_map = self.loader.get_recurring_expenses()
-            queue = recurring_map.get(self.chat_id, [])
-        else:
-            # Fallback to config (Legacy) or empty
-            queue = RECURRING_EXPENSES.get(self.chat_id, [])
+        # Cached merge of config.py and 'Config_Fijos' for this Chat ID
+        queue = await self.recurring.get(self.chat_id)
 
         if not queue:
             await self._retry_request(update.message.reply_text, "⚠️ No tienes gastos fijos configurados en la hoja 'Config_Fijos'.\nUsa /nuevo_fijo para agregar uno.")
@@ -155,11 +155,81 @@ class TransactionsBot:
         self.recurring_sessions[user_id] = {
             "queue": [item.copy() for item in queue], # Deep copy to allow specific edits
             "index": 0,
-            "status": "RECURRING_REVIEW",
+            "status": "RECURRING_BULK",
+            "selected": set(range(len(queue))), # Bulk review: items to save
             "saved_count": 0
         }
         
-        await self._show_next_recurring_item(update, context, user_id)
+        await self._show_recurring_review(update, context, user_id)
+
+    async def _show_recurring_review(self, update, context, user_id):
+        """Bulk review: every pending item on one screen, toggled/edited in place and saved together."""
+        session = self.recurring_sessions[user_id]
+        queue = session["queue"]
+        selected = session["selected"]
+
+        total = sum(queue[i]["amount"] for i in selected)
+        msg = f"📅 *Gastos Fijos* ({len(selected)}/{len(queue)} seleccionados)\n\n"
+        keyboard = []
+        for i, item in enumerate(queue):
+            mark = "✅" if i in selected else "⬜"
+            msg += f"{mark} {i + 1}. {escape_md(item['name'])}: ${item['amount']:,.2f}\n"
+            keyboard.append([
+                InlineKeyboardButton(f"{mark} {i + 1}. {item['name']}", callback_data=f"REC|TOGGLE:{i}"),
+                InlineKeyboardButton("✏️", callback_data=f"REC|EDIT:{i}"),
+            ])
+        msg += f"\n💵 *Total: ${total:,.2f}*"
+
+        keyboard.append([InlineKeyboardButton(f"💾 Guardar todos ({len(selected)})", callback_data="REC|SAVEALL")])
+        keyboard.append([
+            InlineKeyboardButton("➡️ Uno por uno", callback_data="REC|ONEBYONE"),
+            InlineKeyboardButton("❌ Cancelar Todo", callback_data="REC|CANCEL"),
+        ])
+
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text=msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        else:
+            await self._retry_request(update.message.reply_text, text=msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+    async def _save_all_recurring(self, update, context, user_id):
+        """Writes every selected item in one batched Sheets request and reports totals per category."""
+        session = self.recurring_sessions.pop(user_id)
+        query = update.callback_query
+        items = [session["queue"][i] for i in sorted(session["selected"])]
+
+        if not items:
+            await query.edit_message_text(text="⚠️ No hay gastos fijos seleccionados.")
+            return
+
+        await query.edit_message_text(text=f"⏳ Guardando {len(items)} gastos fijos...")
+
+        from datetime import datetime
+        date = datetime.now().strftime("%d/%m/%Y %H:%M")
+        results = [False] * len(items)
+        if self.loader:
+            results = await self.loader.append_many([
+                ({"date": date, "amount": item["amount"], "merchant": item["name"]}, item["category"], item["scope"], item["owner"], "Gasto")
+                for item in items
+            ])
+
+        # Per-category totals of what was saved
+        totals: Dict[Tuple[str, str, str], float] = {}
+        for item, success in zip(items, results):
+            if success:
+                key = (item["category"], item["scope"], item["owner"])
+                totals[key] = totals.get(key, 0.0) + item["amount"]
+
+        msg = f"✅ *Gastos Fijos Registrados* ({sum(results)}/{len(items)})\n\n"
+        for (category, scope, owner), amount in totals.items():
+            accumulated = await self.loader.accumulated(category, scope, "Gasto", user=owner)
+            msg += f"• {escape_md(category)}: ${amount:,.2f} (Acum: ${accumulated:,.2f})\n"
+        msg += f"\n💵 *Total: ${sum(totals.values()):,.2f}*"
+
+        failed = [item["name"] for item, success in zip(items, results) if not success]
+        if failed:
+            msg += "\n⚠️ Error guardando: " + ", ".join(escape_md(name) for name in failed)
+
+        await self._retry_request(context.bot.send_message, chat_id=self.chat_id, text=msg, parse_mode='Markdown')
 
     async def _show_next_recurring_item(self, update, context, user_id):
         session = self.recurring_sessions[user_id]
@@ -218,7 +288,7 @@ class TransactionsBot:
                 "merchant": item["name"] # Description
             }
             
-            success = self.loader.append_transaction(
+            success = await self.loader.append(
                 t_data, 
                 category=item["category"], 
                 scope=item["scope"], 
@@ -244,6 +314,31 @@ class TransactionsBot:
             return
 
         user_id = update.effective_user.id
+
+        # --- 0. Recurring Session waiting for an edited amount ---
+        rec_session = self.recurring_sessions.get(user_id)
+        if rec_session and rec_session.get("status") == "RECURRING_WAITING_AMOUNT":
+            try:
+                text = update.message.text.replace(',', '').replace('$', '').strip()
+                if text.lower().endswith('k'):
+                    amount = float(text.lower().replace('k', '')) * 1000
+                else:
+                    amount = float(text)
+            except ValueError:
+                await self._retry_request(update.message.reply_text, "❌ Número inválido. Intenta de nuevo.")
+                return
+
+            if "edit_index" in rec_session:
+                # Bulk review: update the item and show the review again
+                rec_session["queue"][rec_session.pop("edit_index")]["amount"] = amount
+                rec_session["status"] = "RECURRING_BULK"
+                await self._show_recurring_review(update, context, user_id)
+            else:
+                # One by one: update current item, save and next
+                rec_session["queue"][rec_session["index"]]["amount"] = amount
+                rec_session["status"] = "RECURRING_REVIEW"
+                await self._process_recurring_item_save(update, context, user_id)
+            return
         
         # --- 1. Check for Manual Session ---
         if user_id in self.manual_sessions:
@@ -269,26 +364,6 @@ class TransactionsBot:
 
                 return
             
-            elif status == "RECURRING_WAITING_AMOUNT":
-                try:
-                    text = update.message.text.replace(',', '').replace('$', '').strip()
-                    if text.lower().endswith('k'):
-                        amount = float(text.lower().replace('k', '')) * 1000
-                    else:
-                        amount = float(text)
-                    
-                    # Update current item
-                    current_idx = session["index"]
-                    queue = session["queue"]
-                    queue[current_idx]["amount"] = amount
-                    
-                    # Save and Next
-                    await self._process_recurring_item_save(update, context, user_id)
-                    
-                except ValueError:
-                    await self._retry_request(update.message.reply_text, "❌ Número inválido. Intenta de nuevo.")
-                return
-
             elif status == "MANUAL_WAITING_DESC":
                 desc = update.message.text.strip()
                 session["data"]["merchant"] = desc
@@ -303,8 +378,8 @@ class TransactionsBot:
                 await self._retry_request(update.message.reply_text, f"✅ Descripción: {desc}. Clasificando...")
                 
                 # Launch Async Classification Flow
-                # We use create_task to run independent of helpful return
-                asyncio.create_task(self.process_manual_transaction(transaction_data))
+                # Runs independent of this handler, ahead of any email backlog
+                await self.start_manual_transaction(transaction_data)
                 return
 
         # --- 2. Existing Split Flow (Waiting for Split Input) ---
@@ -391,6 +466,16 @@ class TransactionsBot:
         except ValueError:
             await self._retry_request(update.message.reply_text, "❌ Por favor ingresa un número válido (ej: 50000 o 50k).")
 
+    async def start_manual_transaction(self, transaction: Dict, received_at: float = None):
+        """
+        Starts process_manual_transaction in the background, on the scheduler's interactive lane if there is one.
+        `received_at` (time.monotonic()) is when the request came in, for the lane's end-to-end latency.
+        """
+        if self.scheduler:
+            await self.scheduler.submit_prompt(f"manual:{self.chat_id}", partial(self.process_manual_transaction, transaction), lane=INTERACTIVE, since=received_at)
+        else:
+            asyncio.create_task(self.process_manual_transaction(transaction))
+
     async def process_manual_transaction(self, transaction: Dict):
         """Orchestrates the classification and saving for manual transactions."""
         logger.info(f"Processing manual transaction: {transaction}")
@@ -413,10 +498,14 @@ class TransactionsBot:
         if self.loader:
             all_saved = True
             saved_cats = []
+            pending = []
             for category, scope, amount, user_who_paid, tx_type in splits:
                 t_copy = transaction.copy()
                 t_copy['amount'] = amount
-                success = self.loader.append_transaction(t_copy, category, scope=scope, user_who_paid=user_who_paid, transaction_type=tx_type)
+                pending.append(self.loader.append(t_copy, category, scope=scope, user_who_paid=user_who_paid, transaction_type=tx_type))
+
+            results = await asyncio.gather(*pending)
+            for (category, *_), success in zip(splits, results):
                 if success:
                     saved_cats.append(category)
                 else:
@@ -430,21 +519,8 @@ class TransactionsBot:
                 # If multiple, list them? 
                 # Let's iterate saved cats/splits
                 for category, scope, amount, user_who_paid, tx_type in splits:
-                    accumulated = 0.0
-                    if self.loader:
-                        # Fetch previous total
-                        prev_total = self.loader.get_accumulated_total(category, scope, tx_type, user=user_who_paid)
-                        # Add current (since we just saved it, but sheets might lag or we want optimistic)
-                        # Actually sheets append is sync usually? But get_all_records might be cached or lagging.
-                        # Safest is prev_total + amount if we trust get_accumulated doesn't see it yet.
-                        # Wait, get_accumulated calls get_all_records. If we just appended, it SHOULD see it.
-                        # But `append_row` vs `get_all_records` consistency...
-                        # Let's assume we need to manually add if the loader doesn't guarantee instant visibility.
-                        # Or better: Just show "Acumulado a la fecha".
-                        # Optimistic addition REMOVED: Sheets is fast enough.
-                        # accumulated += amount
-                        pass
-                        
+                    # The loader's aggregate index already includes the rows we just appended
+                    accumulated = await self.loader.accumulated(category, scope, tx_type, user=user_who_paid)
                     msg_text += f"• *{escape_md(category)}*: ${amount:,.2f}\n"
                     msg_text += f"   📊 Acumulado: ${accumulated:,.2f}\n"
 
@@ -528,8 +604,8 @@ class TransactionsBot:
         step, value = data.split("|", 1)
         print(f"DEBUG FLOW: Recv Data={data} -> Step={step}, Value={value}")
 
-        # Recovery/Check
-        if message_id not in self.flow_data and step != "VALID":
+        # Recovery/Check (recurring callbacks keep their state in recurring_sessions)
+        if message_id not in self.flow_data and step not in ("VALID", "REC"):
              from telegram.error import BadRequest
              try:
                  await query.edit_message_text(text="⚠️ Sesión expirada. Intenta de nuevo.")
@@ -799,9 +875,31 @@ class TransactionsBot:
                 return
 
             session = self.recurring_sessions[user_id]
-            action = value
-            
-            if action == "YES":
+            action, _, arg = value.partition(":")
+
+            if action == "TOGGLE":
+                idx = int(arg)
+                session["selected"] ^= {idx}
+                await self._show_recurring_review(update, context, user_id)
+
+            elif action == "EDIT" and arg:
+                # Bulk review: edit one item's amount
+                idx = int(arg)
+                session["status"] = "RECURRING_WAITING_AMOUNT"
+                session["edit_index"] = idx
+                await query.edit_message_text(
+                    text=f"✏️ Ingresa el nuevo valor para *{escape_md(session['queue'][idx]['name'])}*:",
+                    parse_mode='Markdown'
+                )
+
+            elif action == "SAVEALL":
+                await self._save_all_recurring(update, context, user_id)
+
+            elif action == "ONEBYONE":
+                session["status"] = "RECURRING_REVIEW"
+                await self._show_next_recurring_item(update, context, user_id)
+
+            elif action == "YES":
                 # Save current and move next
                 await self._process_recurring_item_save(update, context, user_id)
             
@@ -843,7 +941,7 @@ class TransactionsBot:
                 for cat, scope, amt, user_who_paid, tx_type in splits:
                     accumulated = 0.0
                     if self.loader:
-                        accumulated = self.loader.get_accumulated_total(cat, scope, tx_type, user=user_who_paid)
+                        accumulated = await self.loader.accumulated(cat, scope, tx_type, user=user_who_paid)
                     
                     # Logic: The transaction is saved by main.py *after* this callback finishes (or concurrently).
                     # Since reads/writes are not instant, we assume the sheet doesn't have it yet.
@@ -0,0 +1,121 @@
+import html
+import logging
+import os
+import re
+from collections import Counter
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per-bank signatures, matched lowercase:
+# - senders: in the From header
+# - domains: the original sender's address quoted in a forwarded email ("De: RappiCard <noreply@rappicard.co>").
+#   Bank names alone are not enough there: "Se los enviaste a Bancolombia" is a Nubank notice.
+# - keywords: phrases its transaction notices use (Subject + snippet)
+SIGNATURES: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "Bancolombia": {
+        "senders": ("bancolombia",),
+        "domains": ("bancolombia.com",),
+        "keywords": ("compraste", "pagaste", "transferiste", "retiraste", "recibiste", "factura programada", "a la llave"),
+    },
+    "Nubank": {
+        "senders": ("nubank", "nu.com.co"),
+        "domains": ("nu.com.co", "nubank.com"),
+        "keywords": ("enviaste", "pagaste", "pago aprobado", "fue exitoso", "compra aprobada"),
+    },
+    "RappiCard": {
+        "senders": ("rappi",),
+        "domains": ("rappicard.co", "rappi.com"),
+        "keywords": ("resumen de transacción", "comercio", "compra"),
+    },
+    "Glim": {
+        "senders": ("getglim", "glim"),
+        "domains": ("getglim.com",),
+        "keywords": ("transacción aprobada", "tarjeta de beneficios"),
+    },
+}
+
+# Unknown senders: any bank's phrases, plus generic ones
+GENERIC_KEYWORDS = tuple(sorted({kw for sig in SIGNATURES.values() for kw in sig["keywords"]})) + ("transacción", "compra", "pago", "transferencia")
+
+# Notices that mention money but are not a transaction to record
+NOT_TRANSACTION = (
+    "no se completó", "vuelve a intentar", "rechazad", "declinad",
+    "código de verificación", "clave dinámica", "extracto", "promoción", "oferta", "newsletter", "suscripción",
+)
+
+AMOUNT_RE = re.compile(r"(?:\$|COP)\s?\d", re.IGNORECASE)
+
+def _header(email_data: Dict, name: str) -> str:
+    for h in email_data.get('payload', {}).get('headers', []):
+        if h['name'].lower() == name.lower():
+            return h['value']
+    return ""
+
+def detect_bank(email_data: Dict, text: str = None) -> Optional[str]:
+    """Bank that sent (or, for forwards, originally sent) the email, from the From header or the text."""
+    from_header = _header(email_data, 'From').lower()
+    if text is None:
+        text = (_header(email_data, 'Subject') + " " + html.unescape(email_data.get('snippet', ''))).lower()
+    for bank, signature in SIGNATURES.items():
+        if any(s in from_header for s in signature["senders"]):
+            return bank
+    for bank, signature in SIGNATURES.items():
+        if any(d in text for d in signature["domains"]):
+            return bank
+    return None
+
+class RelevanceGate:
+    """
+    Cheap check, on headers and snippet only, of whether an email is a transaction notice.
+    Runs before the body is downloaded and parsed. Rejected emails are not marked processed, so they stay
+    unread for the user; the ETL loop records them in the ledger so they are checked (and counted) once.
+    Keeps counters of what it let through and why, to see how much parse/LLM work it saves.
+    """
+    def __init__(self, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else os.getenv("EMAIL_RELEVANCE_GATE", "true").lower() != "false"
+        self.counters = Counter()
+
+    def classify(self, email_data: Dict) -> Tuple[bool, str]:
+        """(is a transaction notice, reason). Pure: safe to call from the Gmail worker threads."""
+        if not self.enabled:
+            return True, "disabled"
+        text = (_header(email_data, 'Subject') + " " + html.unescape(email_data.get('snippet', ''))).lower()
+        bank = detect_bank(email_data, text)
+
+        # A bank's own transaction phrase wins over promo/notice wording in the same snippet
+        if bank and any(kw in text for kw in SIGNATURES[bank]["keywords"]):
+            return True, f"signature:{bank}"
+        for phrase in NOT_TRANSACTION:
+            if phrase in text:
+                return False, f"notice:{phrase}"
+        if not bank and any(kw in text for kw in GENERIC_KEYWORDS):
+            return True, "signature:generic"
+        # No known phrase, but it mentions an amount: let the parser decide
+        if AMOUNT_RE.search(text):
+            return True, "amount"
+        # Forwarded from a bank: the snippet may be just the forward header
+        if bank and not any(s in _header(email_data, 'From').lower() for s in SIGNATURES[bank]["senders"]):
+            return True, f"forwarded:{bank}"
+        return False, "no_signal"
+
+    def wants_body(self, email_data: Dict) -> bool:
+        """For the two-phase fetch: only transaction notices get their body downloaded."""
+        return self.classify(email_data)[0]
+
+    def admit(self, email_data: Dict) -> bool:
+        """classify() plus counting. Call once per email, on the event loop."""
+        relevant, reason = self.classify(email_data)
+        self.counters["checked"] += 1
+        self.counters["passed" if relevant else "rejected"] += 1
+        self.counters[reason] += 1
+        if not relevant:
+            logger.info(f"Email {email_data.get('id')} is not a transaction notice ({reason}). Left unprocessed.")
+        return relevant
+
+    def stats(self) -> Dict[str, int]:
+        """Counters; 'rejected' is the number of parses (and possible LLM calls) skipped."""
+        return dict(self.counters)
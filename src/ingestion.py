@@ -1,10 +1,17 @@
 import os
 import os.path
-from typing import List, Dict, Optional, Tuple
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Dict, Optional, Set, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import base64
 from email.mime.text import MIMEText
 import logging
@@ -22,17 +29,181 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
+# Partial responses for the two-phase message fetch
+METADATA_HEADERS = ['From', 'Subject']
+METADATA_FIELDS = 'id,snippet,payload/headers'
+# The fields mask cannot pick one element of `parts`, and inline text parts have no attachmentId to fetch
+# them on their own, so every top-level part's data comes back; _extract_body keeps text/plain over text/html.
+BODY_FIELDS = 'payload(mimeType,body/data,parts(mimeType,body/data))'
+
 class TokenExpiredError(Exception):
     """Raised when the OAuth token is invalid/expired and cannot be refreshed automatically."""
     pass
 
+def _extract_body(payload: Dict) -> str:
+    """Decodes the message body, preferring the text/plain part over text/html."""
+    body = ""
+    found_plain_text = False
+    
+    if 'parts' in payload:
+        # First pass: Look for text/plain
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                 data = part['body'].get('data')
+                 if data:
+                    body = base64.urlsafe_b64decode(data).decode()
+                    found_plain_text = True
+                    break # precise hit
+        
+        # Second pass: If no plain text, look for HTML (and maybe strip it later?)
+        if not found_plain_text:
+            for part in payload['parts']:
+                if part['mimeType'] == 'text/html':
+                     data = part['body'].get('data')
+                     if data:
+                        body = base64.urlsafe_b64decode(data).decode()
+                        # TODO: Consider stripping HTML tags if regex fails often
+                        break
+                        
+    elif 'body' in payload:
+         data = payload['body'].get('data')
+         if data:
+            body = base64.urlsafe_b64decode(data).decode()
+
+    return body
+
+class ProcessedMarker:
+    """
+    Collects processed message IDs and marks them in bulk with users.messages.batchModify
+    (up to 1000 IDs per call), `window` seconds after the first one or on flush()/shutdown.
+    Marks by removing UNREAD, or by adding a dedicated label when `label_name` is set.
+    Timed flushes run on one long-lived thread (so one Gmail service is reused). IDs whose call fails are
+    retried on later flushes, up to `max_attempts` times, then dropped (e.g. a deleted message).
+    """
+    MAX_IDS = 1000
+
+    def __init__(self, gmail: 'GmailClient', window: float = 5.0, label_name: Optional[str] = None, max_attempts: int = 5):
+        self.gmail = gmail
+        self.window = window
+        self.label_name = label_name
+        self.max_attempts = max_attempts
+        self._label_id: Optional[str] = None
+        self._pending: List[str] = []
+        self._attempts: Dict[str, int] = {} # Failed calls so far, per ID
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def query_filter(self) -> str:
+        """Search clause selecting messages not processed yet."""
+        if self.label_name:
+            # Gmail search writes '/' and spaces in label names as '-'
+            return "-label:" + self.label_name.lower().replace('/', '-').replace(' ', '-')
+        return "is:unread"
+
+    def add(self, message_id: str):
+        with self._lock:
+            if message_id not in self._pending:
+                self._pending.append(message_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gmail-marker", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        """Flushes `window` seconds after IDs start arriving."""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.window)
+            self.flush()
+
+    def pending(self) -> Set[str]:
+        with self._lock:
+            return set(self._pending)
+
+    def flush(self):
+        """Marks every pending ID now. IDs whose call fails are queued again for a later flush, up to max_attempts."""
+        with self._flush_lock:
+            with self._lock:
+                ids = self._pending
+                self._pending = []
+
+            failed = []
+            for start in range(0, len(ids), self.MAX_IDS):
+                chunk = ids[start:start + self.MAX_IDS]
+                try:
+                    self.gmail.service.users().messages().batchModify(userId='me', body=self._modify_body(chunk)).execute()
+                    logger.info(f"Marked {len(chunk)} messages as processed.")
+                    for message_id in chunk:
+                        self._attempts.pop(message_id, None)
+                except Exception as e:
+                    logger.error(f"Failed to mark {len(chunk)} messages as processed: {e}")
+                    failed.extend(chunk)
+
+            retry = []
+            for message_id in failed:
+                self._attempts[message_id] = self._attempts.get(message_id, 0) + 1
+                if self._attempts[message_id] >= self.max_attempts:
+                    del self._attempts[message_id]
+                    logger.error(f"Giving up marking message {message_id} as processed after {self.max_attempts} attempts.")
+                else:
+                    retry.append(message_id)
+
+        for message_id in retry:
+            self.add(message_id)
+
+    def _modify_body(self, ids: List[str]) -> Dict:
+        if self.label_name:
+            return {'ids': ids, 'addLabelIds': [self._processed_label_id()]}
+        return {'ids': ids, 'removeLabelIds': ['UNREAD']}
+
+    def _processed_label_id(self) -> str:
+        """Looks up (or creates) the processed label once."""
+        if self._label_id is None:
+            labels = self.gmail.service.users().labels()
+            existing = labels.list(userId='me').execute().get('labels', [])
+            match = next((l for l in existing if l['name'] == self.label_name), None)
+            if match is None:
+                logger.info(f"Creating Gmail label '{self.label_name}'...")
+                match = labels.create(userId='me', body={
+                    'name': self.label_name,
+                    'labelListVisibility': 'labelShow',
+                    'messageListVisibility': 'show'
+                }).execute()
+            self._label_id = match['id']
+        return self._label_id
+
 class GmailClient:
-    def __init__(self, credentials_path: str = 'credentials.json', token_path: str = 'token.json', interactive: bool = False):
+    def __init__(self, credentials_path: str = 'credentials.json', token_path: str = 'token.json', interactive: bool = False, history_path: str = None):
         self.credentials_path = credentials_path
         self.token_path = token_path
         self.interactive = interactive
         self.creds = None
+        self._local = threading.local()
         self.service = None
+
+        # Incremental sync: last seen mailbox historyId, persisted across restarts
+        self.history_path = history_path or os.getenv("GMAIL_HISTORY_PATH", "gmail_history.json")
+        self.history_id: Optional[str] = self._load_history_id()
+        # Backstop full list (picks up unread mail left behind, e.g. after a failed save)
+        self.full_sync_interval = float(os.getenv("GMAIL_FULL_SYNC_SECONDS", "3600"))
+        self._last_full_sync = time.time() if self.history_id else 0.0
+
+        # Backlog fetches: IDs listed per page, message gets per batch HTTP request (Gmail caps batches at 100)
+        self.page_size = int(os.getenv("GMAIL_PAGE_SIZE", "100"))
+        self.batch_size = min(int(os.getenv("GMAIL_BATCH_SIZE", "100")), 100)
+
+        # Processed emails are marked in bulk (UNREAD removed, or GMAIL_PROCESSED_LABEL added)
+        self.processed = ProcessedMarker(
+            self,
+            window=float(os.getenv("GMAIL_MARK_WINDOW", "5")),
+            label_name=os.getenv("GMAIL_PROCESSED_LABEL") or None,
+            max_attempts=int(os.getenv("GMAIL_MARK_MAX_ATTEMPTS", "5"))
+        )
+
         self._authenticate()
 
     def _authenticate(self):
@@ -76,8 +247,39 @@ class GmailClient:
 
         self.service = build('gmail', 'v1', credentials=self.creds)
 
-    def fetch_unread_emails(self, sender: Optional[str] = None, max_results: int = 1, custom_query: str = None) -> List[Dict]:
-        """Fetches unread emails. Defaults to just 1 (the latest)."""
+    @property
+    def service(self):
+        """Gmail API service for the calling thread. httplib2 is not thread-safe, so each worker thread builds its own."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            if self.creds:
+                service = build('gmail', 'v1', credentials=self.creds, cache_discovery=False)
+            else:
+                service = self._default_service
+            self._local.service = service
+        return service
+
+    @service.setter
+    def service(self, value):
+        self._local.service = value
+        self._default_service = value
+
+    def _load_history_id(self) -> Optional[str]:
+        try:
+            with open(self.history_path) as f:
+                return json.load(f).get("history_id")
+        except (OSError, ValueError):
+            return None
+
+    def _save_history_id(self, history_id: str):
+        self.history_id = str(history_id)
+        try:
+            with open(self.history_path, 'w') as f:
+                json.dump({"history_id": self.history_id}, f)
+        except OSError as e:
+            logger.warning(f"Could not persist Gmail historyId: {e}")
+
+    def _build_query(self, sender: Optional[str], custom_query: Optional[str]) -> str:
         query = custom_query if custom_query else 'is:unread newer_than:1d'
         if sender:
             # Handle comma-separated senders robustly
@@ -88,63 +290,173 @@ class GmailClient:
                 query += f' from:({or_query})'
             else:
                 query += f' from:{senders[0]}'
+        return query
+
+    def _history_added_ids(self) -> Optional[Set[str]]:
+        """
+        IDs of messages added since the stored historyId (following nextPageToken).
+        Returns None if the history window has expired (404) and a full list is needed.
+        """
+        added = set()
+        page_token = None
+        while True:
+            try:
+                response = self.service.users().history().list(
+                    userId='me',
+                    startHistoryId=self.history_id,
+                    historyTypes=['messageAdded'],
+                    pageToken=page_token
+                ).execute()
+            except HttpError as e:
+                if e.resp.status == 404:
+                    logger.warning(f"Gmail historyId {self.history_id} expired. Falling back to a full list.")
+                    return None
+                raise
+
+            for record in response.get('history', []):
+                for added_msg in record.get('messagesAdded', []):
+                    added.add(added_msg['message']['id'])
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                if response.get('historyId'):
+                    self._save_history_id(response['historyId'])
+                return added
+
+    def fetch_new_emails(self, sender: Optional[str] = None, custom_query: str = None, max_results: Optional[int] = None, wants_body: Callable[[Dict], bool] = None) -> List[Dict]:
+        """
+        Incremental version of fetch_unread_emails: only messages added since the last call are considered.
+        Idle polls cost a single history.list request. A full list runs on the first sync, when the history
+        window has expired, and every `full_sync_interval` seconds as a backstop.
+        """
+        return self.get_messages(self.new_message_ids(sender=sender, custom_query=custom_query, max_results=max_results), wants_body=wants_body)
+
+    def new_message_ids(self, sender: Optional[str] = None, custom_query: str = None, max_results: Optional[int] = None) -> List[str]:
+        """IDs fetch_new_emails would fetch (see there). Messages already queued as processed are left out."""
+        pending = self.processed.pending()
+        return [m for m in self._new_message_ids(sender, custom_query, max_results) if m not in pending]
+
+    def _new_message_ids(self, sender: Optional[str], custom_query: Optional[str], max_results: Optional[int]) -> List[str]:
+        query = self._build_query(sender, custom_query)
+
+        if self.history_id and time.time() - self._last_full_sync < self.full_sync_interval:
+            added = self._history_added_ids()
+            if added is not None:
+                if not added:
+                    logger.info('No new messages.')
+                    return []
+                # New messages still have to match the query (senders, unread). The list is ordered by
+                # internalDate, so a new message with an older date (delayed, imported) can sit on a later page.
+                matching = [m['id'] for m in self._list_messages(query, max_results, wanted=added) if m['id'] in added]
+                logger.info(f"History sync: {len(added)} added, {len(matching)} matching.")
+                return matching
+
+        # Full list. Take the historyId first so nothing added meanwhile is lost.
+        history_id = self.service.users().getProfile(userId='me').execute().get('historyId')
+        logger.info(f"Full sync with query: {query}")
+        message_ids = [m['id'] for m in self._list_messages(query, max_results)]
+        if history_id:
+            self._save_history_id(history_id)
+        self._last_full_sync = time.time()
+        return message_ids
+
+    def _list_messages(self, query: str, max_results: Optional[int] = None, wanted: Set[str] = None) -> List[Dict]:
+        """
+        Lists matching message IDs page by page (GMAIL_PAGE_SIZE per page), up to `max_results` (None = all).
+        With `wanted`, stops as soon as every one of those IDs has been listed.
+        """
+        messages = []
+        unseen = set(wanted) if wanted is not None else None
+        page_token = None
+        while True:
+            page_size = self.page_size if max_results is None else min(self.page_size, max_results - len(messages))
+            results = self.service.users().messages().list(userId='me', q=query, maxResults=page_size, pageToken=page_token).execute()
+            page = results.get('messages', [])
+            messages.extend(page)
+            if unseen is not None:
+                unseen.difference_update(m['id'] for m in page)
+                if not unseen:
+                    return messages
+            page_token = results.get('nextPageToken')
+            if not page_token or (max_results is not None and len(messages) >= max_results):
+                return messages
+
+    def fetch_unread_emails(self, sender: Optional[str] = None, max_results: Optional[int] = None, custom_query: str = None) -> List[Dict]:
+        """Fetches unread emails, newest first. Defaults to the whole backlog matching the query."""
+        query = self._build_query(sender, custom_query)
         
-        logger.info(f"Fetching latest {max_results} emails with query: {query}")
-        results = self.service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-        messages = results.get('messages', [])
-        
-        email_data = []
+        logger.info(f"Fetching {max_results or 'all'} emails with query: {query}")
+        messages = self._list_messages(query, max_results)
 
         if not messages:
             logger.info('No new messages.')
             return []
 
-        for message in messages:
-            msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-            
-            # simplified parsing for now, focus on body and snippet
-            payload = msg['payload']
-            headers = payload.get("headers")
-            snippet = msg.get("snippet")
-            
-            body = ""
-            found_plain_text = False
-            
-            if 'parts' in payload:
-                # First pass: Look for text/plain
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                         data = part['body'].get('data')
-                         if data:
-                            body = base64.urlsafe_b64decode(data).decode()
-                            found_plain_text = True
-                            break # precise hit
-                
-                # Second pass: If no plain text, look for HTML (and maybe strip it later?)
-                if not found_plain_text:
-                    for part in payload['parts']:
-                        if part['mimeType'] == 'text/html':
-                             data = part['body'].get('data')
-                             if data:
-                                body = base64.urlsafe_b64decode(data).decode()
-                                # TODO: Consider stripping HTML tags if regex fails often
-                                break
-                                
-            elif 'body' in payload:
-                 data = payload['body'].get('data')
-                 if data:
-                    body = base64.urlsafe_b64decode(data).decode()
-
-            email_data.append({
-                'id': message['id'],
-                'snippet': snippet,
-                'body': body,
-                'payload': payload # Keep full payload for deeper inspection if needed
-            })
-            
+        email_data = self.get_messages([message['id'] for message in messages])
         logger.info(f"Fetched {len(email_data)} emails.")
         return email_data
 
+    def _batch_get(self, message_ids: List[str], handle, **get_kwargs):
+        """
+        Runs messages.get for `message_ids` through the batch endpoint (up to GMAIL_BATCH_SIZE gets per
+        HTTP request, max 100), calling handle(message_id, response) for each success.
+        Failures are logged and skipped; the message is still unread, so a later sync picks it up.
+        """
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Failed to fetch message {request_id}: {exception}")
+            else:
+                handle(request_id, response)
+
+        for start in range(0, len(message_ids), self.batch_size):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for message_id in message_ids[start:start + self.batch_size]:
+                batch.add(self.service.users().messages().get(userId='me', id=message_id, **get_kwargs), request_id=message_id)
+            batch.execute()
+
+    def get_messages(self, message_ids: List[str], wants_body: Callable[[Dict], bool] = None) -> List[Dict]:
+        """
+        Two-phase fetch. Phase 1 gets only From/Subject + snippet (format=metadata with a fields mask),
+        enough to route and pre-filter. Phase 2 downloads the top-level body parts (data and mimeType only),
+        and only for the messages `wants_body` accepts (all by default). Skipped messages come back with an empty body.
+        """
+        results: Dict[str, Dict] = {}
+
+        def on_metadata(message_id, msg):
+            results[message_id] = self._to_email_data(msg)
+
+        self._batch_get(message_ids, on_metadata, format='metadata', metadataHeaders=METADATA_HEADERS, fields=METADATA_FIELDS)
+
+        body_ids = [m for m in message_ids if m in results and (wants_body is None or wants_body(results[m]))]
+
+        def on_body(message_id, msg):
+            results[message_id]['body'] = _extract_body(msg.get('payload', {}))
+
+        self._batch_get(body_ids, on_body, format='full', fields=BODY_FIELDS)
+
+        return [results[message_id] for message_id in message_ids if message_id in results]
+
+    def _to_email_data(self, msg: Dict) -> Dict:
+        return {
+            'id': msg['id'],
+            'snippet': msg.get("snippet"),
+            'body': "",
+            # Only the routing headers (From/Subject) are kept, in the payload layout detect_original_source reads
+            'payload': {'headers': msg.get('payload', {}).get('headers', [])}
+        }
+
+    def watch(self, topic_name: str) -> Dict:
+        """
+        Registers a users.watch on the inbox so Gmail publishes new-mail notifications to the
+        Pub/Sub topic (pushed to /gmail/push). Watches expire after 7 days and must be renewed.
+        """
+        response = self.service.users().watch(
+            userId='me',
+            body={'topicName': topic_name, 'labelIds': ['INBOX'], 'labelFilterBehavior': 'INCLUDE'}
+        ).execute()
+        logger.info(f"Gmail watch registered on {topic_name} (historyId {response.get('historyId')}, expires {response.get('expiration')}).")
+        return response
+
     def mark_as_read(self, message_id: str):
         """Marks a message as read by removing the UNREAD label."""
         self.service.users().messages().modify(
@@ -154,6 +466,10 @@ class GmailClient:
         ).execute()
         logger.info(f"Marked message {message_id} as read.")
 
+    def mark_processed(self, message_id: str):
+        """Queues a message to be marked as processed in the next batchModify (see ProcessedMarker)."""
+        self.processed.add(message_id)
+
     def send_email(self, to: str, subject: str, message_text: str):
         """Sends an email using the Gmail API."""
         try:
@@ -170,6 +486,68 @@ class GmailClient:
         except Exception as e:
             logger.error(f"❌ Failed to send email to {to}: {e}")
 
+class AsyncGmailClient:
+    """
+    Async facade over GmailClient. Blocking Gmail calls run on a dedicated worker pool (one service
+    object per worker thread), so Gmail latency never stalls the Telegram bots or the webhook server.
+    Message gets are split into batches fetched in parallel, at most `max_concurrent_gets` at a time.
+    """
+    def __init__(self, gmail: GmailClient, max_workers: int = None, max_concurrent_gets: int = None):
+        self.gmail = gmail
+        self.max_workers = max_workers or int(os.getenv("GMAIL_MAX_WORKERS", "4"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gmail")
+        self.gets = asyncio.Semaphore(max_concurrent_gets or int(os.getenv("GMAIL_MAX_CONCURRENT_GETS", str(self.max_workers))))
+
+    @property
+    def creds(self):
+        return self.gmail.creds
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def fetch_new_emails(self, sender: Optional[str] = None, custom_query: str = None, max_results: Optional[int] = None, wants_body: Callable[[Dict], bool] = None) -> List[Dict]:
+        message_ids = await self.new_message_ids(sender=sender, custom_query=custom_query, max_results=max_results)
+        return await self.get_messages(message_ids, wants_body=wants_body)
+
+    async def new_message_ids(self, sender: Optional[str] = None, custom_query: str = None, max_results: Optional[int] = None) -> List[str]:
+        return await self._run(self.gmail.new_message_ids, sender=sender, custom_query=custom_query, max_results=max_results)
+
+    async def get_messages(self, message_ids: List[str], wants_body: Callable[[Dict], bool] = None) -> List[Dict]:
+        """Fetches messages in parallel batches, keeping the order of `message_ids`."""
+        # Small chunks so a backlog spreads over the workers; each chunk is one batch HTTP request
+        chunk_size = max(1, min(self.gmail.batch_size, -(-len(message_ids) // self.max_workers)))
+
+        async def get_chunk(chunk):
+            async with self.gets:
+                return await self._run(self.gmail.get_messages, chunk, wants_body=wants_body)
+
+        chunks = [message_ids[i:i + chunk_size] for i in range(0, len(message_ids), chunk_size)]
+        results = await asyncio.gather(*(get_chunk(chunk) for chunk in chunks))
+        return [email for chunk in results for email in chunk]
+
+    @property
+    def unprocessed_filter(self) -> str:
+        return self.gmail.processed.query_filter
+
+    async def mark_as_read(self, message_id: str):
+        await self._run(self.gmail.mark_as_read, message_id)
+
+    def mark_processed(self, message_id: str):
+        """Non-blocking: the ID is flushed with the next batchModify."""
+        self.gmail.mark_processed(message_id)
+
+    async def send_email(self, to: str, subject: str, message_text: str):
+        await self._run(self.gmail.send_email, to, subject, message_text)
+
+    async def watch(self, topic_name: str) -> Dict:
+        return await self._run(self.gmail.watch, topic_name)
+
+    def close(self):
+        """Marks any pending processed emails and releases the worker threads."""
+        self.gmail.processed.flush()
+        self.executor.shutdown(wait=False)
+
 def detect_original_source(email_data: Dict) -> Tuple[str, str, str]:
     """
     Analyzes the email to detect the original sender and the target user.
@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Email lifecycle: fetched -> prompted -> saved | skipped, or failed (retried later) -> gave_up once out of attempts
+FETCHED = "fetched"
+PROMPTED = "prompted"
+SAVED = "saved"
+SKIPPED = "skipped" # Unparseable, or ignored by the user
+REJECTED = "rejected" # Not a transaction notice (relevance gate); left unprocessed in Gmail
+FAILED = "failed"
+GAVE_UP = "gave_up" # Failed EMAIL_MAX_ATTEMPTS times; left unprocessed in Gmail for a human
+
+IN_FLIGHT = (FETCHED, PROMPTED, FAILED)
+
+class EmailLedger:
+    """
+    Durable record of every Gmail message the ETL loop has picked up, keyed by message ID.
+    Lets the loop skip known emails, resume in-flight ones after a restart without reparsing,
+    and report backlog counts per state.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("EMAIL_LEDGER_PATH", "autotrx_ledger.db")
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS emails (
+                    id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    snippet TEXT,
+                    target_user TEXT,
+                    chat_id_key TEXT,
+                    transaction_json TEXT, -- parsed transaction (set once parsed)
+                    splits_json TEXT, -- user's answer (set once answered)
+                    message_id INTEGER, -- Telegram prompt message
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_emails_state ON emails(state, updated_at);
+            """)
+
+    def state(self, email_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM emails WHERE id = ?", (email_id,)).fetchone()
+        return row["state"] if row else None
+
+    def claim(self, email_id: str, snippet: str = None) -> bool:
+        """Records a newly fetched email. Returns False if it was already known (nothing to do)."""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO emails (id, state, updated_at, snippet) VALUES (?, ?, ?, ?)",
+                (email_id, FETCHED, time.time(), snippet)
+            )
+        return cursor.rowcount == 1
+
+    def update(self, email_id: str, state: str, transaction: Dict = None, splits: list = None, error: str = None, **fields):
+        """Moves an email to `state`, storing whatever was learned at this step."""
+        values = dict(fields, state=state, updated_at=time.time())
+        if transaction is not None:
+            values["transaction_json"] = json.dumps(transaction, default=str)
+        if splits is not None:
+            values["splits_json"] = json.dumps(splits)
+        if error is not None:
+            values["error"] = error
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE emails SET {assignments}, attempts = attempts + ? WHERE id = ?",
+                              (*values.values(), 1 if state == FAILED else 0, email_id))
+
+    def give_up(self, max_attempts: int) -> List[str]:
+        """Parks failed emails that used up their attempts, so they are neither retried nor fetched again."""
+        with self.lock, self.conn:
+            rows = self.conn.execute("SELECT id FROM emails WHERE state = ? AND attempts >= ?", (FAILED, max_attempts)).fetchall()
+            self.conn.execute("UPDATE emails SET state = ?, updated_at = ? WHERE state = ? AND attempts >= ?",
+                              (GAVE_UP, time.time(), FAILED, max_attempts))
+        return [row["id"] for row in rows]
+
+    def in_flight(self, states=IN_FLIGHT, older_than: float = 0, max_attempts: int = None) -> List[Dict]:
+        """Emails not finished yet, oldest first, with their stored transaction/splits decoded."""
+        query = f"SELECT * FROM emails WHERE state IN ({', '.join('?' for _ in states)}) AND updated_at <= ?"
+        params = [*states, time.time() - older_than]
+        if max_attempts is not None:
+            query += " AND attempts < ?"
+            params.append(max_attempts)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY updated_at", params).fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            transaction_json = entry.pop("transaction_json")
+            splits_json = entry.pop("splits_json")
+            entry["transaction"] = json.loads(transaction_json) if transaction_json else None
+            entry["splits"] = [tuple(s) for s in json.loads(splits_json)] if splits_json else None
+            entries.append(entry)
+        return entries
+
+    def counts(self) -> Dict[str, int]:
+        """Backlog size per state."""
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM emails GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def prune(self, days: float = 30):
+        """Forgets finished emails older than `days` (Gmail queries only look back a few days)."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM emails WHERE state IN (?, ?, ?, ?) AND updated_at < ?", (SAVED, SKIPPED, REJECTED, GAVE_UP, time.time() - days * 86400))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
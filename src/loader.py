@@ -1,19 +1,278 @@
+import asyncio
 import gspread
 import os
-from typing import Dict, List
+import pandas as pd
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from gspread.utils import rowcol_to_a1
 from dotenv import load_dotenv
+from src.mirror import TransactionsMirror, records_digest
 
 from datetime import datetime, timedelta
 
 load_dotenv()
 
+def _period_start(day: datetime) -> datetime:
+    """Returns the start (the 25th, 00:00) of the 25th-to-25th period containing `day`."""
+    if day.day >= 25:
+        start = datetime(day.year, day.month, 25)
+    else:
+        # Go to first day of this month, then back one day to get prev month
+        last_of_prev = day.replace(day=1) - timedelta(days=1)
+        start = datetime(last_of_prev.year, last_of_prev.month, 25)
+    return start
+
+def _parse_sheet_date(value) -> Optional[datetime]:
+    """Parses the 'Fecha' cell ("DD/MM/YYYY[ HH:MM]" or "YYYY-MM-DD"). Returns None if unparseable."""
+    date_str = str(value or "").strip()
+    if not date_str:
+        return None
+    try:
+        return datetime.strptime(date_str.split(" ")[0], "%d/%m/%Y")
+    except ValueError:
+        try:
+            return datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            return None
+
+def _parse_amount(value) -> float:
+    """Parses the 'Monto' cell, tolerating '$' and thousands commas."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    amount_str = str(value).replace(',', '').replace('$', '').strip()
+    return float(amount_str) if amount_str else 0.0
+
+def _split_category(category: str) -> Tuple[str, str]:
+    """Splits "MainCategory - Subcategory" into its parts. Subcategory is "" if absent."""
+    if " - " in category:
+        main, sub = category.split(" - ", 1)
+        return main.strip(), sub.strip()
+    return category.strip(), ""
+
+# Columns each read path needs: name -> (accepted headers, match header by prefix)
+# Headers are compared stripped and lowercased.
+TRANSACTION_COLUMNS = {
+    "fecha": (("fecha", "date"), False),
+    "usuario": (("usuario",), False),
+    # Scope / Type headers may carry suffixes (e.g. "Scope (Familiar/Personal)")
+    "scope": (("scope",), True),
+    "tipo": (("tipo",), True),
+    "main": (("categoría principal", "categoría (principal)"), False),
+    "sub": (("subcategoría",), False),
+    "monto": (("monto",), False),
+}
+
+RECURRING_COLUMNS = {
+    "chat_id": (("chat id",), False),
+    "name": (("nombre gasto",), False),
+    "monto": (("monto",), False),
+    "category": (("categoría", "categoria"), False),
+    "scope": (("scope",), False),
+    "owner": (("dueño (user)", "dueño"), False),
+}
+
+def _resolve_columns(header: List[str], spec: Dict[str, tuple]) -> Dict[str, int]:
+    """Maps each wanted column name to its 1-based index in the header row (missing ones are left out)."""
+    normalized = [str(h).strip().lower() for h in header]
+    resolved = {}
+    for name, (aliases, by_prefix) in spec.items():
+        for alias in aliases:
+            matches = [i for i, h in enumerate(normalized) if (h.startswith(alias) if by_prefix else h == alias)]
+            if matches:
+                resolved[name] = matches[0] + 1
+                break
+    return resolved
+
+def _col_letter(col: int) -> str:
+    return rowcol_to_a1(1, col)[:-1]
+
+def _parse_amounts(values: pd.Series) -> pd.Series:
+    """Vectorized _parse_amount. Unparseable cells count as 0."""
+    cleaned = values.astype(str).str.replace(',', '', regex=False).str.replace('$', '', regex=False).str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").fillna(0.0)
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """Vectorized _parse_sheet_date. Unparseable cells become NaT."""
+    day_part = values.astype(str).str.strip().str.split(" ").str[0]
+    dates = pd.to_datetime(day_part, format="%d/%m/%Y", errors="coerce")
+    return dates.fillna(pd.to_datetime(day_part, format="%Y-%m-%d", errors="coerce"))
+
+def _period_starts(dates: pd.Series) -> pd.Series:
+    """Vectorized _period_start."""
+    months = dates.dt.year * 12 + (dates.dt.month - 1) - (dates.dt.day < 25).astype(int)
+    return pd.to_datetime(pd.DataFrame({"year": months // 12, "month": months % 12 + 1, "day": 25}))
+
+def _mirror_records(first_row: int, frame: pd.DataFrame) -> List[tuple]:
+    """Normalizes TRANSACTION_COLUMNS data (sheet reads or freshly written rows) into mirror records."""
+    dates = _parse_dates(frame["fecha"])
+    fecha_iso = dates.dt.strftime("%Y-%m-%d")
+    periods = _period_starts(dates).dt.strftime("%Y-%m-%d")
+    amounts = _parse_amounts(frame["monto"])
+    columns = zip(
+        frame["fecha"].astype(str), fecha_iso, periods,
+        frame["usuario"].astype(str).str.strip().str.lower(),
+        frame["scope"].astype(str), frame["tipo"].astype(str),
+        frame["main"].astype(str).str.strip(), frame["sub"].astype(str).str.strip(),
+        amounts
+    )
+    return [
+        (first_row + i, fecha, iso if isinstance(iso, str) else None, period if isinstance(period, str) else None,
+         usuario, scope, tipo, main, sub, float(monto))
+        for i, (fecha, iso, period, usuario, scope, tipo, main, sub, monto) in enumerate(columns)
+    ]
+
+def _aggregate_totals(frame: pd.DataFrame) -> Dict[tuple, float]:
+    """Builds the aggregate index from (main, sub, scope, tipo, user, period, monto) columns."""
+    totals = {}
+    # One groupby per wildcard combination (exact / any sub / any user / both)
+    for with_sub in (True, False):
+        for with_user in (True, False):
+            by = ["main"] + (["sub"] if with_sub else []) + ["scope", "tipo"] + (["user"] if with_user else []) + ["period"]
+            sums = frame.groupby(by, sort=False)["monto"].sum()
+            for key, total in sums.items():
+                parts = dict(zip(by, key))
+                index_key = (parts["main"], parts.get("sub"), parts["scope"], parts["tipo"], parts.get("user"), parts["period"].to_pydatetime())
+                totals[index_key] = float(total)
+    return totals
+
+class WriteCoordinator:
+    """
+    Single entry point for every write to Base_Transacciones (both bots, email tasks and /tasker).
+    Rows submitted within `window` seconds are coalesced into one flush, and flushes never overlap,
+    so reserving the target rows (cursor read + advance) is atomic across producers.
+    """
+    def __init__(self, write_rows, window: float = 0.5, on_written=None):
+        self.write_rows = write_rows # Callable[[List[list]], bool]
+        self.window = window
+        self.on_written = on_written # Callable[[List[list]], None], runs inside the flush lock
+        self.flush_lock = threading.Lock()
+        self._queue: List[Tuple[list, Future]] = []
+        self._queue_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, row: list) -> Future:
+        """Queues a row and returns a Future resolving to True/False once it is written."""
+        future = Future()
+        with self._queue_lock:
+            self._queue.append((row, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def submit_many(self, rows: List[list]) -> List[Future]:
+        """Queues rows together: they always land in the same flush, so they are written or fail as one."""
+        futures = [Future() for _ in rows]
+        with self._queue_lock:
+            self._queue.extend(zip(rows, futures))
+            if self._timer is None and rows:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return futures
+
+    def pending(self) -> int:
+        with self._queue_lock:
+            return len(self._queue)
+
+    def flush(self):
+        """Writes every queued row in one request and resolves their futures."""
+        with self.flush_lock:
+            with self._queue_lock:
+                batch = self._queue
+                self._queue = []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            if not batch:
+                return
+
+            rows = [row for row, _ in batch]
+            try:
+                success = self.write_rows(rows)
+                if success and self.on_written:
+                    self.on_written(rows)
+            except Exception as e:
+                print(f"Error flushing queued rows: {e}")
+                success = False
+
+        for _, future in batch:
+            future.set_result(success)
+
+class ReadCache:
+    """
+    Worksheet reads keyed by the spreadsheet revision (Drive modifiedTime).
+    An entry is served until the revision changes or our own writes invalidate the cache.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[tuple, Tuple[str, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, revision: Optional[str]) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if revision is not None and entry is not None and entry[0] == revision:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, revision: Optional[str], frame: pd.DataFrame):
+        if revision is None:
+            return
+        with self._lock:
+            self._entries[key] = (revision, frame)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
 class SheetsLoader:
-    def __init__(self, credentials_path: str = 'credentials.json', sheet_id: str = None, credentials=None):
+    def __init__(self, credentials_path: str = 'credentials.json', sheet_id: str = None, credentials=None, max_workers: int = None, mirror_path: str = None):
         self.credentials_path = credentials_path
         self.sheet_id = sheet_id or os.getenv("GOOGLE_SHEET_ID")
         self.client = None
         self.sheet = None
-        
+
+        # Bounded pool for blocking gspread reads issued from async code
+        self.max_workers = max_workers or int(os.getenv("SHEETS_MAX_WORKERS", "4"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sheets")
+
+        # Aggregate index for "acumulado" queries:
+        # (main, sub|None, scope, tipo, user|None, period_start) -> total. None keys are wildcards.
+        self._totals: Dict[tuple, float] = {}
+        self._index_loaded = False
+
+        # All writes go through the coordinator (batched, serialized)
+        self.writes = WriteCoordinator(
+            self._write_rows,
+            window=float(os.getenv("SHEETS_WRITE_WINDOW", "0.5")),
+            on_written=self._index_written_rows
+        )
+        # First free row in Base_Transacciones (None until scanned). Only touched inside writes.flush_lock.
+        self._next_row: Optional[int] = None
+
+        # Local SQLite mirror: read paths query it; Sheets is only asked for new rows (and a periodic checksum pass)
+        self.mirror = TransactionsMirror(mirror_path)
+        self.sync_interval = float(os.getenv("SHEETS_MIRROR_SYNC_SECONDS", "300"))
+        self.checksum_interval = float(os.getenv("SHEETS_MIRROR_CHECKSUM_SECONDS", str(6 * 3600)))
+        self.checksum_block = 500
+        self._last_sync = 0.0
+
+        # Column reads are reused while the spreadsheet revision stays the same
+        self.read_cache = ReadCache()
+
         if credentials:
             self.client = gspread.authorize(credentials)
         else:
@@ -28,8 +287,125 @@ class SheetsLoader:
              # We can't do much if no auth provided
              pass
 
-    def append_transaction(self, transaction: Dict, category: str, scope: str = "Personal", user_who_paid: str = "User", transaction_type: str = "Gasto") -> bool:
-        """Appends a row to the sheet. Returns True if successful, False otherwise."""
+    def _build_row(self, transaction: Dict, category: str, scope: str, user_who_paid: str, transaction_type: str) -> list:
+        """Builds the 9-column Base_Transacciones row for a transaction."""
+        # Parse Category/Subcategory
+        # Format expected: "MainCategory - Subcategory" or just "MainCategory"
+        main_category = category
+        subcategory = ""
+        
+        if " - " in category:
+            parts = category.split(" - ", 1)
+            main_category = parts[0]
+            subcategory = parts[1]
+
+        # Timestamp: We use the captured date as both 'Date' (YYYY-MM-DD or similar) and 'Timestamp' 
+        # Or we can generate a real insertion timestamp?
+        # User requested: [Fecha, Timestamp, Usuario, Scope, Categoría Principal, Subcategoría, Monto, Descripción]
+        # Let's assume 'date' from transaction is the main Date. 
+        # 'Timestamp' usually means precise insertion time or extraction time. 
+        # I will use current time for Timestamp, and transaction date for Date.
+        
+        # Timestamp: Allow override from transaction dict for historical loads
+        current_timestamp = transaction.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        tx_date = transaction.get("date")
+        description = transaction.get("merchant") # Maps to Description/Merchant
+        
+        # Row Schema: 
+        # 1. Fecha (Transaction Date)
+        # 2. Timestamp (Insertion Time)
+        # 3. Usuario (user_who_paid)
+        # 4. Scope
+        # 5. Tipo Movimiento (Transaction Type)
+        # 6. Categoría Principal
+        # 7. Subcategoría
+        # 8. Monto
+        # 9. Descripción
+        
+        return [
+            tx_date,
+            current_timestamp,
+            user_who_paid,
+            scope,
+            transaction_type,
+            main_category,
+            subcategory,
+            transaction.get("amount"),
+            description
+        ]
+
+    def queue_transaction(self, transaction: Dict, category: str, scope: str = "Personal", user_who_paid: str = "User", transaction_type: str = "Gasto") -> Future:
+        """
+        Queues a row on the write coordinator and returns a Future resolving to True/False.
+        Rows queued within the write window are written together in a single Sheets request.
+        """
+        return self.writes.submit(self._build_row(transaction, category, scope, user_who_paid, transaction_type))
+
+    async def append(self, transaction: Dict, category: str, scope: str = "Personal", user_who_paid: str = "User", transaction_type: str = "Gasto") -> bool:
+        """Awaitable append. Concurrent callers share batched, serialized writes."""
+        return await asyncio.wrap_future(self.queue_transaction(transaction, category, scope=scope, user_who_paid=user_who_paid, transaction_type=transaction_type))
+
+    async def append_many(self, entries: List[Tuple[Dict, str, str, str, str]]) -> List[bool]:
+        """
+        Writes several transactions in a single Sheets request: all of them are saved, or none.
+        `entries` are (transaction, category, scope, user_who_paid, transaction_type) tuples.
+        """
+        futures = self.writes.submit_many([self._build_row(*entry) for entry in entries])
+        await self._run_blocking(self.flush_writes)
+        return [await asyncio.wrap_future(future) for future in futures]
+
+    def flush_writes(self):
+        """Writes out any queued rows now."""
+        self.writes.flush()
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Runs a blocking gspread call on the loader's executor so the event loop stays free."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def accumulated(self, category_name: str, scope: str, transaction_type: str, user: str = None) -> float:
+        """Async get_accumulated_total (the first call may load the index from Sheets)."""
+        return await self._run_blocking(self.get_accumulated_total, category_name, scope, transaction_type, user=user)
+
+    async def recurring_expenses(self) -> Dict[int, List[Dict]]:
+        """Async get_recurring_expenses."""
+        return await self._run_blocking(self.get_recurring_expenses)
+
+    def close(self):
+        """Flushes pending writes and releases the worker threads."""
+        self.writes.flush()
+        self.executor.shutdown(wait=False)
+
+    def _mirror_written_rows(self, first_row: int, rows: List[list]):
+        """Copies rows we just wrote into the mirror (called inside writes.flush_lock)."""
+        try:
+            # Row schema: Fecha, Timestamp, Usuario, Scope, Tipo, Principal, Sub, Monto, Descripción
+            frame = pd.DataFrame({
+                "fecha": [r[0] for r in rows], "usuario": [r[2] for r in rows], "scope": [r[3] for r in rows],
+                "tipo": [r[4] for r in rows], "main": [r[5] for r in rows], "sub": [r[6] for r in rows],
+                "monto": [r[7] for r in rows],
+            }, dtype=object)
+            self.mirror.upsert_transactions(_mirror_records(first_row, frame))
+            # Only advance the sync mark if nothing is missing in between (e.g. rows typed by hand)
+            if self.mirror.last_row == first_row - 1:
+                self.mirror.last_row = first_row + len(rows) - 1
+        except Exception as e:
+            print(f"Error mirroring written rows: {e}")
+
+    def _index_written_rows(self, rows: List[list]):
+        """Adds freshly written rows to the aggregate index (if loaded)."""
+        if not self._index_loaded:
+            return
+        for row in rows:
+            try:
+                row_date = _parse_sheet_date(row[0])
+                if row_date:
+                    self._index_row(row_date, row[5], row[6], row[3], row[4], row[2], _parse_amount(row[7] or 0))
+            except Exception as e:
+                print(f"Could not index written row {row}: {e}")
+
+    def _write_rows(self, rows: List[list]) -> bool:
+        """Writes a block of rows right after the last used row of column A. Returns True if successful."""
         if not self.client:
              print("No gspread client. Skipping load.")
              return False
@@ -46,194 +422,232 @@ class SheetsLoader:
                     # Optional: Add headers if new? 
                     # For now, just create.
 
-            # Parse Category/Subcategory
-            # Format expected: "MainCategory - Subcategory" or just "MainCategory"
-            main_category = category
-            subcategory = ""
-            
-            if " - " in category:
-                parts = category.split(" - ", 1)
-                main_category = parts[0]
-                subcategory = parts[1]
-
-            # Timestamp: We use the captured date as both 'Date' (YYYY-MM-DD or similar) and 'Timestamp' 
-            # Or we can generate a real insertion timestamp?
-            # User requested: [Fecha, Timestamp, Usuario, Scope, Categoría Principal, Subcategoría, Monto, Descripción]
-            # Let's assume 'date' from transaction is the main Date. 
-            # 'Timestamp' usually means precise insertion time or extraction time. 
-            # I will use current time for Timestamp, and transaction date for Date.
+            next_row = self._reserve_rows(len(rows))
+            last_row = next_row + len(rows) - 1
             
-            from datetime import datetime
-            # Timestamp: Allow override from transaction dict for historical loads
-            current_timestamp = transaction.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            tx_date = transaction.get("date")
-            description = transaction.get("merchant") # Maps to Description/Merchant
-            
-            # Row Schema: 
-            # 1. Fecha (Transaction Date)
-            # 2. Timestamp (Insertion Time)
-            # 3. Usuario (user_who_paid)
-            # 4. Scope
-            # 5. Tipo Movimiento (Transaction Type)
-            # 6. Categoría Principal
-            # 7. Subcategoría
-            # 8. Monto
-            # 9. Descripción
-            
-            row = [
-                tx_date,
-                current_timestamp,
-                user_who_paid,
-                scope,
-                transaction_type,
-                main_category,
-                subcategory,
-                transaction.get("amount"),
-                description
-            ]
-            
-            # Find the actual last row of data in Column A to prevent issues with filters and ghost rows
-            col_a_values = self.sheet.col_values(1)
-            next_row = len(col_a_values) + 1
-            
-            # Ensure the sheet has enough rows to hold the new record
+            # Ensure the sheet has enough rows to hold the new records.
+            # Google won't auto-expand under an active filter, so we grow explicitly (geometrically).
             row_count = self.sheet.row_count
-            if next_row > row_count:
-                print(f"Row {next_row} exceeds grid limit {row_count}. Adding 100 rows explicitly...")
-                self.sheet.add_rows(100)
+            if last_row > row_count:
+                missing = max(last_row - row_count, row_count // 2, 100)
+                print(f"Row {last_row} exceeds grid limit {row_count}. Adding {missing} rows explicitly...")
+                self.sheet.add_rows(missing)
             
-            # Write row using update
-            self.sheet.update(range_name=f"A{next_row}:I{next_row}", values=[row], value_input_option='USER_ENTERED')
-            print(f"Successfully updated row {next_row}: {row}")
+            # Write the whole block using a single update
+            self.sheet.update(range_name=f"A{next_row}:I{last_row}", values=rows, value_input_option='USER_ENTERED')
+            print(f"Successfully updated rows {next_row}-{last_row}: {rows}")
+            self.read_cache.invalidate()
+            self._mirror_written_rows(next_row, rows)
             return True
             
         except Exception as e:
             print(f"Error appending to sheet: {e}")
+            # We don't know what landed; rescan column A and re-read on the next call
+            self._next_row = None
+            self.read_cache.invalidate()
+            return False
+
+    def _reserve_rows(self, count: int) -> int:
+        """
+        Reserves `count` rows right after the data in column A and returns the first one.
+        Must be called inside writes.flush_lock. Uses the cached cursor, revalidated with a single
+        2-cell read; rescans column A only when the cursor is unknown or stale (rows added/deleted by hand).
+        """
+        n = self._next_row
+        if n is not None and n > 1:
+            # The row above the cursor must hold data and the cursor row must be empty
+            values = self.sheet.get(f"A{n - 1}:A{n}")
+            cells = [row[0] if row else "" for row in values] + ["", ""]
+            if not (cells[0] != "" and cells[1] == ""):
+                print(f"Row cursor {n} is stale. Rescanning column A...")
+                n = None
+
+        if n is None or n <= 1:
+            # Find the actual last row of data in Column A to prevent issues with filters and ghost rows
+            col_a_values = self.sheet.col_values(1)
+            n = len(col_a_values) + 1
+
+        self._next_row = n + count
+        return n
+
+    def append_transaction(self, transaction: Dict, category: str, scope: str = "Personal", user_who_paid: str = "User", transaction_type: str = "Gasto") -> bool:
+        """Appends a row to the sheet (flushing any queued rows with it). Returns True if successful, False otherwise."""
+        future = self.queue_transaction(transaction, category, scope=scope, user_who_paid=user_who_paid, transaction_type=transaction_type)
+        self.flush_writes()
+        return future.result()
+
+    def _open_transactions_sheet(self) -> bool:
+        """Lazily opens 'Base_Transacciones' for read paths. Returns False if unavailable."""
+        if self.sheet:
+            return True
+        try:
+            if self.client:
+                sh = self.client.open_by_key(self.sheet_id)
+                self.sheet = sh.worksheet("Base_Transacciones")
+                return True
+        except Exception:
+            pass
+        return False
+
+    def _index_row(self, row_date: datetime, main_category: str, subcategory: str, scope: str, transaction_type: str, user: str, amount: float):
+        """Adds a single row to the aggregate index under its exact and wildcard keys."""
+        period = _period_start(row_date)
+        main_category = main_category.strip()
+        user_key = user.strip().lower()
+        for sub_key in (subcategory.strip(), None):
+            for u_key in (user_key, None):
+                key = (main_category, sub_key, scope, transaction_type, u_key, period)
+                self._totals[key] = self._totals.get(key, 0.0) + amount
+
+    def _load_index(self) -> bool:
+        """Builds the in-memory aggregate index from a single full read of the sheet."""
+        # Hold the write lock so no flush lands between the read and the rebuild
+        with self.writes.flush_lock:
+            return self._load_index_locked()
+
+    def _load_index_locked(self) -> bool:
+        synced = False
+        if self._open_transactions_sheet():
+            try:
+                self._sync_mirror_locked()
+                synced = True
+            except Exception as e:
+                print(f"Error syncing transactions mirror: {e}")
+
+        # Offline: fall back to whatever the mirror already holds
+        if not synced:
+            self._last_sync = time.time()
+        if not synced and self.mirror.last_row <= 1:
             return False
 
+        self._totals = _aggregate_totals(self.mirror.transactions_frame())
+        self._index_loaded = True
+        return True
+
+    def _sync_mirror_locked(self, full: bool = False) -> bool:
+        """
+        Brings the mirror up to date with Base_Transacciones. Must hold writes.flush_lock.
+        Fetches only rows after the last synced row; when `full` (or the checksum pass is due),
+        compares every block of rows by digest and rewrites the blocks edited by hand.
+        Returns True if the mirror changed.
+        """
+        now = time.time()
+        last_checksum = float(self.mirror.get_state("last_checksum", "0"))
+        if full or now - last_checksum >= self.checksum_interval:
+            changed = self._checksum_mirror_locked()
+            self.mirror.set_state("last_checksum", now)
+        else:
+            first_row = self.mirror.last_row + 1
+            records = _mirror_records(first_row, self._read_columns(self.sheet, TRANSACTION_COLUMNS, first_row=first_row))
+            if records:
+                self.mirror.upsert_transactions(records)
+                self.mirror.last_row = records[-1][0]
+            changed = bool(records)
+
+        self._last_sync = now
+        return changed
 
+    def _checksum_mirror_locked(self) -> bool:
+        records = _mirror_records(2, self._read_columns(self.sheet, TRANSACTION_COLUMNS))
+        last_row = len(records) + 1
+        changed = False
+
+        for start in range(0, len(records), self.checksum_block):
+            block = records[start:start + self.checksum_block]
+            first, last = block[0][0], block[-1][0]
+            if records_digest(block) != self.mirror.block_digest(first, last):
+                print(f"Mirror rows {first}-{last} differ from the sheet. Refreshing...")
+                self.mirror.replace_transactions(first, last, block)
+                changed = True
+
+        # Rows deleted from the bottom of the sheet
+        changed = changed or self.mirror.last_row > last_row
+        self.mirror.truncate_after(last_row)
+        self.mirror.last_row = last_row
+        return changed
+
+    def _refresh_if_due(self):
+        """Periodically pulls new/edited rows into the mirror and rebuilds the index if anything changed."""
+        if time.time() - self._last_sync < self.sync_interval:
+            return
+        with self.writes.flush_lock:
+            try:
+                if self._open_transactions_sheet() and self._sync_mirror_locked():
+                    self._totals = _aggregate_totals(self.mirror.transactions_frame())
+            except Exception as e:
+                print(f"Error syncing transactions mirror: {e}")
+                self._last_sync = time.time()
+
+    def _revision(self, ws) -> Optional[str]:
+        """Spreadsheet modifiedTime from Drive (one metadata call). None if it can't be read."""
+        try:
+            return ws.spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            print(f"Could not read spreadsheet revision: {e}")
+            return None
+
+    def _read_columns(self, ws, spec: Dict[str, tuple], first_row: int = 2) -> pd.DataFrame:
+        """
+        Reads only the columns in `spec` from `first_row` down with one batch_get.
+        The header is resolved to column indexes once per read. Missing columns come back as "".
+        Served from the read cache while the spreadsheet revision is unchanged.
+        """
+        revision = self._revision(ws)
+        key = (ws.title, first_row, tuple(spec))
+        cached = self.read_cache.get(key, revision)
+        if cached is not None:
+            return cached
+
+        frame = self._download_columns(ws, spec, first_row)
+        self.read_cache.put(key, revision, frame)
+        return frame
+
+    def _download_columns(self, ws, spec: Dict[str, tuple], first_row: int) -> pd.DataFrame:
+        columns = _resolve_columns(ws.row_values(1), spec)
+        names = list(columns)
+        ranges = [f"{_col_letter(columns[n])}{first_row}:{_col_letter(columns[n])}" for n in names]
+        results = ws.batch_get(ranges, major_dimension="COLUMNS") if ranges else []
+
+        data = {name: list(value_range[0]) if value_range else [] for name, value_range in zip(names, results)}
+        length = max((len(v) for v in data.values()), default=0)
+        return pd.DataFrame(
+            {name: data.get(name, []) + [""] * (length - len(data.get(name, []))) for name in spec},
+            dtype=object
+        )
+
+    def refresh_index(self) -> bool:
+        """Re-checks the whole sheet against the mirror and rebuilds the aggregate index (e.g. after manual edits)."""
+        with self.writes.flush_lock:
+            self.mirror.set_state("last_checksum", 0)
+            self._index_loaded = False
+            return self._load_index_locked()
 
     def get_accumulated_total(self, category_name: str, scope: str, transaction_type: str, user: str = None) -> float:
         """
         Calculates accumulated total for a category/scope/type since the 25th of current/prev month.
         If scope is 'Personal' and user is provided, filters by that user.
+        Served from the in-memory aggregate index, which is loaded once and kept up to date by append_transaction.
         """
-        if not self.sheet:
-             try:
-                 if self.client:
-                     sh = self.client.open_by_key(self.sheet_id)
-                     self.sheet = sh.worksheet("Base_Transacciones")
-                 else:
-                     return 0.0
-             except:
-                 return 0.0
-             
+        if not self._index_loaded:
+            if not self._load_index():
+                return 0.0
+        else:
+            self._refresh_if_due()
+
         try:
-            # 1. Determine Start Date
-            today = datetime.now()
-            if today.day >= 25:
-                start_date = datetime(today.year, today.month, 25)
+            query_main, query_sub = _split_category(category_name)
+            period = _period_start(datetime.now())
+            user_key = user.strip().lower() if (scope == "Personal" and user) else None
+
+            if query_sub:
+                # Exact match, plus rows that only carry the subcategory
+                total = self._totals.get((query_main, query_sub, scope, transaction_type, user_key, period), 0.0)
+                if query_main:
+                    total += self._totals.get(("", query_sub, scope, transaction_type, user_key, period), 0.0)
             else:
-                # Go to first day of this month, then back one day to get prev month
-                first_of_month = today.replace(day=1)
-                last_of_prev = first_of_month - timedelta(days=1)
-                start_date = datetime(last_of_prev.year, last_of_prev.month, 25)
-            
-            # Reset time to beginning of day
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            rows = self.sheet.get_all_records()
-            
-            total = 0.0
-            
-            for raw_row in rows:
-                try:
-                    # Normalize keys
-                    row = {k.strip().lower(): v for k, v in raw_row.items()}
-                    
-                    # Parse Date
-                    row_date_str = str(row.get("fecha") or row.get("date") or "").strip()
-                    if not row_date_str:
-                        continue
-                        
-                    try:
-                        if " " in row_date_str:
-                            row_date = datetime.strptime(row_date_str.split(" ")[0], "%d/%m/%Y")
-                        else:
-                            row_date = datetime.strptime(row_date_str, "%d/%m/%Y")
-                    except ValueError:
-                        try:
-                            row_date = datetime.strptime(row_date_str, "%Y-%m-%d")
-                        except:
-                             continue
-                    
-                    if row_date < start_date:
-                        continue
-                    
-                    # Parse Query Category
-                    query_main = category_name
-                    query_sub = ""
-                    if " - " in category_name:
-                        parts = category_name.split(" - ", 1)
-                        query_main = parts[0].strip()
-                        query_sub = parts[1].strip()
-                    else:
-                        query_main = category_name.strip()
-                    
-                    # Sheet Values
-                    sheet_main = str(row.get("categoría principal") or row.get("categoría (principal)") or "").strip()
-                    sheet_sub = str(row.get("subcategoría") or row.get("subcategoría ") or "").strip()
-                    
-                    # LOGIC: Matches
-                    match_cat = False
-                    if sheet_main == query_main and sheet_sub == query_sub:
-                        match_cat = True
-                    elif not sheet_main and sheet_sub == query_sub and query_sub:
-                         match_cat = True
-                    elif not query_sub and sheet_main == query_main:
-                         match_cat = True
-                         
-                    if not match_cat:
-                        continue
-                        
-                    # Scope
-                    scope_val = ""
-                    for k, v in row.items():
-                        if k.startswith("scope"):
-                            scope_val = str(v)
-                            break
-                    if scope_val != scope:
-                        continue
-                        
-                    # Type
-                    type_val = ""
-                    for k, v in row.items():
-                        if k.startswith("tipo"):
-                            type_val = str(v)
-                            break
-                    
-                    if type_val != transaction_type:
-                        continue
-
-                    # User Filter (NEW) based on Scope
-                    if scope == "Personal" and user:
-                        # Key: 'usuario', 'usuario '
-                        row_user = str(row.get("usuario") or row.get("usuario ") or "").strip()
-                        if row_user.lower() != user.lower():
-                            continue
-
-                    # Sum Amount
-                    amount_val = row.get("monto", 0)
-                    if isinstance(amount_val, (int, float)):
-                        total += float(amount_val)
-                    else:
-                        amount_str = str(amount_val).replace(',', '').replace('$', '').strip()
-                        if amount_str:
-                             total += float(amount_str)
-                    
-                except Exception as ex:
-                    continue
-                    
+                # Main category only: every subcategory counts
+                total = self._totals.get((query_main, None, scope, transaction_type, user_key, period), 0.0)
+
             return total
 
         except Exception as e:
@@ -242,11 +656,19 @@ class SheetsLoader:
 
     def get_recurring_expenses(self) -> Dict[int, List[Dict]]:
         """
-        Fetches recurring expenses configuration from 'Config_Fijos' sheet.
+        Returns the recurring expenses configuration from the mirror, refreshed from 'Config_Fijos' first.
+        If Sheets is unreachable, the last mirrored config is served.
         Returns a dict keyed by chat_id: {chat_id: [{name, amount, category, scope, owner}, ...]}
         """
+        recurring_map = self._fetch_recurring_expenses()
+        if recurring_map is not None:
+            self.mirror.replace_recurring(recurring_map)
+        return self.mirror.recurring()
+
+    def _fetch_recurring_expenses(self) -> Optional[Dict[int, List[Dict]]]:
+        """Reads 'Config_Fijos'. Returns None if it could not be read."""
         if not self.client:
-            return {}
+            return None
 
         try:
             if not self.sheet:
@@ -267,52 +689,38 @@ class SheetsLoader:
                 ws.append_row(["Chat ID", "Nombre Gasto", "Monto", "Categoría", "Scope", "Dueño (User)"], value_input_option='USER_ENTERED')
                 # Example
                 ws.append_row(["123456789", "Netflix", "50000", "Entretenimiento", "Personal", "Juanma"], value_input_option='USER_ENTERED')
+                self.read_cache.invalidate()
                 return {}
 
-            records = ws.get_all_records()
-            
+            frame = self._read_columns(ws, RECURRING_COLUMNS)
+
+            chat_id_str = frame["chat_id"].astype(str).str.strip()
+            chat_ids = pd.to_numeric(chat_id_str, errors="coerce")
+            invalid = chat_ids.isna() & (chat_id_str != "")
+            if invalid.any():
+                print(f"Skipping {int(invalid.sum())} invalid recurring rows: {frame[invalid].to_dict('records')}")
+
+            amounts = _parse_amounts(frame["monto"])
+            names = frame["name"].astype(str).str.strip()
+            categories = frame["category"].astype(str).str.strip()
+            scopes = frame["scope"].astype(str).str.strip().replace("", "Personal")
+            owners = frame["owner"].astype(str).str.strip().replace("", "User")
+
             recurring_map = {}
-            
-            for row in records:
-                try:
-                    # Clean keys
-                    r = {k.strip().lower(): v for k, v in row.items()}
-                    
-                    chat_id_val = str(r.get("chat id", "")).strip()
-                    if not chat_id_val: 
-                        continue
-                    
-                    chat_id = int(chat_id_val)
-                    
-                    # Parse Amount
-                    raw_amt = r.get("monto", 0)
-                    if isinstance(raw_amt, (int, float)):
-                        amount = float(raw_amt)
-                    else:
-                        amount = float(str(raw_amt).replace(',', '').replace('$', '').strip() or 0)
-
-                    item = {
-                        "name": str(r.get("nombre gasto") or "").strip(),
-                        "amount": amount,
-                        "category": str(r.get("categoría") or r.get("categoria") or "").strip(),
-                        "scope": str(r.get("scope") or "Personal").strip(),
-                        "owner": str(r.get("dueño (user)") or r.get("dueño") or "User").strip()
-                    }
-                    
-                    if chat_id not in recurring_map:
-                        recurring_map[chat_id] = []
-                    
-                    recurring_map[chat_id].append(item)
-                    
-                except Exception as ex:
-                    print(f"Skipping invalid recurring row: {row} - {ex}")
-                    continue
+            for i in frame.index[chat_ids.notna()]:
+                recurring_map.setdefault(int(chat_ids[i]), []).append({
+                    "name": names[i],
+                    "amount": float(amounts[i]),
+                    "category": categories[i],
+                    "scope": scopes[i],
+                    "owner": owners[i]
+                })
             
             return recurring_map
 
         except Exception as e:
             print(f"Error fetching recurring expenses: {e}")
-            return {}
+            return None
 
 if __name__ == "__main__":
     # Test
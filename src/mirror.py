@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import hashlib
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# (row, fecha, fecha_iso, period, usuario, scope, tipo, main, sub, monto)
+MirrorRecord = Tuple[int, str, Optional[str], Optional[str], str, str, str, str, str, float]
+
+def records_digest(records: List[MirrorRecord]) -> str:
+    """Stable digest of a block of mirror records (used to compare sheet blocks against the mirror)."""
+    h = hashlib.sha1()
+    for record in records:
+        h.update(repr(tuple(record)).encode("utf-8"))
+    return h.hexdigest()
+
+class TransactionsMirror:
+    """
+    Local SQLite mirror of Base_Transacciones and Config_Fijos, kept in sync by SheetsLoader.
+    Transactions are keyed by their sheet row number so deltas and manual edits are applied in place.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("SHEETS_MIRROR_PATH", "autotrx_mirror.db")
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS transactions (
+                    row INTEGER PRIMARY KEY,
+                    fecha TEXT,
+                    fecha_iso TEXT,
+                    period TEXT,
+                    usuario TEXT, -- stripped + lowercased
+                    scope TEXT,
+                    tipo TEXT,
+                    main TEXT,
+                    sub TEXT,
+                    monto REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_transactions_fecha ON transactions(fecha_iso);
+                CREATE INDEX IF NOT EXISTS idx_transactions_period ON transactions(period, scope, tipo);
+                CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions(main, sub);
+                CREATE INDEX IF NOT EXISTS idx_transactions_scope ON transactions(scope);
+                CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(usuario);
+
+                CREATE TABLE IF NOT EXISTS recurring (
+                    position INTEGER PRIMARY KEY,
+                    chat_id INTEGER,
+                    name TEXT,
+                    amount REAL,
+                    category TEXT,
+                    scope TEXT,
+                    owner TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_recurring_chat ON recurring(chat_id);
+
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+
+    # --- Sync bookkeeping ---
+
+    def get_state(self, key: str, default: str = None) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key: str, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def last_row(self) -> int:
+        """Last sheet row already mirrored (1 = only the header)."""
+        return int(self.get_state("last_row", "1"))
+
+    @last_row.setter
+    def last_row(self, value: int):
+        self.set_state("last_row", value)
+
+    # --- Transactions ---
+
+    def upsert_transactions(self, records: List[MirrorRecord]):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def replace_transactions(self, first_row: int, last_row: int, records: List[MirrorRecord]):
+        """Replaces rows first_row..last_row (inclusive) with `records`."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM transactions WHERE row BETWEEN ? AND ?", (first_row, last_row))
+            self.conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def truncate_after(self, row: int):
+        """Drops rows after `row` (rows deleted from the sheet)."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM transactions WHERE row > ?", (row,))
+
+    def block_digest(self, first_row: int, last_row: int) -> str:
+        with self.lock:
+            records = self.conn.execute(
+                "SELECT * FROM transactions WHERE row BETWEEN ? AND ? ORDER BY row", (first_row, last_row)
+            ).fetchall()
+        return records_digest(records)
+
+    def transactions_frame(self) -> pd.DataFrame:
+        """Dated transactions, in the column layout the aggregate index is built from."""
+        with self.lock:
+            return pd.read_sql_query(
+                "SELECT main, sub, scope, tipo, usuario AS user, period, monto FROM transactions WHERE period IS NOT NULL",
+                self.conn,
+                parse_dates=["period"]
+            )
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Read-only access for reports."""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # --- Recurring config ---
+
+    def replace_recurring(self, recurring_map: Dict[int, List[Dict]]):
+        rows = [
+            (chat_id, item["name"], item["amount"], item["category"], item["scope"], item["owner"])
+            for chat_id, items in recurring_map.items()
+            for item in items
+        ]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM recurring")
+            self.conn.executemany("INSERT INTO recurring (chat_id, name, amount, category, scope, owner) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def recurring(self) -> Dict[int, List[Dict]]:
+        with self.lock:
+            rows = self.conn.execute("SELECT chat_id, name, amount, category, scope, owner FROM recurring ORDER BY position").fetchall()
+        recurring_map = {}
+        for chat_id, name, amount, category, scope, owner in rows:
+            recurring_map.setdefault(chat_id, []).append({
+                "name": name,
+                "amount": amount,
+                "category": category,
+                "scope": scope,
+                "owner": owner
+            })
+        return recurring_map
@@ -1,5 +1,7 @@
+import asyncio
 import re
-from typing import Dict, Optional, Tuple
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 import os
 import json
@@ -9,8 +11,147 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+_HSPACE = re.compile(r"[^\S\n]+")
+_LINE_BREAKS = re.compile(r" ?\n\s*")
+
+def normalize_text(text: str) -> str:
+    """Collapses spaces/tabs/CR into one space and blank-line runs into one LF, so every pattern scans less."""
+    return _LINE_BREAKS.sub("\n", _HSPACE.sub(" ", text))
+
+def looks_like_html(text: str) -> bool:
+    lowered = text.lower() # Once, not per marker
+    return "<html" in lowered or "<div" in lowered or "body {" in lowered
+
+def amount_auto(raw: str) -> float:
+    """Guesses the separators (generic chain: the sender's format is unknown)."""
+    raw = raw.strip()
+    # Remove currency symbols or stray chars if any remain (regex handles most)
+    raw = re.sub(r'[^\d,\.]', '', raw)
+
+    # Heuristic: Detect separator
+    # Case 1: Both . and , exist (e.g. "18,400.00" or "1.200,50")
+    if '.' in raw and ',' in raw:
+        last_dot = raw.rfind('.')
+        last_comma = raw.rfind(',')
+        if last_dot > last_comma:
+            # US Format: 18,400.00 -> Remove commas
+            clean = raw.replace(',', '')
+        else:
+            # EU/Col Format: 1.200,50 -> Remove dots, swap comma
+            clean = raw.replace('.', '').replace(',', '.')
+    
+    # Case 2: Only one separator exists (e.g. "17.900" or "17,900" or "5000")
+    elif '.' in raw:
+        # Ambiguous: 17.900 (17k) vs 17.90 (17.9). 
+        # "17.900" is almost always 17k in this context: clean . if it looks like thousands
+        if len(raw.split('.')[-1]) == 3:
+             clean = raw.replace('.', '')
+        else:
+             clean = raw # preserve decimal? Risk.
+             # 17.900 -> 17900. 17.00 -> 17.00
+    elif ',' in raw:
+        # "17,900" -> 17900 or 17.9?
+        if len(raw.split(',')[-1]) == 3:
+            clean = raw.replace(',', '')
+        else:
+            clean = raw.replace(',', '.')
+    else:
+        clean = raw
+
+    try:
+        return float(clean)
+    except ValueError:
+        return 0.0
+
+_ES_CO_AMOUNT = re.compile(r"\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:,\d{1,2})?")
+
+def amount_es_co(raw: str) -> float:
+    """
+    Colombian format: '.' thousands, ',' decimals ("$1.567.244,00", "$3.650").
+    Any other layout ("$1,000.00") goes to amount_auto instead of being misread as 1.0.
+    """
+    digits = re.sub(r'[^\d,\.]', '', raw).strip('.,')
+    if not _ES_CO_AMOUNT.fullmatch(digits):
+        return amount_auto(digits)
+    return float(digits.replace('.', '').replace(',', '.'))
+
+def amount_two_decimals(raw: str) -> float:
+    """Either separator style, cents always written with two digits ("$17.600,00", "$18,400.00", "$5000")."""
+    digits = re.sub(r'[^\d,\.]', '', raw).strip('.,')
+    match = re.match(r'^(.*?)[\.,](\d{2})$', digits)
+    whole, cents = (match.group(1), match.group(2)) if match else (digits, "0")
+    try:
+        return float(re.sub(r'\D', '', whole) + "." + cents)
+    except ValueError:
+        return 0.0
+
+class ExtractionEngine:
+    """
+    Amount, merchant and date patterns compiled once (IGNORECASE), plus the rule that turns the amount into a number.
+    Merchant patterns keep their priority: the first pattern in the list that matches anywhere wins.
+    """
+    def __init__(self, amount_pattern: str, merchant_patterns: List[str], date_pattern: str, amount_rule: Callable[[str], float] = amount_auto):
+        self.amount_rule = amount_rule
+        self.amount_re = re.compile(amount_pattern, re.IGNORECASE)
+        self.merchant_res = [re.compile(p, re.IGNORECASE) for p in merchant_patterns]
+        self.date_re = re.compile(date_pattern, re.IGNORECASE)
+
+    def merchant(self, text: str) -> Optional[str]:
+        for pattern in self.merchant_res:
+            match = pattern.search(text)
+            if match:
+                return match.group(1).strip().upper()
+        return None
+
+class LLMCircuitBreaker:
+    """
+    Stops Gemini calls for a while after errors that would repeat on every email instead of retrying each time:
+    - quota (429): for the retry delay Gemini sends, at least LLM_QUOTA_COOLDOWN seconds
+    - model not found (404): LLM_NOT_FOUND_COOLDOWN seconds
+    - timeouts and other errors: LLM_QUOTA_COOLDOWN seconds after LLM_MAX_FAILURES in a row
+    """
+    def __init__(self, quota_cooldown: float = None, not_found_cooldown: float = None, max_failures: int = None):
+        self.quota_cooldown = quota_cooldown if quota_cooldown is not None else float(os.getenv("LLM_QUOTA_COOLDOWN", "60"))
+        self.not_found_cooldown = not_found_cooldown if not_found_cooldown is not None else float(os.getenv("LLM_NOT_FOUND_COOLDOWN", "3600"))
+        self.max_failures = max_failures or int(os.getenv("LLM_MAX_FAILURES", "3"))
+        self.open_until = 0.0
+        self.failures = 0 # In a row
+        self.reason = None
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def status(self) -> str:
+        remaining = self.open_until - time.monotonic()
+        return f"circuit open for {remaining:.0f}s more ({self.reason})" if remaining > 0 else "circuit closed"
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self, error: Exception):
+        code = getattr(error, "code", None)
+        message = str(error)
+        if code == 429 or "429" in message or "quota" in message.lower():
+            delay = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", message)
+            self._open(max(self.quota_cooldown, float(delay.group(1)) if delay else 0.0), "quota exceeded")
+        elif code == 404 or "404" in message:
+            self._open(self.not_found_cooldown, "model not found")
+        else:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self._open(self.quota_cooldown, f"{self.failures} failures in a row")
+
+    def _open(self, seconds: float, reason: str):
+        self.open_until = time.monotonic() + seconds
+        self.failures = 0
+        self.reason = reason
+        print(f"LLM circuit open for {seconds:.0f}s: {reason}")
+
 class TransactionParser:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, template_cache=None):
+        # src.template_cache.TemplateCache: LLM extractions replayed for emails with a known template (None: off)
+        self.template_cache = template_cache
+
         # Configure Gemini
         key = api_key or os.getenv("GEMINI_API_KEY")
         if key:
@@ -18,6 +159,13 @@ class TransactionParser:
             self.model = genai.GenerativeModel("gemini-flash-latest")
         else:
             self.model = None
+        self.llm_timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+        self.llm_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+        # Interactive parses (Tasker) get their own slots, so they never queue behind an email backfill
+        self.llm_interactive_concurrency = int(os.getenv("LLM_INTERACTIVE_CONCURRENCY", "1"))
+        self._llm_slots: Optional[asyncio.Semaphore] = None # Created on first use, in the running loop
+        self._llm_interactive_slots: Optional[asyncio.Semaphore] = None
+        self.breaker = LLMCircuitBreaker()
 
         # Regex patterns
         # 1. Amount: "$ 17.600,00" or "$17.600,00"
@@ -51,10 +199,98 @@ class TransactionParser:
         # Note: Time group 2 is now optional inside the first branch
         self.date_pattern = r"(?:(\d{2}/\d{2}/\d{4})(?:(?:\s+a\s+las\s+|\s+)(\d{2}:\d{2}))?)|(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})|(\d{4}/\d{2}/\d{2}(?:\s+\d{2}:\d{2}(?::\d{2})?)?)"
 
-    def parse(self, text: str) -> Dict:
-        """Parses the email body/snippet to extract transaction details."""
+        # 4. Bank-specific templates, keyed by the bank src.gate.detect_bank finds (From header or forwarded text).
+        # Each bank only runs its own merchant patterns and uses its own thousands-separator rule;
+        # the generic chain above is for unknown senders.
+        self.bank_templates: Dict[str, Dict] = {
+            "Bancolombia": {
+                "merchant_patterns": [
+                    r"a la llave\s+(@?[\w\d]+)", # QR and Transfers to Key
+                    r"Retiraste\s+[\d\.,\s\$]+en\s+(.*?)\s+de tu", # Withdrawals
+                    r"pago Factura Programada\s+(.*?)(?:\s+Ref|\s+por)", # Facturas Programadas
+                    r"\ben\s+([^.!?]*?)\s+(?:con|si tienes dudas)", # Compraste ... en MERCHANT con
+                    r"\ba\s+([^.!?]*?)\s*,?\s*el\s+(?:\d{2}/\d{2}/\d{4}|\d{4}/\d{2}/\d{2}|\d{2}/\d{2}|\d{4}-\d{2}-\d{2})", # Transfers 'a MERCHANT el'
+                ],
+                "amount_rule": amount_two_decimals, # "$17.600,00" and "$18,400.00" both occur
+            },
+            "Nubank": {
+                "merchant_patterns": [
+                    r"Le enviaste a\s+(.*?)(?:\s+en su cuenta|\s*$)", # Transfers (Old)
+                    r"Se los enviaste a\s+(.*?)(?:\s+por|\. Si no reconoces|\s+con\s+tu|\s+en\s+su\s+cuenta|\.|$)", # Transfers Sent
+                    r"El pago de.*?a\s+(.*?)\s+fue exitoso", # Bill Payments
+                    r"Pagaste en\s+(.*?)\s+con\s+(?:tu|su)\s+cuenta", # PSE / Approved Payments
+                ],
+                "amount_rule": amount_es_co,
+            },
+            "RappiCard": {
+                "merchant_patterns": [r"Comercio\s+(.*?)\s*\r?\n"],
+                "amount_rule": amount_es_co, # "$3.650"
+            },
+            "Glim": {
+                # "...tarjeta de beneficios Glim el\n27/06/2026\na las\n18:46\nen\nILLY." spans lines
+                "merchant_patterns": [r"(?s)tarjeta de beneficios Glim.*?\ben\s+(.*?)(?:\.|$)"],
+                "amount_rule": amount_es_co,
+            },
+        }
+
+        # 5. Merchant patterns induced from LLM results and promoted by the template cache, per bank (None: unknown senders).
+        # Tried last, only when every hand-written pattern missed.
+        self.induced_patterns: Dict[Optional[str], List[str]] = template_cache.promoted() if template_cache else {}
+
+        self.compile_patterns()
+
+    def compile_patterns(self):
+        """(Re)builds the compiled engines; call after changing the pattern attributes."""
+        self.engine = ExtractionEngine(self.amount_pattern, self.merchant_patterns, self.date_pattern)
+        self.bank_engines: Dict[str, ExtractionEngine] = {
+            bank: ExtractionEngine(t.get("amount_pattern", self.amount_pattern), t["merchant_patterns"], t.get("date_pattern", self.date_pattern), t["amount_rule"])
+            for bank, t in self.bank_templates.items()
+        }
+        self.induced_engines: Dict[Optional[str], ExtractionEngine] = {
+            bank: ExtractionEngine(self.amount_pattern, patterns, self.date_pattern)
+            for bank, patterns in self.induced_patterns.items()
+        }
+
+    def parse(self, text: str, bank: Optional[str] = None) -> Dict:
+        """
+        Parses the email body/snippet to extract transaction details.
+        `bank` (see src.gate.detect_bank) selects that bank's templates; unknown or None uses the generic chain.
+        """
+        text, regex_result, result = self._parse_local(text, bank)
+        if result:
+            return result
+
+        if self.model:
+            print("Regex failed to fully parse. Attempting fallback to Gemini...")
+            try:
+                return self._merge_llm_result(text, regex_result, self._parse_with_llm(text), bank)
+            except Exception as e:
+                print(f"LLM Fallback failed with exception: {e}")
+        
+        return regex_result
+
+    async def parse_async(self, text: str, bank: Optional[str] = None, interactive: bool = False) -> Dict:
+        """
+        parse() for callers on the event loop: the Gemini fallback is awaited (see _parse_with_llm_async)
+        instead of blocking every other task while it runs. `interactive` is for a user waiting on the answer.
+        """
+        text, regex_result, result = self._parse_local(text, bank)
+        if result:
+            return result
+
+        if self.model:
+            print("Regex failed to fully parse. Attempting fallback to Gemini...")
+            try:
+                return self._merge_llm_result(text, regex_result, await self._parse_with_llm_async(text, interactive=interactive), bank)
+            except Exception as e:
+                print(f"LLM Fallback failed with exception: {e}")
+
+        return regex_result
+
+    def _parse_local(self, text: str, bank: Optional[str] = None) -> Tuple[str, Dict, Optional[Dict]]:
+        """Everything before the LLM: (cleaned text, regex result, final result if regex or the template cache got one)."""
         # 0. Clean HTML if present
-        if text and ("<html" in text.lower() or "<div" in text.lower() or "body {" in text.lower()):
+        if text and looks_like_html(text):
             try:
                 soup = BeautifulSoup(text, "html.parser")
                 text = soup.get_text(separator="\n")
@@ -62,89 +298,52 @@ class TransactionParser:
                 print(f"HTML cleaning failed: {e}")
 
         # 1. Try Regex First (Fast & Free)
-        regex_result = self._parse_regex(text)
+        regex_result = self._parse_regex(text, bank)
         
         # Validation: If regex got a valid amount and merchant, return it
         if regex_result['amount'] > 0 and regex_result['merchant'] != "UNKNOWN":
-            return regex_result
+            return text, regex_result, regex_result
             
-        if self.model:
-            print("Regex failed to fully parse. Attempting fallback to Gemini...")
-            try:
-                llm_result = self._parse_with_llm(text)
-                if llm_result:
-                    print(f"LLM Success: {llm_result}")
-                    # Merge: use LLM values but keep original text
-                    llm_result['original_text'] = text
-                    return llm_result
-            except Exception as e:
-                print(f"LLM Fallback failed with exception: {e}")
-        
-        return regex_result
+        # 2. An email with a template the LLM already read: take the fields from the same places
+        if self.template_cache:
+            cached_result = self._parse_cached(text, bank)
+            if cached_result:
+                return text, regex_result, cached_result
+
+        return text, regex_result, None
 
-    def _parse_regex(self, text: str) -> Dict:
-        """Original Regex Logic"""
+    def _merge_llm_result(self, text: str, regex_result: Dict, llm_result: Optional[Dict], bank: Optional[str] = None) -> Dict:
+        if not llm_result:
+            return regex_result
+        print(f"LLM Success: {llm_result}")
+        if self.template_cache:
+            self._learn_template(text, regex_result, llm_result, bank)
+        # Merge: use LLM values but keep original text
+        llm_result['original_text'] = text
+        return llm_result
+
+    def _parse_regex(self, text: str, bank: Optional[str] = None) -> Dict:
+        """Original Regex Logic, on the bank's compiled engine (or the generic one)"""
+        original_text = text
+        # Normalize once (CRLF, runs of spaces and blank lines) instead of every pattern skipping them
+        text = normalize_text(text)
+        engine = self.bank_engines.get(bank, self.engine)
         
         # 1. Extract Amount
-        amount_match = re.search(self.amount_pattern, text, re.IGNORECASE)
+        amount_match = engine.amount_re.search(text)
         amount = 0.0
         if amount_match:
-            # Normalize amount string
-            raw = amount_match.group(1).strip()
-            # Remove currency symbols or stray chars if any remain (regex handles most)
-            raw = re.sub(r'[^\d,\.]', '', raw)
-
-            # Heuristic: Detect separator
-            # Case 1: Both . and , exist (e.g. "18,400.00" or "1.200,50")
-            if '.' in raw and ',' in raw:
-                last_dot = raw.rfind('.')
-                last_comma = raw.rfind(',')
-                if last_dot > last_comma:
-                    # US Format: 18,400.00 -> Remove commas
-                    clean = raw.replace(',', '')
-                else:
-                    # EU/Col Format: 1.200,50 -> Remove dots, swap comma
-                    clean = raw.replace('.', '').replace(',', '.')
-            
-            # Case 2: Only one separator exists (e.g. "17.900" or "17,900" or "5000")
-            elif '.' in raw:
-                # Ambiguous: 17.900 (17k) vs 17.90 (17.9). 
-                # Bancolombia usually sends 2 decimals for cents if it is a decimal.
-                # If 3 digits follow, it's likely thousands. 
-                # If 2 digits, it works as decimal or thousands (usually decimal in US, thousands in Col).
-                # Assumption: If string ends with .XX, treat as decimal? 
-                # Actually, "17.900" is almost always 17k in this context. 
-                # But "18.400.00" (handled above).
-                # Let's clean . if it looks like thousands
-                if len(raw.split('.')[-1]) == 3:
-                     clean = raw.replace('.', '')
-                else:
-                     clean = raw # preserve decimal? Risk.
-                     # 17.900 -> 17900. 17.00 -> 17.00
-            elif ',' in raw:
-                # "17,900" -> 17900 or 17.9?
-                if len(raw.split(',')[-1]) == 3:
-                    clean = raw.replace(',', '')
-                else:
-                    clean = raw.replace(',', '.')
-            else:
-                clean = raw
+            amount = engine.amount_rule(amount_match.group(1))
 
-            try:
-                amount = float(clean)
-            except:
-                pass
-
-        # 2. Extract Merchant (Try patterns)
-        merchant = "UNKNOWN"
-        for pattern in self.merchant_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                merchant = match.group(1).strip().upper()
-                break # Stop after first match
+        # 2. Extract Merchant (patterns in priority order)
+        # A known bank only runs its own patterns: a template they miss goes to the induced ones, then the LLM
+        merchant = engine.merchant(text)
+        if merchant is None and bank in self.induced_engines:
+            merchant = self.induced_engines[bank].merchant(text)
+        merchant = merchant or "UNKNOWN"
 
         # 3. Extract Date
-        date_match = re.search(self.date_pattern, text, re.IGNORECASE)
+        date_match = engine.date_re.search(text)
         date_str = ""
         if date_match:
             if date_match.group(1):
@@ -183,12 +382,51 @@ class TransactionParser:
             "amount": amount,
             "merchant": merchant,
             "description": merchant,
+            "original_text": original_text
+        }
+
+    def _parse_cached(self, text: str, bank: Optional[str] = None) -> Optional[Dict]:
+        """Replays a cached LLM extraction (see src.template_cache)."""
+        try:
+            fields = self.template_cache.lookup(text)
+        except Exception as e:
+            print(f"Template cache lookup failed: {e}")
+            return None
+        if not fields:
+            return None
+        amount = self.bank_engines.get(bank, self.engine).amount_rule(fields["amount"])
+        if amount <= 0 or not fields["merchant"]:
+            return None
+        print(f"Template cache hit: {fields}")
+        return {
+            "date": fields["date"] or datetime.now().strftime("%d/%m/%Y %H:%M"),
+            "amount": amount,
+            "merchant": fields["merchant"],
+            "description": fields["merchant"],
             "original_text": text
         }
 
-    def _parse_with_llm(self, text: str) -> Optional[Dict]:
-        """Uses Gemini to extract structured data."""
-        prompt = f"""
+    def _learn_template(self, text: str, regex_result: Dict, llm_result: Dict, bank: Optional[str] = None):
+        """
+        Remembers where the LLM found the fields, for the next emails with this template, and tries to induce a
+        merchant pattern from it. Induction only when the regex amount already agrees: with the pattern, the regex
+        stage alone then parses emails like this one.
+        """
+        try:
+            if self.template_cache.learn(text, llm_result, self.bank_engines.get(bank, self.engine).amount_rule, bank):
+                print("Template cached.")
+            self.template_cache.add_sample(text, llm_result['merchant'], bank)
+            if abs(regex_result['amount'] - llm_result['amount']) < 0.005:
+                pattern = self.template_cache.induce(text, llm_result['merchant'], bank)
+                if pattern:
+                    self.induced_patterns.setdefault(bank, []).append(pattern)
+                    self.compile_patterns()
+                    print(f"Promoted induced pattern for {bank or 'unknown senders'}: {pattern}")
+        except Exception as e:
+            print(f"Template cache update failed: {e}")
+
+    def _llm_prompt(self, text: str) -> str:
+        return f"""
         Extract transaction details from this email text into JSON format.
         Fields: 
         - amount (number, no strings)
@@ -199,10 +437,10 @@ class TransactionParser:
         
         Return ONLY valid JSON.
         """
+
+    def _llm_result(self, response) -> Optional[Dict]:
+        """The transaction in a Gemini response (None if it is not the JSON asked for)."""
         try:
-            # print("Calling Gemini generate_content...")
-            response = self.model.generate_content(prompt)
-            
             # Clean response (remove markdown ```json ... ```)
             raw_json = response.text.replace("```json", "").replace("```", "").strip()
             data = json.loads(raw_json)
@@ -213,9 +451,48 @@ class TransactionParser:
                 "merchant": str(data.get("merchant", "UNKNOWN")).upper(),
                 "description": str(data.get("merchant", "UNKNOWN")).upper(),
             }
+        except Exception as e:
+            print(f"Error reading the LLM response: {e}")
+            return None
+
+    def _parse_with_llm(self, text: str) -> Optional[Dict]:
+        """Uses Gemini to extract structured data. Blocks until Gemini answers; on the event loop use _parse_with_llm_async."""
+        if not self.breaker.allow():
+            print(f"LLM skipped: {self.breaker.status()}")
+            return None
+        try:
+            response = self.model.generate_content(self._llm_prompt(text), request_options={"timeout": self.llm_timeout})
         except Exception as e:
             print(f"Error inside _parse_with_llm: {e}")
+            self.breaker.record_failure(e)
             return None
+        self.breaker.record_success()
+        return self._llm_result(response)
+
+    async def _parse_with_llm_async(self, text: str, interactive: bool = False) -> Optional[Dict]:
+        """
+        _parse_with_llm without blocking the loop: at most LLM_MAX_CONCURRENCY calls at a time (plus
+        LLM_INTERACTIVE_CONCURRENCY for `interactive` ones), each cut off after LLM_TIMEOUT_SECONDS.
+        While the breaker is open it returns None at once (the regex result stands).
+        """
+        if not self.breaker.allow():
+            print(f"LLM skipped: {self.breaker.status()}")
+            return None
+        if self._llm_slots is None:
+            self._llm_slots = asyncio.Semaphore(self.llm_concurrency)
+            self._llm_interactive_slots = asyncio.Semaphore(self.llm_interactive_concurrency)
+        async with (self._llm_interactive_slots if interactive else self._llm_slots):
+            if not self.breaker.allow(): # Opened by a call this one was waiting behind
+                print(f"LLM skipped: {self.breaker.status()}")
+                return None
+            try:
+                response = await asyncio.wait_for(self.model.generate_content_async(self._llm_prompt(text)), timeout=self.llm_timeout)
+            except Exception as e:
+                print(f"Error inside _parse_with_llm_async: {type(e).__name__} {e}")
+                self.breaker.record_failure(e)
+                return None
+        self.breaker.record_success()
+        return self._llm_result(response)
 
 class Classifier:
     def __init__(self):
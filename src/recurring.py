@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from src.config import RECURRING_EXPENSES
+
+load_dotenv()
+
+def _config_digest(recurring_map: Dict[int, List[Dict]]) -> str:
+    """Content hash of a {chat_id: [items]} map (order of items matters, order of chats doesn't)."""
+    payload = json.dumps({str(k): v for k, v in recurring_map.items()}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def merge_recurring(static: Dict[int, List[Dict]], sheet: Dict[int, List[Dict]]) -> Dict[int, List[Dict]]:
+    """
+    Merges the static RECURRING_EXPENSES with 'Config_Fijos'.
+    Sheet rows override static ones with the same name (case-insensitive) for the same chat;
+    static items keep their position, new sheet items go after them.
+    """
+    merged = {}
+    for chat_id in list(static) + [c for c in sheet if c not in static]:
+        sheet_items = {item["name"].strip().lower(): item for item in sheet.get(chat_id, [])}
+        items = []
+        for item in static.get(chat_id, []):
+            items.append(dict(sheet_items.pop(item["name"].strip().lower(), item)))
+        items.extend(dict(item) for item in sheet_items.values())
+        if items:
+            merged[chat_id] = items
+    return merged
+
+class RecurringConfigProvider:
+    """
+    Per-chat recurring expenses for /fijos, merged from src/config.py and the sheet.
+    The merged map is cached for `ttl` seconds; after that it is still served immediately
+    while a background refresh re-reads the sheet. The map is only rebuilt when the
+    sheet content hash changes.
+    """
+    def __init__(self, loader=None, static: Dict[int, List[Dict]] = None, ttl: float = None):
+        self.loader = loader
+        self.static = RECURRING_EXPENSES if static is None else static
+        self.ttl = ttl if ttl is not None else float(os.getenv("RECURRING_CONFIG_TTL", "300"))
+
+        self._merged: Optional[Dict[int, List[Dict]]] = None
+        self._sheet_digest: Optional[str] = None
+        self._loaded_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, chat_id: int) -> List[Dict]:
+        """Recurring items for a chat. Only the very first call waits for the sheet."""
+        if self._merged is None:
+            await self.refresh()
+        elif time.time() - self._loaded_at >= self.ttl:
+            self._refresh_in_background()
+        return [item.copy() for item in self._merged.get(chat_id, [])]
+
+    def _refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def refresh(self) -> bool:
+        """Re-reads the sheet config. Returns True if the merged map changed."""
+        async with self._lock:
+            sheet_map = {}
+            if self.loader:
+                try:
+                    sheet_map = await self.loader.recurring_expenses()
+                except Exception as e:
+                    print(f"Error reading recurring config: {e}")
+                    if self._merged is not None:
+                        # Keep serving what we have; try again after another TTL
+                        self._loaded_at = time.time()
+                        return False
+
+            self._loaded_at = time.time()
+            digest = _config_digest(sheet_map)
+            if self._merged is not None and digest == self._sheet_digest:
+                return False
+
+            self._merged = merge_recurring(self.static, sheet_map)
+            self._sheet_digest = digest
+            print(f"Recurring config loaded ({sum(len(v) for v in self._merged.values())} items).")
+            return True
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from functools import partial
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable]
+
+# Lanes, highest priority first
+INTERACTIVE = "interactive" # /m and Tasker: a user is waiting
+EMAIL = "email" # Gmail alerts (and the backlog after a catch-up)
+BACKFILL = "backfill" # Historical imports
+LANES = (INTERACTIVE, EMAIL, BACKFILL)
+
+class TaskScheduler:
+    """
+    Bounded worker pool with priority lanes, between the producers (Gmail fetcher, /m, /tasker) and the jobs.
+    - Each lane has its own queue; workers always take the next job from the highest-priority non-empty lane.
+      SCHEDULER_RESERVED_WORKERS workers only serve the interactive lane, so a manual entry never waits
+      behind slow email jobs.
+    - `start_prompt` caps the human prompts outstanding per chat for email/backfill jobs. When the chat has
+      no free slot the prompt is parked in that chat's pending queue and the worker moves on, so one busy
+      chat never holds up another's emails; parked prompts start as the chat's slots free up.
+    - `submit` waits while the lane's queue is full, or while `queue_size` prompts are parked, so the fetcher
+      slows down instead of piling up payloads (the interactive lane is unbounded).
+    - Queue wait and end-to-end latency (from `since`, or from submit, until the job is done) are recorded
+      per lane (`stats`).
+    """
+    def __init__(self, workers: int = None, queue_size: int = None, max_prompts_per_chat: int = None, reserved_workers: int = None):
+        self.workers = workers or int(os.getenv("EMAIL_WORKERS", "4"))
+        self.queue_size = queue_size or int(os.getenv("EMAIL_QUEUE_SIZE", "50"))
+        self.max_prompts_per_chat = max_prompts_per_chat or int(os.getenv("EMAIL_MAX_PROMPTS_PER_CHAT", "3"))
+        self.reserved_workers = reserved_workers if reserved_workers is not None else int(os.getenv("SCHEDULER_RESERVED_WORKERS", "1"))
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self._ready: Optional[asyncio.Condition] = None
+        self._workers: Set[asyncio.Task] = set()
+        self._prompts: Set[asyncio.Task] = set()
+        self._active_prompts: Dict[str, int] = {} # Capped prompts running, per chat
+        self._parked: Dict[str, Deque[Job]] = {} # Capped prompts waiting for a slot, per chat
+        self._unparked: Optional[asyncio.Event] = None # Set whenever a parked prompt starts
+        self._waits: Dict[str, List[float]] = {lane: [] for lane in LANES} # Recent queue waits (s)
+        self._latencies: Dict[str, List[float]] = {lane: [] for lane in LANES} # Recent end-to-end times (s)
+        self._started: Dict[str, int] = {lane: 0 for lane in LANES}
+
+    def start(self):
+        if self._workers:
+            return
+        # Created here so the queues belong to the running loop
+        self.queues = {lane: asyncio.Queue(maxsize=0 if lane == INTERACTIVE else self.queue_size) for lane in LANES}
+        self._ready = asyncio.Condition()
+        self._unparked = asyncio.Event()
+        for i in range(self.reserved_workers):
+            self._workers.add(asyncio.create_task(self._worker(f"interactive-{i}", (INTERACTIVE,)), name=f"worker-interactive-{i}"))
+        for i in range(self.workers):
+            self._workers.add(asyncio.create_task(self._worker(str(i), LANES), name=f"worker-{i}"))
+
+    async def submit(self, job: Job, lane: str = EMAIL, since: float = None):
+        """
+        Queues a job on `lane`, waiting while that lane's queue is full (or too many prompts are parked).
+        `since` (time.monotonic()) is when the request arrived, if work was done on it before submitting.
+        """
+        self.start()
+        if lane != INTERACTIVE:
+            while self._parked_count() >= self.queue_size:
+                self._unparked.clear()
+                await self._unparked.wait()
+        enqueued_at = time.monotonic()
+        await self.queues[lane].put((enqueued_at, since if since is not None else enqueued_at, job))
+        async with self._ready:
+            self._ready.notify_all()
+
+    async def submit_prompt(self, chat_key: str, job: Job, lane: str = INTERACTIVE, since: float = None):
+        """Queues a job whose only work is prompting a user (see `start_prompt`)."""
+        await self.submit(partial(self.start_prompt, chat_key, job, lane=lane), lane=lane, since=since)
+
+    def _next(self, lanes: Tuple[str, ...]) -> Optional[Tuple[str, float, float, Job]]:
+        for lane in lanes:
+            queue = self.queues[lane]
+            if not queue.empty():
+                return (lane, *queue.get_nowait())
+        return None
+
+    async def _worker(self, name: str, lanes: Tuple[str, ...]):
+        while True:
+            async with self._ready:
+                picked = self._next(lanes)
+                while picked is None:
+                    await self._ready.wait()
+                    picked = self._next(lanes)
+            lane, enqueued_at, since, job = picked
+            self._started[lane] += 1
+            self._record(self._waits[lane], time.monotonic() - enqueued_at)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Worker {name}: {lane} job failed: {e}")
+            finally:
+                self._record(self._latencies[lane], time.monotonic() - since)
+                self.queues[lane].task_done()
+
+    @staticmethod
+    def _record(samples: List[float], seconds: float):
+        samples.append(seconds)
+        if len(samples) > 1000:
+            del samples[:500]
+
+    async def start_prompt(self, chat_key: str, job: Job, lane: str = EMAIL):
+        """
+        Runs `job` in the background without waiting for it. For email/backfill it takes one of `chat_key`'s
+        prompt slots until the job ends, or parks the job until a slot frees up; prompts a user asked for
+        themselves are never capped.
+        """
+        if lane == INTERACTIVE:
+            self._launch_prompt(chat_key, job, capped=False)
+        elif self._active_prompts.get(chat_key, 0) < self.max_prompts_per_chat:
+            self._launch_prompt(chat_key, job, capped=True)
+        else:
+            self._parked.setdefault(chat_key, deque()).append(job)
+
+    def _launch_prompt(self, chat_key: str, job: Job, capped: bool):
+        if capped:
+            self._active_prompts[chat_key] = self._active_prompts.get(chat_key, 0) + 1
+        task = asyncio.create_task(self._run_prompt(chat_key, job))
+
+        def finished(t):
+            self._prompts.discard(t)
+            if capped:
+                self._active_prompts[chat_key] -= 1
+                self._start_parked(chat_key)
+
+        self._prompts.add(task)
+        task.add_done_callback(finished)
+
+    def _start_parked(self, chat_key: str):
+        parked = self._parked.get(chat_key)
+        if not parked:
+            return
+        self._launch_prompt(chat_key, parked.popleft(), capped=True)
+        self._unparked.set()
+
+    def _parked_count(self) -> int:
+        return sum(len(parked) for parked in self._parked.values())
+
+    async def _run_prompt(self, chat_key: str, job: Job):
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Prompt for {chat_key} failed: {e}")
+
+    async def join(self):
+        """Waits until every queued job has run (prompts handed off may still be waiting on the user)."""
+        for queue in self.queues.values():
+            await queue.join()
+
+    def stats(self) -> Dict:
+        """
+        Per lane: queued/started jobs, queue wait (p50_ms/max_ms) and end-to-end latency (total_p50_ms/total_max_ms),
+        in ms over the recent jobs. Plus the prompts outstanding and parked.
+        """
+        lanes = {}
+        for lane in LANES:
+            waits = sorted(self._waits[lane])
+            latencies = sorted(self._latencies[lane])
+            lanes[lane] = {
+                "queued": self.queues[lane].qsize() if self.queues else 0,
+                "started": self._started[lane],
+                "p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+                "total_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+                "total_max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            }
+        return {"lanes": lanes, "prompts": len(self._prompts), "parked": self._parked_count()}
+
+    async def close(self):
+        # Dropped first so cancelled prompts do not start parked ones
+        self._parked.clear()
+        tasks = self._workers | self._prompts
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        self._prompts.clear()
+        self._active_prompts.clear()
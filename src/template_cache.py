@@ -0,0 +1,274 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from src.parser import normalize_text
+
+load_dotenv()
+
+# The parts of a notice that change from one email to the next; everything else is the bank's wording.
+# Order matters: a date or time is not also read as plain numbers.
+_FIELDS = re.compile(
+    r"(?P<date>\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2})"
+    r"|(?P<time>\d{2}:\d{2}(?::\d{2})?)"
+    r"|(?P<amount>(?:\$|COP)\s?[\d\.,]*\d)"
+    r"|(?P<number>\d+)",
+    re.IGNORECASE
+)
+
+def _day_first(raw: str) -> str:
+    """DD/MM/YYYY for any of the date field formats."""
+    if raw[2] == "/":
+        return raw
+    year, month, day = re.split(r"[-/]", raw)
+    return f"{day}/{month}/{year}"
+
+class Template:
+    """
+    An email's (normalized) text split into its fixed wording and its fields: dates, times, amounts and other numbers.
+    Two emails from the same bank template, differing only in those fields, share the fingerprint.
+    """
+    def __init__(self, text: str):
+        self.text = text = normalize_text(text)
+        self.fields: List[Tuple[str, int, int]] = [] # (kind, start, end) in text
+        parts, pos = [], 0
+        for match in _FIELDS.finditer(text):
+            parts.append(text[pos:match.start()].lower())
+            parts.append("{" + match.lastgroup + "}")
+            self.fields.append((match.lastgroup, match.start(), match.end()))
+            pos = match.end()
+        parts.append(text[pos:].lower())
+        self.masked = "".join(parts)
+        self.fingerprint = hashlib.sha1(self.masked.encode("utf-8")).hexdigest()
+
+    def value(self, index: Optional[int]) -> Optional[str]:
+        if index is None:
+            return None
+        _, start, end = self.fields[index]
+        return self.text[start:end]
+
+    def to_masked(self, pos: int) -> Optional[int]:
+        """Position in the masked text for a position in the text (None inside a field)."""
+        shift = 0
+        for kind, start, end in self.fields:
+            if pos <= start:
+                break
+            if pos < end:
+                return None
+            shift += len(kind) + 2 - (end - start)
+        return pos + shift
+
+    def to_text(self, pos: int) -> Optional[int]:
+        """Inverse of to_masked."""
+        shift = 0
+        for kind, start, end in self.fields:
+            masked_start = start + shift
+            if pos <= masked_start:
+                break
+            masked_end = masked_start + len(kind) + 2
+            if pos < masked_end:
+                return None
+            shift += len(kind) + 2 - (end - start)
+        return pos - shift
+
+def _locate(text: str, merchant: str) -> Optional[re.Match]:
+    """Where the merchant an LLM returned (uppercased, spacing may differ) appears in the text."""
+    merchant = (merchant or "").strip()
+    if not merchant or merchant == "UNKNOWN":
+        return None
+    return re.search(r"\s+".join(re.escape(word) for word in merchant.split()), text, re.IGNORECASE)
+
+def _literal(word: str) -> str:
+    """A context word as regex: escaped, with its numbers ("18:46", "$45.900") generalized."""
+    parts = re.split(r"(\d[\d\.,:]*\d|\d)", word)
+    return "".join(r"\d[\d\.,:]*" if i % 2 else re.escape(part) for i, part in enumerate(parts))
+
+def induce_patterns(text: str, merchant: str) -> List[str]:
+    """
+    Candidate merchant patterns for a (normalized) text and the merchant found in it, most general first:
+    one to three words of context before the merchant, and what closes it (punctuation, the next word or the end).
+    """
+    match = _locate(text, merchant)
+    if not match:
+        return []
+    before = text[:match.start()].split()[-3:]
+    after = text[match.end():]
+    if not after.strip():
+        closing = r"\s*$"
+    elif after[0] in ".,;:!?)":
+        closing = re.escape(after[0])
+    else:
+        closing = r"\s+" + _literal(after.split()[0])
+    candidates = []
+    for words in range(1, len(before) + 1):
+        context = before[-words:]
+        if sum(c.isalpha() for c in "".join(context)) < 3:
+            continue # "a", "$", "#": matches almost anywhere
+        candidates.append(r"\s+".join(_literal(w) for w in context) + r"\s*([^\n]+?)" + closing)
+    return candidates
+
+class TemplateCache:
+    """
+    Persistent cache of LLM extractions keyed by template fingerprint (see Template).
+    Stores where the merchant, amount and date were in the email, not their values, so the next email
+    with the same template is extracted locally instead of costing another Gemini call.
+    Also keeps the emails the LLM parsed as a corpus for inducing regex merchant patterns (`induce`),
+    which cover the same bank wording for any merchant.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("TEMPLATE_CACHE_PATH", "autotrx_templates.db")
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS templates (
+                    fingerprint TEXT PRIMARY KEY,
+                    bank TEXT,
+                    masked TEXT NOT NULL,
+                    merchant_start INTEGER NOT NULL, -- in the masked text
+                    merchant_end INTEGER NOT NULL,
+                    amount_field INTEGER NOT NULL, -- index into the template's fields
+                    date_field INTEGER,
+                    time_field INTEGER,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_hit REAL
+                );
+                -- Emails the LLM parsed: the corpus induced patterns are checked against
+                CREATE TABLE IF NOT EXISTS samples (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bank TEXT NOT NULL, -- '' for unknown senders
+                    text TEXT NOT NULL, -- normalized
+                    merchant TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS patterns (
+                    bank TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    support INTEGER NOT NULL, -- samples it extracts correctly
+                    promoted INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (bank, pattern)
+                );
+            """)
+        self.min_support = int(os.getenv("TEMPLATE_MIN_SUPPORT", "2"))
+        self.max_samples = int(os.getenv("TEMPLATE_MAX_SAMPLES", "500"))
+
+    def lookup(self, text: str) -> Optional[Dict[str, Optional[str]]]:
+        """Merchant, raw amount string and date ("DD/MM/YYYY HH:MM", None if it had none) for a known template, or None."""
+        template = Template(text)
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM templates WHERE fingerprint = ?", (template.fingerprint,)).fetchone()
+        if row is None:
+            return None
+        start, end = template.to_text(row["merchant_start"]), template.to_text(row["merchant_end"])
+        if start is None or end is None:
+            return None
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE templates SET hits = hits + 1, last_hit = ? WHERE fingerprint = ?", (time.time(), template.fingerprint))
+        date, clock = template.value(row["date_field"]), template.value(row["time_field"])
+        return {
+            "merchant": template.text[start:end].strip().upper(),
+            "amount": template.value(row["amount_field"]),
+            "date": f"{_day_first(date)} {clock[:5] if clock else '00:00'}" if date else None,
+        }
+
+    def learn(self, text: str, result: Dict, amount_rule: Callable[[str], float], bank: str = None) -> bool:
+        """
+        Records where an LLM result's values are in `text`. Returns False (nothing stored) when they cannot be
+        located exactly: a merchant the model renamed, an amount not in the email, a merchant cut through a field.
+        """
+        template = Template(text)
+        match = _locate(template.text, result.get("merchant"))
+        if not match:
+            return False
+        merchant_start, merchant_end = template.to_masked(match.start()), template.to_masked(match.end())
+        if merchant_start is None or merchant_end is None:
+            return False
+
+        amount_field = date_field = time_field = None
+        date, _, clock = (result.get("date") or "").partition(" ")
+        for index, (kind, start, end) in enumerate(template.fields):
+            value = template.text[start:end]
+            if kind == "amount" and amount_field is None and abs(amount_rule(value) - result.get("amount", 0.0)) < 0.005:
+                amount_field = index
+            elif kind == "date" and date_field is None and _day_first(value) == date:
+                date_field = index
+            elif kind == "time" and time_field is None and value[:5] == clock:
+                time_field = index
+        if amount_field is None:
+            return False
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO templates (fingerprint, bank, masked, merchant_start, merchant_end, amount_field, date_field, time_field, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (template.fingerprint, bank, template.masked, merchant_start, merchant_end, amount_field, date_field, time_field, time.time())
+            )
+        return True
+
+    def add_sample(self, text: str, merchant: str, bank: str = None):
+        """Adds an email the LLM parsed to the corpus (the newest TEMPLATE_MAX_SAMPLES are kept)."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO samples (bank, text, merchant, created_at) VALUES (?, ?, ?, ?)",
+                              (bank or "", normalize_text(text), merchant.strip().upper(), time.time()))
+            self.conn.execute("DELETE FROM samples WHERE id <= (SELECT MAX(id) FROM samples) - ?", (self.max_samples,))
+
+    def induce(self, text: str, merchant: str, bank: str = None) -> Optional[str]:
+        """
+        Tries to turn an LLM-parsed email into a merchant pattern for the regex stage.
+        Candidates (see induce_patterns) are checked against every stored email of the same bank: one wrong
+        merchant rejects a candidate. The most general clean one is kept, and promoted once it extracts
+        TEMPLATE_MIN_SUPPORT emails correctly. Returns the pattern when it is promoted by this email.
+        """
+        text = normalize_text(text)
+        bank = bank or ""
+        with self.lock:
+            corpus = self.conn.execute("SELECT text, merchant FROM samples WHERE bank = ?", (bank,)).fetchall()
+
+        for pattern in induce_patterns(text, merchant):
+            compiled = re.compile(pattern, re.IGNORECASE)
+            support = 0
+            for sample in corpus:
+                match = compiled.search(sample["text"])
+                if not match:
+                    continue
+                if match.group(1).strip().upper() != sample["merchant"]:
+                    break # Wrong merchant for a known email: too general
+                support += 1
+            else:
+                promoted = support >= self.min_support
+                with self.lock, self.conn:
+                    previous = self.conn.execute("SELECT promoted FROM patterns WHERE bank = ? AND pattern = ?", (bank, pattern)).fetchone()
+                    self.conn.execute("INSERT OR REPLACE INTO patterns (bank, pattern, support, promoted, updated_at) VALUES (?, ?, ?, ?, ?)",
+                                      (bank, pattern, support, int(promoted or bool(previous and previous["promoted"])), time.time()))
+                newly = promoted and not (previous and previous["promoted"])
+                return pattern if newly else None
+        return None
+
+    def promoted(self) -> Dict[Optional[str], List[str]]:
+        """Promoted patterns per bank (None: unknown senders), oldest first."""
+        with self.lock:
+            rows = self.conn.execute("SELECT bank, pattern FROM patterns WHERE promoted = 1 ORDER BY updated_at").fetchall()
+        patterns: Dict[Optional[str], List[str]] = {}
+        for row in rows:
+            patterns.setdefault(row["bank"] or None, []).append(row["pattern"])
+        return patterns
+
+    def stats(self) -> Dict[str, int]:
+        """Templates known, LLM calls they saved, and the induction corpus/patterns."""
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM templates").fetchone()
+            samples = self.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            candidates, promoted = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(promoted), 0) FROM patterns").fetchone()
+        return {"templates": row[0], "hits": row[1], "samples": samples, "candidates": candidates - promoted, "promoted": promoted}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,122 @@
+"""
+Benchmarks TransactionParser's regex stage against the previous implementation
+(uncompiled re.search per pattern, three lowercase copies for the HTML check) on the emails in resources/.
+
+Usage: python tests/benchmark_parser.py [rounds]
+"""
+import email
+import glob
+import os
+import re
+import sys
+import time
+from email import policy
+from bs4 import BeautifulSoup
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.parser import TransactionParser, looks_like_html, normalize_text
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+
+def load_corpus():
+    """Bodies of the .eml files (as parse() sees them after HTML cleaning) plus the Nubank notifications in the Tasker log."""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(RESOURCES, "*.eml"))):
+        with open(path, "rb") as f:
+            msg = email.message_from_binary_file(f, policy=policy.default)
+        body = msg.get_body(preferencelist=("html", "plain")).get_content()
+        texts.append(BeautifulSoup(body, "html.parser").get_text(separator="\n"))
+    for path in sorted(glob.glob(os.path.join(RESOURCES, "*.txt"))):
+        with open(path, encoding="utf-8") as f:
+            log = f.read()
+        # "4-5-26 00.14 - Acabas de enviar $500,00 ..." entries (runlog.txt has none)
+        entries = re.split(r"\n(?=\d+-\d+-\d+ \d+\.\d+ - )", log)
+        texts.extend(e.split(" - ", 1)[1] for e in entries if re.match(r"\d+-\d+-\d+ \d+\.\d+ - ", e))
+    return texts
+
+def legacy_extract(parser, text):
+    """The regex stage as it was: HTML check with three lower() copies, then re.search with pattern strings."""
+    "<html" in text.lower() or "<div" in text.lower() or "body {" in text.lower()
+    amount = re.search(parser.amount_pattern, text, re.IGNORECASE)
+    merchant = None
+    for pattern in parser.merchant_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            merchant = match.group(1).strip().upper()
+            break
+    date = re.search(parser.date_pattern, text, re.IGNORECASE)
+    return amount.group(1).strip() if amount else None, merchant, date.groups() if date else None
+
+def engine_extract(parser, text):
+    """The regex stage now: one lower() for the HTML check, normalize once, compiled patterns."""
+    looks_like_html(text)
+    text = normalize_text(text)
+    engine = parser.engine
+    amount = engine.amount_re.search(text)
+    date = engine.date_re.search(text)
+    return amount.group(1).strip() if amount else None, engine.merchant(text), date.groups() if date else None
+
+def alternation_extractor(parser):
+    """
+    Reference only: all merchant patterns as one alternation with named groups, keeping list priority
+    (leftmost match, then re-search the rest of the text with just the higher-priority patterns).
+    """
+    named = [re.sub(r"(?<!\\)\((?!\?)", f"(?P<m{i}>", p, count=1) for i, p in enumerate(parser.merchant_patterns)]
+    combined = [None] + [re.compile("|".join(f"(?:{p})" for p in named[:k]), re.IGNORECASE) for k in range(1, len(named) + 1)]
+
+    def merchant(text):
+        limit, pos, found = len(named), 0, None
+        while limit:
+            match = combined[limit].search(text, pos)
+            if not match:
+                break
+            limit = int(match.lastgroup[1:])
+            found = match.group(match.lastgroup).strip().upper()
+            pos = match.start() + 1
+        return found
+
+    def extract(text):
+        looks_like_html(text)
+        text = normalize_text(text)
+        amount = parser.engine.amount_re.search(text)
+        date = parser.engine.date_re.search(text)
+        return amount.group(1).strip() if amount else None, merchant(text), date.groups() if date else None
+
+    return extract
+
+def timed(fn, texts, rounds, repeats=5):
+    """Microseconds per email, best of `repeats` (the least disturbed run)."""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                fn(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (rounds * len(texts)) * 1e6
+
+def main(rounds=300):
+    parser = TransactionParser(api_key="")
+    texts = load_corpus()
+    alternation = alternation_extractor(parser)
+
+    mismatches = [t for t in texts if legacy_extract(parser, t) != engine_extract(parser, t) or legacy_extract(parser, t) != alternation(t)]
+    print(f"Corpus: {len(texts)} emails ({sum(len(t) for t in texts):,} chars). Result mismatches vs legacy: {len(mismatches)}")
+    for text in mismatches:
+        print(f"  legacy={legacy_extract(parser, text)} engine={engine_extract(parser, text)} | {text[:80]!r}")
+
+    groups = [("all", texts), ("html (>1000 chars)", [t for t in texts if len(t) > 1000]), ("short", [t for t in texts if len(t) <= 1000])]
+    print(f"{'set':<20}{'legacy us':>11}{'engine us':>11}{'speedup':>9}{'alternation us':>16}")
+    for name, subset in groups:
+        if not subset:
+            continue
+        legacy = timed(lambda t: legacy_extract(parser, t), subset, rounds)
+        engine = timed(lambda t: engine_extract(parser, t), subset, rounds)
+        alt = timed(alternation, subset, rounds)
+        print(f"{name:<20}{legacy:>11.1f}{engine:>11.1f}{legacy / engine:>8.2f}x{alt:>16.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -8,9 +8,12 @@ import asyncio
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.ingestion import GmailClient
+from src.ingestion import AsyncGmailClient
 from src.parser import TransactionParser
 from src.loader import SheetsLoader
+from src.ledger import EmailLedger
+from src.scheduler import TaskScheduler
+from src.gate import RelevanceGate
 # Import the function to test. Since it's in main.py, we might need to import it carefully
 # or move it to a module. Importing main might run the script if not guarded?
 # main.py has if __name__ == "__main__":, so it's safe.
@@ -25,18 +28,19 @@ class TestDualBotRouting(unittest.IsolatedAsyncioTestCase):
         # 1. Setup Mocks
         mock_bot_juanma = AsyncMock()
         mock_bot_juanma.chat_id = 123
-        mock_bot_juanma.ask_user_for_category.return_value = [] # Simulate user skipped
+        mock_bot_juanma.ask_user_for_category.return_value = ([], None) # Simulate user skipped
         
         mock_bot_leydi = AsyncMock()
         mock_bot_leydi.chat_id = 456
-        mock_bot_leydi.ask_user_for_category.return_value = [] 
+        mock_bot_leydi.ask_user_for_category.return_value = ([], None)
         
         bots = {
             "Juanma": mock_bot_juanma,
             "Leydi": mock_bot_leydi
         }
         
-        mock_gmail = MagicMock(spec=GmailClient)
+        mock_gmail = MagicMock(spec=AsyncGmailClient)
+        mock_gmail.unprocessed_filter = "is:unread"
         mock_parser = MagicMock(spec=TransactionParser)
         mock_loader = MagicMock(spec=SheetsLoader)
         
@@ -61,14 +65,12 @@ class TestDualBotRouting(unittest.IsolatedAsyncioTestCase):
             'snippet': ''
         }
         
-        # Configure Gmail Mock to return these emails then stop
-        mock_gmail.fetch_unread_emails.side_effect = [
-            [email_leydi, email_juanma], # First call returns emails
-            StopLoopException("Stop") # Second call stops the loop (simulating end of test)
-        ]
+        # Configure Gmail Mock to return these emails
+        mock_gmail.new_message_ids = AsyncMock(return_value=['msg_leydi', 'msg_juanma'])
+        mock_gmail.get_messages = AsyncMock(return_value=[email_leydi, email_juanma])
         
         # Configure Parser Mock
-        mock_parser.parse.return_value = {'amount': 50000, 'merchant': 'Test Merchant', 'date': '2025-01-01'}
+        mock_parser.parse_async = AsyncMock(return_value={'amount': 50000, 'merchant': 'Test Merchant', 'date': '2025-01-01'})
         
         # 3. Run Loop
         try:
@@ -80,8 +82,15 @@ class TestDualBotRouting(unittest.IsolatedAsyncioTestCase):
             # So if fetch raises StopLoopException, it will be caught and logged.
             # We need a different way to break.
             # We can mock asyncio.sleep to raise StopLoopException.
+            # The in-memory ledger keeps the run from creating autotrx_ledger.db in the CWD;
+            # the gate is off because these emails carry no snippet.
+            scheduler = TaskScheduler(workers=2)
             with patch('asyncio.sleep', side_effect=StopLoopException("End Loop")):
-                 await etl_loop(bots, mock_gmail, mock_parser, mock_loader)
+                 await etl_loop(bots, mock_gmail, mock_parser, mock_loader, ledger=EmailLedger(":memory:"), scheduler=scheduler, gate=RelevanceGate(enabled=False))
+            # Let the workers and the prompts they handed off finish
+            await scheduler.join()
+            await asyncio.sleep(0.05)
+            await scheduler.close()
         except StopLoopException:
             pass
         except Exception as e:
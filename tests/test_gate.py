@@ -0,0 +1,81 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import etl_loop
+from src.gate import RelevanceGate, detect_bank
+from src.ledger import EmailLedger, REJECTED, SKIPPED
+
+def make_email(email_id, snippet, sender="alertas@bancolombia.com.co", subject="Alertas y Notificaciones"):
+    return {"id": email_id, "snippet": snippet, "body": snippet, "payload": {"headers": [{"name": "From", "value": sender}, {"name": "Subject", "value": subject}]}}
+
+PURCHASE = make_email("buy", "Bancolombia: Compraste $17.600,00 en CITY PARKING con tu T.Deb *4256, el 11/12/2025 a las 15:51.")
+FAILED_TRANSFER = make_email("fail", "Tu transferencia por $502,00 no se completó porque el número de cuenta no es válido.", sender="Nu Colombia <notificaciones@nu.com.co>")
+PROMO = make_email("promo", "Conoce los nuevos beneficios de tu cuenta", subject="Novedades de este mes")
+
+class TestRelevanceGate(unittest.TestCase):
+    def test_signatures(self):
+        gate = RelevanceGate(enabled=True)
+        self.assertEqual(gate.classify(PURCHASE), (True, "signature:Bancolombia"))
+        self.assertEqual(gate.classify(FAILED_TRANSFER), (False, "notice:no se completó"))
+        self.assertEqual(gate.classify(PROMO), (False, "no_signal"))
+
+    def test_forwarded_email_matches_original_bank(self):
+        forwarded = make_email("fwd", "De: RappiCard <noreply@rappicard.co> Enviados: martes Asunto: RappiCard - Resumen de transacción", sender="Leydi <lejom_0721@hotmail.com>", subject="RV: RappiCard - Resumen de transacción")
+        self.assertEqual(detect_bank(forwarded), "RappiCard")
+        self.assertTrue(RelevanceGate(enabled=True).classify(forwarded)[0])
+        # A bank named in the text is not its sender: this is a Nubank transfer to a Bancolombia account
+        nubank = make_email("nu", "Se los enviaste a Bancolombia por $50.000,00", sender="Nu Colombia <notificaciones@nu.com.co>", subject="Enviaste dinero")
+        self.assertEqual(detect_bank(nubank), "Nubank")
+
+    def test_transaction_with_promo_wording_passes(self):
+        purchase = make_email("buy_promo", "Bancolombia: Compraste $45.000,00 en EXITO con tu T.Cred *1234. Conoce la promoción de puntos de este mes.")
+        self.assertEqual(RelevanceGate(enabled=True).classify(purchase), (True, "signature:Bancolombia"))
+
+    def test_forwarded_email_with_only_the_forward_header_passes(self):
+        forwarded = make_email("fwd_hdr", "---------- Forwarded message --------- De: Bancolombia <alertas@bancolombia.com.co> Date: lun, 1 dic 2025",
+                               sender="Leydi <lejom_0721@hotmail.com>", subject="RV: Alertas y Notificaciones")
+        self.assertEqual(RelevanceGate(enabled=True).classify(forwarded), (True, "forwarded:Bancolombia"))
+
+    def test_unknown_wording_with_amount_goes_to_parser(self):
+        self.assertEqual(RelevanceGate(enabled=True).classify(make_email("x", "Movimiento por $20.000", sender="otro@banco.com")), (True, "amount"))
+
+    def test_rejected_emails_are_left_unprocessed(self):
+        gmail = MagicMock()
+        gmail.unprocessed_filter = "is:unread"
+        gmail.new_message_ids = AsyncMock(return_value=["buy", "fail", "promo"])
+        gmail.get_messages = AsyncMock(return_value=[PURCHASE, FAILED_TRANSFER, PROMO])
+        parser = MagicMock()
+        parser.parse_async = AsyncMock(return_value={"amount": 0.0, "merchant": ""})
+        ledger = EmailLedger(":memory:")
+        gate = RelevanceGate(enabled=True)
+
+        async def run():
+            wakeup = asyncio.Event()
+            task = asyncio.create_task(etl_loop({"Juanma": MagicMock()}, gmail, parser, MagicMock(), wakeup=wakeup, ledger=ledger, gate=gate))
+            await asyncio.sleep(0.05)
+            wakeup.set() # Second sync lists the same emails again
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(gmail.new_message_ids.await_count, 2)
+        parser.parse_async.assert_awaited_once()
+        gmail.get_messages.assert_awaited_once() # Not downloaded (or gated) again
+        self.assertEqual(gmail.get_messages.call_args.kwargs["wants_body"], gate.wants_body)
+        # Recorded but not marked: still unread for the user
+        self.assertEqual(ledger.state("fail"), REJECTED)
+        self.assertEqual(ledger.state("promo"), REJECTED)
+        self.assertEqual(ledger.state("buy"), SKIPPED) # Unparseable here
+        marked = [c.args[0] for c in gmail.mark_processed.call_args_list]
+        self.assertEqual(marked, ["buy"])
+        self.assertEqual(gate.stats()["rejected"], 2)
+        self.assertEqual(gate.stats()["passed"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import json
+import os
+import sys
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_web_app, etl_loop
+from src.ledger import EmailLedger
+
+def push_payload(history_id="12345"):
+    """Pub/Sub push envelope as sent for a Gmail users.watch notification."""
+    data = json.dumps({"emailAddress": "me@gmail.com", "historyId": history_id}).encode()
+    return {"message": {"data": base64.b64encode(data).decode(), "messageId": "1"}, "subscription": "projects/p/subscriptions/s"}
+
+class TestGmailPush(unittest.TestCase):
+    def post(self, payload, path="/gmail/push", wakeup=None):
+        async def run():
+            app = create_web_app({"Juanma": MagicMock()}, gmail_wakeup=wakeup)
+            async with TestClient(TestServer(app)) as client:
+                resp = await client.post(path, json=payload)
+                return resp.status
+        return asyncio.run(run())
+
+    def test_push_sets_wakeup(self):
+        async def run():
+            wakeup = asyncio.Event()
+            app = create_web_app({"Juanma": MagicMock()}, gmail_wakeup=wakeup)
+            async with TestClient(TestServer(app)) as client:
+                resp = await client.post("/gmail/push", json=push_payload())
+                return resp.status, wakeup.is_set()
+
+        self.assertEqual(asyncio.run(run()), (204, True))
+
+    def test_malformed_payload_rejected(self):
+        self.assertEqual(self.post({"message": {"data": "not base64 json"}}), 400)
+
+    def test_push_token_checked(self):
+        with patch.dict(os.environ, {"GMAIL_PUSH_TOKEN": "s3cret"}):
+            self.assertEqual(self.post(push_payload()), 401)
+            self.assertEqual(self.post(push_payload(), path="/gmail/push?token=s3cret"), 204)
+
+    def test_push_triggers_immediate_fetch(self):
+        gmail = MagicMock()
+        gmail.new_message_ids = AsyncMock(return_value=[])
+        gmail.watch = AsyncMock()
+
+        async def run():
+            wakeup = asyncio.Event()
+            app = create_web_app({"Juanma": MagicMock()}, gmail_wakeup=wakeup)
+            with patch.dict(os.environ, {"GMAIL_PUBSUB_TOPIC": "projects/p/topics/gmail", "GMAIL_SAFETY_POLL_SECONDS": "600"}):
+                loop_task = asyncio.create_task(etl_loop({}, gmail, MagicMock(), MagicMock(), wakeup=wakeup, ledger=EmailLedger(":memory:")))
+                await asyncio.sleep(0.05)
+                self.assertEqual(gmail.new_message_ids.call_count, 1)
+
+                async with TestClient(TestServer(app)) as client:
+                    await client.post("/gmail/push", json=push_payload())
+                await asyncio.sleep(0.05)
+
+                loop_task.cancel()
+            return gmail.new_message_ids.call_count
+
+        self.assertEqual(asyncio.run(run()), 2)
+        gmail.watch.assert_awaited_once_with("projects/p/topics/gmail")
+
+if __name__ == '__main__':
+    unittest.main()
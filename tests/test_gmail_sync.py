@@ -0,0 +1,314 @@
+import asyncio
+import base64
+import threading
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from googleapiclient.errors import HttpError
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ingestion import AsyncGmailClient, GmailClient
+
+def make_message(message_id, text="Compra por $10.000 en TIENDA"):
+    data = base64.urlsafe_b64encode(text.encode()).decode()
+    return {"id": message_id, "snippet": text, "payload": {"headers": [{"name": "From", "value": "alertas@bank.com"}], "body": {"data": data}}}
+
+class FakeBatch:
+    """Stands in for BatchHttpRequest: runs each request on execute() and reports through the callback."""
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+def make_client(history_path):
+    with patch.object(GmailClient, "_authenticate"):
+        client = GmailClient(history_path=history_path)
+    service = MagicMock()
+    users = service.users.return_value
+    users.getProfile.return_value.execute.return_value = {"historyId": "100"}
+    users.messages.return_value.get.side_effect = lambda userId, id, **kwargs: MagicMock(execute=MagicMock(return_value=make_message(id)))
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+    client.service = service
+    return client, users
+
+class TestHistorySync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "history.json")
+        self.client, self.users = make_client(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_first_sync_lists_and_stores_history_id(self):
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "a"}]}
+
+        emails = self.client.fetch_new_emails(custom_query="is:unread")
+
+        self.assertEqual([e["id"] for e in emails], ["a"])
+        self.assertEqual(self.client.history_id, "100")
+        # Persisted for the next start
+        self.assertEqual(make_client(self.path)[0].history_id, "100")
+
+    def test_idle_poll_is_a_single_history_call(self):
+        self.client._save_history_id("100")
+        self.client._last_full_sync = time.time() # Backstop not due
+        self.users.history.return_value.list.return_value.execute.return_value = {"historyId": "105"}
+
+        self.assertEqual(self.client.fetch_new_emails(custom_query="is:unread"), [])
+        self.users.messages.return_value.list.assert_not_called()
+        self.users.messages.return_value.get.assert_not_called()
+        self.assertEqual(self.client.history_id, "105")
+
+    def test_added_messages_are_filtered_by_query(self):
+        self.client._save_history_id("100")
+        self.client._last_full_sync = time.time()
+        self.users.history.return_value.list.return_value.execute.side_effect = [
+            {"history": [{"messagesAdded": [{"message": {"id": "new1"}}]}], "nextPageToken": "p2"},
+            {"history": [{"messagesAdded": [{"message": {"id": "new2"}}]}], "historyId": "110"},
+        ]
+        # new2 does not match the sender/unread query; "old" was already seen
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "new1"}, {"id": "old"}]}
+
+        emails = self.client.fetch_new_emails(custom_query="is:unread")
+
+        self.assertEqual([e["id"] for e in emails], ["new1"])
+        self.assertEqual(self.client.history_id, "110")
+
+    def test_added_message_with_older_date_is_found_on_a_later_page(self):
+        self.client._save_history_id("100")
+        self.client._last_full_sync = time.time()
+        self.client.page_size = 2
+        self.users.history.return_value.list.return_value.execute.return_value = {
+            "history": [{"messagesAdded": [{"message": {"id": "delayed"}}]}], "historyId": "110"
+        }
+        # Newest first: the delayed message sorts behind older unread matches
+        pages = {None: (["old1", "old2"], "p2"), "p2": (["delayed", "old3"], "p3"), "p3": (["old4"], None)}
+
+        def list_messages(userId, q, maxResults, pageToken=None):
+            page, next_token = pages[pageToken]
+            return MagicMock(execute=MagicMock(return_value={"messages": [{"id": i} for i in page], "nextPageToken": next_token}))
+
+        self.users.messages.return_value.list.side_effect = list_messages
+        emails = self.client.fetch_new_emails(custom_query="is:unread")
+
+        self.assertEqual([e["id"] for e in emails], ["delayed"])
+        # Stops once every added ID has been seen
+        self.assertEqual(self.users.messages.return_value.list.call_count, 2)
+
+    def test_expired_history_falls_back_to_full_list(self):
+        self.client._save_history_id("1")
+        self.client._last_full_sync = time.time()
+        self.users.history.return_value.list.return_value.execute.side_effect = HttpError(MagicMock(status=404), b"not found")
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "a"}]}
+
+        emails = self.client.fetch_new_emails(custom_query="is:unread")
+
+        self.assertEqual([e["id"] for e in emails], ["a"])
+        self.assertEqual(self.client.history_id, "100")
+
+class TestBacklogFetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client, self.users = make_client(os.path.join(self.tmp.name, "history.json"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_backlog_is_paginated_and_fetched_in_batches(self):
+        self.client.page_size = 100
+        ids = [f"m{i}" for i in range(250)]
+        pages = {None: (ids[:100], "p2"), "p2": (ids[100:200], "p3"), "p3": (ids[200:], None)}
+
+        def list_messages(userId, q, maxResults, pageToken=None):
+            page, next_token = pages[pageToken]
+            return MagicMock(execute=MagicMock(return_value={"messages": [{"id": i} for i in page], "nextPageToken": next_token}))
+
+        self.users.messages.return_value.list.side_effect = list_messages
+        emails = self.client.fetch_unread_emails(custom_query="is:unread")
+
+        self.assertEqual([e["id"] for e in emails], ids)
+        # 100 + 100 + 50, once for metadata and once for bodies
+        self.assertEqual(self.client.service.new_batch_http_request.call_count, 6)
+        self.assertEqual(emails[0]["body"], "Compra por $10.000 en TIENDA")
+
+    def test_max_results_stops_listing(self):
+        self.client.page_size = 2
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "a"}, {"id": "b"}], "nextPageToken": "more"}
+
+        emails = self.client.fetch_unread_emails(custom_query="is:unread", max_results=2)
+
+        self.assertEqual(len(emails), 2)
+        self.users.messages.return_value.list.assert_called_once()
+
+    def test_failed_get_is_skipped(self):
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "ok"}, {"id": "bad"}]}
+        good_get = self.users.messages.return_value.get.side_effect
+
+        def get(userId, id, **kwargs):
+            if id == "bad":
+                return MagicMock(execute=MagicMock(side_effect=Exception("500")))
+            return good_get(userId=userId, id=id, **kwargs)
+
+        self.users.messages.return_value.get.side_effect = get
+        self.assertEqual([e["id"] for e in self.client.fetch_unread_emails(custom_query="is:unread")], ["ok"])
+
+class TestTwoPhaseFetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client, self.users = make_client(os.path.join(self.tmp.name, "history.json"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_metadata_first_then_bodies_for_accepted_messages(self):
+        emails = self.client.get_messages(["keep", "skip"], wants_body=lambda e: e["id"] == "keep")
+
+        calls = self.users.messages.return_value.get.call_args_list
+        metadata_calls = [c for c in calls if c.kwargs.get("format") == "metadata"]
+        body_calls = [c for c in calls if c.kwargs.get("format") == "full"]
+        self.assertEqual([c.kwargs["id"] for c in metadata_calls], ["keep", "skip"])
+        self.assertEqual(metadata_calls[0].kwargs["metadataHeaders"], ["From", "Subject"])
+        self.assertIn("payload/headers", metadata_calls[0].kwargs["fields"])
+        self.assertEqual([c.kwargs["id"] for c in body_calls], ["keep"])
+
+        self.assertEqual(emails[0]["body"], "Compra por $10.000 en TIENDA")
+        self.assertEqual(emails[1]["body"], "")
+        # Only the headers survive in the payload
+        self.assertEqual(emails[0]["payload"], {"headers": [{"name": "From", "value": "alertas@bank.com"}]})
+
+class TestProcessedMarker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client, self.users = make_client(os.path.join(self.tmp.name, "history.json"))
+        self.client.processed.window = 60 # Only flush explicitly
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def modify_bodies(self):
+        return [c.kwargs["body"] for c in self.users.messages.return_value.batchModify.call_args_list]
+
+    def test_ids_flushed_in_chunks_of_1000(self):
+        for i in range(1500):
+            self.client.mark_processed(f"m{i}")
+        self.client.mark_processed("m0") # Duplicates are ignored
+        self.client.processed.flush()
+
+        bodies = self.modify_bodies()
+        self.assertEqual([len(b["ids"]) for b in bodies], [1000, 500])
+        self.assertEqual(bodies[0]["removeLabelIds"], ["UNREAD"])
+        self.users.messages.return_value.modify.assert_not_called()
+
+    def test_timer_flushes_after_window(self):
+        self.client.processed.window = 0.01
+        self.client.mark_processed("a")
+        time.sleep(0.2)
+        self.assertEqual(self.modify_bodies(), [{"ids": ["a"], "removeLabelIds": ["UNREAD"]}])
+
+    def test_pending_ids_are_not_listed_again(self):
+        self.client.mark_processed("done")
+        self.users.messages.return_value.list.return_value.execute.return_value = {"messages": [{"id": "done"}, {"id": "new"}]}
+        self.assertEqual(self.client.new_message_ids(custom_query="is:unread"), ["new"])
+
+    def test_failed_flush_is_retried(self):
+        self.users.messages.return_value.batchModify.return_value.execute.side_effect = [Exception("503"), {}]
+        self.client.mark_processed("a")
+        self.client.processed.flush()
+        self.assertEqual(self.client.processed.pending(), {"a"})
+        self.client.processed.flush()
+        self.assertEqual(self.client.processed.pending(), set())
+
+    def test_failing_id_is_dropped_after_max_attempts(self):
+        self.users.messages.return_value.batchModify.return_value.execute.side_effect = Exception("404 not found")
+        self.client.processed.max_attempts = 3
+        self.client.mark_processed("deleted")
+        for _ in range(3):
+            self.client.processed.flush()
+        self.assertEqual(self.client.processed.pending(), set())
+        self.client.processed.flush()
+        self.assertEqual(len(self.modify_bodies()), 3)
+
+    def test_timed_flushes_share_one_thread(self):
+        self.client.processed.window = 0.01
+        self.client.mark_processed("a")
+        time.sleep(0.1)
+        thread = self.client.processed._thread
+        self.client.mark_processed("b")
+        time.sleep(0.1)
+        self.assertIs(self.client.processed._thread, thread)
+        self.assertEqual([b["ids"] for b in self.modify_bodies()], [["a"], ["b"]])
+
+    def test_processed_label_mode(self):
+        self.client.processed.label_name = "AutoTrx/processed"
+        self.users.labels.return_value.list.return_value.execute.return_value = {"labels": [{"id": "INBOX", "name": "INBOX"}]}
+        self.users.labels.return_value.create.return_value.execute.return_value = {"id": "Label_7", "name": "AutoTrx/processed"}
+
+        self.client.mark_processed("a")
+        self.client.processed.flush()
+        self.client.mark_processed("b")
+        self.client.processed.flush()
+
+        self.assertEqual(self.modify_bodies(), [{"ids": ["a"], "addLabelIds": ["Label_7"]}, {"ids": ["b"], "addLabelIds": ["Label_7"]}])
+        self.users.labels.return_value.create.assert_called_once()
+        self.assertEqual(self.client.processed.query_filter, "-label:autotrx-processed")
+
+class TestAsyncGmailClient(unittest.TestCase):
+    def test_gets_run_off_loop_in_parallel_with_per_thread_services(self):
+        with patch.object(GmailClient, "_authenticate"):
+            client = GmailClient(history_path=os.path.join(tempfile.gettempdir(), "unused_history.json"))
+        client.creds = MagicMock()
+        services = {}
+        lock = threading.Lock()
+
+        def build(*args, **kwargs):
+            service = MagicMock()
+            service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+
+            def slow_get(userId, id):
+                time.sleep(0.1)
+                return make_message(id)
+
+            service.users.return_value.messages.return_value.get.side_effect = lambda userId, id, **kwargs: MagicMock(execute=lambda: slow_get(userId, id))
+            with lock:
+                services[threading.get_ident()] = service
+            return service
+
+        gmail = AsyncGmailClient(client, max_workers=4)
+        ids = [f"m{i}" for i in range(8)]
+
+        async def run():
+            ticks = 0
+            task = asyncio.create_task(gmail.get_messages(ids))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            return ticks, task.result()
+
+        started = time.time()
+        with patch("src.ingestion.build", side_effect=build):
+            ticks, emails = asyncio.run(run())
+        elapsed = time.time() - started
+        gmail.close()
+
+        self.assertEqual([e["id"] for e in emails], ids)
+        self.assertEqual(len(services), 4) # One service per worker thread
+        self.assertLess(elapsed, 1.2) # 4 chunks of 2 (x2 phases) in parallel, not 16 sequential gets
+        self.assertGreater(ticks, 5) # Event loop kept running
+
+if __name__ == '__main__':
+    unittest.main()
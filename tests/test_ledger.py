@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import process_email_task, resume_email_task
+from src.ledger import EmailLedger, FAILED, GAVE_UP, PROMPTED, SAVED, SKIPPED
+
+TX = {"date": "01/02/2026 10:00", "amount": 1000.0, "merchant": "TIENDA"}
+SPLITS = [("💸 Deudas", "Personal", 1000.0, "Juanma", "Gasto")]
+
+def make_bot(splits=SPLITS):
+    bot = MagicMock()
+    bot.ask_user_for_category = AsyncMock(return_value=(splits, 42))
+    bot.application.bot.edit_message_text = AsyncMock()
+    bot.application.bot.send_message = AsyncMock()
+    return bot
+
+def make_loader(saved=True):
+    loader = MagicMock()
+    loader.append_many = AsyncMock(side_effect=lambda entries: [saved] * len(entries))
+    loader.accumulated = AsyncMock(return_value=1000.0)
+    return loader
+
+EMAIL = {"id": "m1", "snippet": "Compra por $1.000 en TIENDA", "body": "Compra por $1.000 en TIENDA", "payload": {"headers": []}}
+
+class TestEmailLedger(unittest.TestCase):
+    def test_claim_is_once_per_email(self):
+        ledger = EmailLedger(":memory:")
+        self.assertTrue(ledger.claim("m1"))
+        self.assertFalse(ledger.claim("m1"))
+        self.assertEqual(ledger.counts(), {"fetched": 1})
+
+    def test_state_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ledger.db")
+            ledger = EmailLedger(path)
+            ledger.claim("m1")
+            ledger.update("m1", PROMPTED, transaction=TX, splits=SPLITS, message_id=42)
+            ledger.close()
+
+            entry = EmailLedger(path).in_flight()[0]
+        self.assertEqual(entry["state"], PROMPTED)
+        self.assertEqual(entry["transaction"], TX)
+        self.assertEqual(entry["splits"], SPLITS)
+        self.assertEqual(entry["message_id"], 42)
+
+    def test_failed_retries_are_bounded(self):
+        ledger = EmailLedger(":memory:")
+        ledger.claim("m1")
+        for _ in range(3):
+            ledger.update("m1", FAILED, error="quota")
+        self.assertEqual(len(ledger.in_flight(states=(FAILED,), max_attempts=4)), 1)
+        self.assertEqual(ledger.in_flight(states=(FAILED,), max_attempts=3), [])
+
+    def test_exhausted_emails_are_parked(self):
+        ledger = EmailLedger(":memory:")
+        ledger.claim("m1")
+        ledger.claim("m2")
+        for _ in range(3):
+            ledger.update("m1", FAILED, error="quota")
+        ledger.update("m2", FAILED, error="quota")
+
+        self.assertEqual(ledger.give_up(max_attempts=3), ["m1"])
+        self.assertEqual(ledger.state("m1"), GAVE_UP)
+        self.assertEqual([e["id"] for e in ledger.in_flight()], ["m2"])
+
+class TestLedgerLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.ledger = EmailLedger(":memory:")
+        self.ledger.claim(EMAIL["id"])
+        self.gmail = MagicMock()
+        self.parser = MagicMock()
+        self.parser.parse_async = AsyncMock(return_value=dict(TX))
+
+    def test_saved_email_is_marked(self):
+        asyncio.run(process_email_task(EMAIL, {"Juanma": make_bot()}, self.gmail, self.parser, make_loader(), self.ledger))
+        self.assertEqual(self.ledger.state("m1"), SAVED)
+        self.gmail.mark_processed.assert_called_once_with("m1")
+
+    def test_ignored_email_is_skipped(self):
+        asyncio.run(process_email_task(EMAIL, {"Juanma": make_bot(splits=None)}, self.gmail, self.parser, make_loader(), self.ledger))
+        self.assertEqual(self.ledger.state("m1"), SKIPPED)
+
+    def test_failed_save_is_retried_without_asking_again(self):
+        bot = make_bot()
+        asyncio.run(process_email_task(EMAIL, {"Juanma": bot}, self.gmail, self.parser, make_loader(saved=False), self.ledger))
+        self.assertEqual(self.ledger.state("m1"), FAILED)
+        self.gmail.mark_processed.assert_not_called()
+
+        entry = self.ledger.in_flight(states=(FAILED,))[0]
+        asyncio.run(resume_email_task(entry, {"Juanma": bot}, self.gmail, self.parser, make_loader(), self.ledger))
+
+        self.assertEqual(self.ledger.state("m1"), SAVED)
+        bot.ask_user_for_category.assert_awaited_once()
+        self.parser.parse_async.assert_awaited_once()
+
+    def test_unanswered_prompt_is_asked_again_after_restart(self):
+        self.ledger.update("m1", PROMPTED, transaction=TX, target_user="Juanma")
+        bot = make_bot()
+
+        asyncio.run(resume_email_task(self.ledger.in_flight()[0], {"Juanma": bot}, self.gmail, self.parser, make_loader(), self.ledger))
+
+        bot.ask_user_for_category.assert_awaited_once()
+        self.assertEqual(bot.ask_user_for_category.call_args.args[0], TX)
+        self.assertEqual(self.ledger.state("m1"), SAVED)
+
+    def test_unparsed_email_is_refetched_by_id(self):
+        self.gmail.get_messages = AsyncMock(return_value=[EMAIL])
+
+        asyncio.run(resume_email_task(self.ledger.in_flight()[0], {"Juanma": make_bot()}, self.gmail, self.parser, make_loader(), self.ledger))
+
+        self.gmail.get_messages.assert_awaited_once_with(["m1"])
+        self.assertEqual(self.ledger.state("m1"), SAVED)
+
+    def test_failed_refetch_counts_as_an_attempt(self):
+        self.gmail.get_messages = AsyncMock(return_value=[])
+        self.ledger.update("m1", FAILED, error="parse error")
+
+        asyncio.run(resume_email_task(self.ledger.in_flight()[0], {"Juanma": make_bot()}, self.gmail, self.parser, make_loader(), self.ledger))
+
+        entry = self.ledger.in_flight(states=(FAILED,))[0]
+        self.assertEqual(entry["attempts"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
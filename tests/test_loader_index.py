@@ -0,0 +1,186 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.loader import SheetsLoader, _period_start
+
+HEADERS = ["Fecha", "Timestamp", "Usuario", "Scope", "Tipo Movimiento", "Categoría Principal", "Subcategoría", "Monto", "Descripción"]
+
+def make_record(fecha, usuario, scope, tipo, main, sub, monto):
+    return [fecha, "", usuario, scope, tipo, main, sub, str(monto), "desc"]
+
+def stub_sheet_rows(sheet, rows, headers=HEADERS):
+    """Serves `rows` through the row_values(1) + batch_get(COLUMNS) read path."""
+    sheet.row_values.return_value = headers
+
+    def batch_get(ranges, major_dimension=None):
+        result = []
+        for rng in ranges:
+            col = ord(rng[0]) - ord("A")
+            first_row = int(rng.split(":")[0][1:])
+            values = [r[col] if col < len(r) else "" for r in rows[first_row - 2:]]
+            while values and values[-1] == "":
+                values.pop()
+            result.append([values] if values else [])
+        return result
+
+    sheet.batch_get.side_effect = batch_get
+    # Drive modifiedTime changes whenever the rows do
+    sheet.spreadsheet.get_lastUpdateTime.side_effect = lambda: str(hash(repr(rows)))
+
+class TestAccumulationIndex(unittest.TestCase):
+    def setUp(self):
+        with patch("src.loader.gspread"):
+            self.loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=":memory:")
+        self.sheet = MagicMock()
+        self.sheet.row_count = 1000
+        self.sheet.col_values.return_value = ["Fecha", "x"]
+        self.loader.sheet = self.sheet
+
+        today = datetime.now().strftime("%d/%m/%Y %H:%M")
+        stub_sheet_rows(self.sheet, [
+            make_record(today, "Juanma", "Familiar", "Gasto", "🏠 Casa", "Mercado", 10000),
+            make_record(today, "Leydi", "Familiar", "Gasto", "🏠 Casa", "Mercado", "$5,000"),
+            make_record(today, "Juanma", "Familiar", "Gasto", "", "Mercado", 1000),
+            make_record(today, "Juanma", "Personal", "Gasto", "💸 Deudas", "", 300),
+            make_record(today, "Leydi", "Personal", "Gasto", "💸 Deudas", "", 700),
+            make_record(today, "Juanma", "Familiar", "Ahorro", "🏠 Casa", "Mercado", 99),
+            make_record("01/01/2000", "Juanma", "Familiar", "Gasto", "🏠 Casa", "Mercado", 50000),
+        ])
+
+    def test_period_start(self):
+        self.assertEqual(_period_start(datetime(2026, 3, 25, 10)), datetime(2026, 3, 25))
+        self.assertEqual(_period_start(datetime(2026, 3, 24)), datetime(2026, 2, 25))
+        self.assertEqual(_period_start(datetime(2026, 1, 3)), datetime(2025, 12, 25))
+
+    def test_subcategory_query_includes_rows_without_main(self):
+        total = self.loader.get_accumulated_total("🏠 Casa - Mercado", "Familiar", "Gasto", user="Juanma")
+        # Familiar ignores the user filter; old-period row is excluded
+        self.assertEqual(total, 16000.0)
+
+    def test_main_category_and_personal_user_filter(self):
+        self.assertEqual(self.loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto", user="juanma"), 300.0)
+        self.assertEqual(self.loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto"), 1000.0)
+        self.assertEqual(self.loader.get_accumulated_total("🏠 Casa", "Familiar", "Ahorro"), 99.0)
+
+    def test_index_loads_once_and_tracks_appends(self):
+        self.loader.get_accumulated_total("🏠 Casa - Mercado", "Familiar", "Gasto")
+        today = datetime.now().strftime("%d/%m/%Y %H:%M")
+        ok = self.loader.append_transaction({"date": today, "amount": 4000.0, "merchant": "D1"}, "🏠 Casa - Mercado", scope="Familiar", user_who_paid="Leydi")
+        self.assertTrue(ok)
+
+        total = self.loader.get_accumulated_total("🏠 Casa - Mercado", "Familiar", "Gasto")
+        self.assertEqual(total, 20000.0)
+        self.assertEqual(self.sheet.batch_get.call_count, 1)
+
+    def test_only_needed_columns_are_downloaded(self):
+        self.loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto")
+        ranges = self.sheet.batch_get.call_args.args[0]
+        # Timestamp (B) and Descripción (I) are never fetched
+        self.assertEqual(sorted(ranges), ["A2:A", "C2:C", "D2:D", "E2:E", "F2:F", "G2:G", "H2:H"])
+        self.sheet.get_all_records.assert_not_called()
+
+    def test_headers_resolved_with_suffixes_and_reordering(self):
+        headers = ["Monto", "Fecha", "Usuario ", "Scope (Fam/Per)", "Tipo de Movimiento", "Categoría (Principal)", "Subcategoría "]
+        today = datetime.now().strftime("%d/%m/%Y")
+        stub_sheet_rows(self.sheet, [["$1,500", today, "Juanma", "Personal", "Gasto", "💸 Deudas", ""]], headers=headers)
+        self.assertEqual(self.loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto", user="Juanma"), 1500.0)
+
+class TestRecurringRead(unittest.TestCase):
+    def test_recurring_expenses_from_columns(self):
+        with patch("src.loader.gspread"):
+            loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=":memory:")
+        ws = MagicMock()
+        loader.client.open_by_key.return_value.worksheet.return_value = ws
+        stub_sheet_rows(ws, [
+            ["123", "Netflix", "50,000", "🎬 Entretenimiento", "", ""],
+            ["bad", "Broken", "1", "x", "Personal", "Juanma"],
+            ["123", "AFP", "200000", "💰 Ahorro/Inversion - AFP", "Personal", "Juanma"],
+            ["456", "Seguro", "$288,700", "🚗 Transporte - [Bolsillo] Seguro", "Familiar", "Leydi"],
+        ], headers=["Chat ID", "Nombre Gasto", "Monto", "Categoría", "Scope", "Dueño (User)"])
+
+        recurring = loader.get_recurring_expenses()
+
+        self.assertEqual(sorted(recurring), [123, 456])
+        self.assertEqual(recurring[123][0], {"name": "Netflix", "amount": 50000.0, "category": "🎬 Entretenimiento", "scope": "Personal", "owner": "User"})
+        self.assertEqual(recurring[123][1]["name"], "AFP")
+        self.assertEqual(recurring[456][0]["amount"], 288700.0)
+
+class TestReadCache(unittest.TestCase):
+    def setUp(self):
+        with patch("src.loader.gspread"):
+            self.loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=":memory:")
+        self.ws = MagicMock()
+        self.loader.client.open_by_key.return_value.worksheet.return_value = self.ws
+        self.rows = [["123", "Netflix", "50000", "🎬 Entretenimiento", "Personal", "Juanma"]]
+        stub_sheet_rows(self.ws, self.rows, headers=["Chat ID", "Nombre Gasto", "Monto", "Categoría", "Scope", "Dueño (User)"])
+
+    def test_unchanged_revision_is_served_from_memory(self):
+        self.loader.get_recurring_expenses()
+        self.loader.get_recurring_expenses()
+
+        self.ws.batch_get.assert_called_once()
+        self.ws.row_values.assert_called_once()
+        self.assertEqual(self.loader.read_cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+    def test_new_revision_is_downloaded(self):
+        self.loader.get_recurring_expenses()
+        self.rows.append(["123", "AFP", "1000", "💰 Ahorro/Inversion", "Personal", "Juanma"])
+
+        self.assertEqual(len(self.loader.get_recurring_expenses()[123]), 2)
+        self.assertEqual(self.ws.batch_get.call_count, 2)
+
+    def test_own_writes_invalidate(self):
+        self.loader.get_recurring_expenses()
+        self.loader.sheet = MagicMock(row_count=1000)
+        self.loader.sheet.col_values.return_value = ["Fecha"]
+        self.loader.sheet.spreadsheet.worksheet.return_value = self.ws
+        self.loader.append_transaction({"date": "01/02/2026", "amount": 1.0, "merchant": "X"}, "💸 Deudas")
+
+        self.loader.get_recurring_expenses()
+        self.assertEqual(self.ws.batch_get.call_count, 2)
+
+    def test_unknown_revision_bypasses_cache(self):
+        self.ws.spreadsheet.get_lastUpdateTime.side_effect = Exception("drive down")
+        self.loader.get_recurring_expenses()
+        self.loader.get_recurring_expenses()
+        self.assertEqual(self.ws.batch_get.call_count, 2)
+
+class TestAsyncLoader(unittest.TestCase):
+    def test_slow_sheet_read_does_not_block_event_loop(self):
+        with patch("src.loader.gspread"):
+            loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=":memory:", max_workers=2)
+        self.assertEqual(loader.executor._max_workers, 2)
+
+        loader.sheet = MagicMock()
+        stub_sheet_rows(loader.sheet, [make_record(datetime.now().strftime("%d/%m/%Y"), "Juanma", "Personal", "Gasto", "💸 Deudas", "", 300)])
+        fast_batch_get = loader.sheet.batch_get.side_effect
+
+        def slow_batch_get(ranges, **kwargs):
+            time.sleep(0.2)
+            return fast_batch_get(ranges, **kwargs)
+
+        loader.sheet.batch_get.side_effect = slow_batch_get
+
+        async def run():
+            ticks = 0
+            task = asyncio.create_task(loader.accumulated("💸 Deudas", "Personal", "Gasto", user="Juanma"))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            return ticks, task.result()
+
+        ticks, total = asyncio.run(run())
+        self.assertGreater(ticks, 5)
+        self.assertEqual(total, 300.0)
+        loader.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.loader import SheetsLoader
+
+def make_loader():
+    with patch("src.loader.gspread"):
+        loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=":memory:")
+    sheet = MagicMock()
+    sheet.row_count = 1000
+    sheet.col_values.return_value = ["Fecha", "01/01/2026"]
+    loader.sheet = sheet
+    return loader, sheet
+
+TX = {"date": "01/02/2026 10:00", "amount": 1000.0, "merchant": "TEST"}
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def test_queued_rows_are_written_in_one_request(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 60 # Only flush explicitly
+
+        futures = [loader.queue_transaction(TX, f"🏠 Casa - Sub{i}", scope="Familiar") for i in range(3)]
+        self.assertFalse(any(f.done() for f in futures))
+
+        loader.flush_writes()
+
+        self.assertTrue(all(f.result() for f in futures))
+        sheet.update.assert_called_once()
+        kwargs = sheet.update.call_args.kwargs
+        self.assertEqual(kwargs["range_name"], "A3:I5")
+        self.assertEqual([r[6] for r in kwargs["values"]], ["Sub0", "Sub1", "Sub2"])
+
+    def test_timer_flushes_after_window(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 0.01
+
+        future = loader.queue_transaction(TX, "💸 Deudas")
+        self.assertTrue(future.result(timeout=2))
+        sheet.update.assert_called_once()
+
+    def test_failed_write_resolves_all_futures_false(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 60
+        sheet.update.side_effect = Exception("quota")
+
+        futures = [loader.queue_transaction(TX, "💸 Deudas") for _ in range(2)]
+        loader.flush_writes()
+        self.assertEqual([f.result() for f in futures], [False, False])
+
+    def test_append_transaction_still_synchronous(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 60
+        self.assertTrue(loader.append_transaction(TX, "💸 Deudas"))
+        sheet.update.assert_called_once()
+
+class TestRowCursor(unittest.TestCase):
+    def test_cursor_scans_column_once_then_revalidates_cheaply(self):
+        loader, sheet = make_loader()
+        sheet.get.return_value = [["01/02/2026 10:00"]] # A{n-1} filled, A{n} empty
+
+        loader.append_transaction(TX, "💸 Deudas")
+        loader.append_transaction(TX, "💸 Deudas")
+
+        sheet.col_values.assert_called_once()
+        sheet.get.assert_called_once_with("A3:A4")
+        ranges = [c.kwargs["range_name"] for c in sheet.update.call_args_list]
+        self.assertEqual(ranges, ["A3:I3", "A4:I4"])
+
+    def test_stale_cursor_rescans_column(self):
+        loader, sheet = make_loader()
+        loader.append_transaction(TX, "💸 Deudas")
+
+        # Someone typed two rows by hand: the cursor row is no longer empty
+        sheet.get.return_value = [["x"], ["manual row"]]
+        sheet.col_values.return_value = ["Fecha", "a", "b", "c", "d"]
+        loader.append_transaction(TX, "💸 Deudas")
+
+        self.assertEqual(sheet.col_values.call_count, 2)
+        self.assertEqual(sheet.update.call_args.kwargs["range_name"], "A6:I6")
+
+    def test_grid_grows_geometrically(self):
+        loader, sheet = make_loader()
+        sheet.row_count = 1000
+        sheet.col_values.return_value = ["x"] * 1000
+
+        loader.append_transaction(TX, "💸 Deudas")
+
+        sheet.add_rows.assert_called_once_with(500)
+        self.assertEqual(sheet.update.call_args.kwargs["range_name"], "A1001:I1001")
+
+class FakeSheet:
+    """Minimal in-memory Base_Transacciones with slow writes, to surface row collisions."""
+    def __init__(self):
+        self.rows = [["Fecha"]]
+        self.row_count = 1000
+
+    def col_values(self, col):
+        return [r[0] for r in self.rows]
+
+    def get(self, rng):
+        first, last = [int(part[1:]) for part in rng.split(":")]
+        return [[self.rows[i - 1][0]] if i <= len(self.rows) else [] for i in range(first, last + 1)]
+
+    def update(self, range_name, values, value_input_option=None):
+        start = int(range_name.split(":")[0][1:])
+        time.sleep(0.01)
+        for offset, row in enumerate(values):
+            idx = start - 1 + offset
+            while len(self.rows) <= idx:
+                self.rows.append([""])
+            if self.rows[idx][0] != "":
+                raise AssertionError(f"Row {idx + 1} overwritten")
+            self.rows[idx] = row
+
+    def add_rows(self, n):
+        self.row_count += n
+
+class TestWriteCoordinator(unittest.TestCase):
+    def test_concurrent_producers_never_share_a_row(self):
+        loader, _ = make_loader()
+        sheet = FakeSheet()
+        loader.sheet = sheet
+        loader.writes.window = 0.005
+        results = []
+
+        def producer(i):
+            results.append(loader.append_transaction({**TX, "merchant": f"T{i}"}, "💸 Deudas"))
+
+        threads = [threading.Thread(target=producer, args=(i,)) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertTrue(all(results))
+        merchants = sorted(r[8] for r in sheet.rows[1:])
+        self.assertEqual(merchants, sorted(f"T{i}" for i in range(20)))
+
+    def test_async_append_batches_concurrent_awaits(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 0.01
+
+        async def run():
+            return await asyncio.gather(*(loader.append(TX, "💸 Deudas") for _ in range(4)))
+
+        self.assertEqual(asyncio.run(run()), [True] * 4)
+        sheet.update.assert_called_once()
+        self.assertEqual(sheet.update.call_args.kwargs["range_name"], "A3:I6")
+
+    def test_append_many_is_one_request(self):
+        loader, sheet = make_loader()
+        loader.writes.window = 60 # append_many flushes by itself
+
+        entries = [(TX, f"💸 Deudas - Sub{i}", "Personal", "Juanma", "Gasto") for i in range(13)]
+        self.assertEqual(asyncio.run(loader.append_many(entries)), [True] * 13)
+        sheet.update.assert_called_once()
+        self.assertEqual(sheet.update.call_args.kwargs["range_name"], "A3:I15")
+
+if __name__ == '__main__':
+    unittest.main()
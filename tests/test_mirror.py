@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.loader import SheetsLoader
+from src.mirror import TransactionsMirror
+from tests.test_loader_index import make_record, stub_sheet_rows
+
+TODAY = datetime.now().strftime("%d/%m/%Y %H:%M")
+
+def make_loader(rows, mirror_path=":memory:"):
+    with patch("src.loader.gspread"):
+        loader = SheetsLoader(credentials=MagicMock(), sheet_id="fake", mirror_path=mirror_path)
+    sheet = MagicMock()
+    sheet.row_count = 1000
+    stub_sheet_rows(sheet, rows)
+    sheet.col_values.side_effect = lambda col: ["Fecha"] + [r[0] for r in rows]
+
+    def update(range_name, values, value_input_option=None):
+        rows.extend(values)
+
+    sheet.update.side_effect = update
+    loader.sheet = sheet
+    return loader, sheet
+
+def first_rows_read(sheet):
+    return {rng.split(":")[0][1:] for rng in sheet.batch_get.call_args.args[0]}
+
+class TestTransactionsMirror(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            make_record(TODAY, "Juanma", "Personal", "Gasto", "💸 Deudas", "", 100),
+            make_record(TODAY, "Juanma", "Personal", "Gasto", "💸 Deudas", "", 200),
+        ]
+        self.loader, self.sheet = make_loader(self.rows)
+
+    def total(self):
+        return self.loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto", user="Juanma")
+
+    def test_delta_sync_fetches_only_new_rows(self):
+        self.assertEqual(self.total(), 300.0)
+        self.assertEqual(self.loader.mirror.last_row, 3)
+
+        # A row typed by hand in the sheet
+        self.rows.append(make_record(TODAY, "Juanma", "Personal", "Gasto", "💸 Deudas", "", 50))
+        self.loader.sync_interval = 0
+        self.assertEqual(self.total(), 350.0)
+        self.assertEqual(first_rows_read(self.sheet), {"4"})
+
+    def test_own_writes_are_mirrored(self):
+        self.total()
+        self.loader.append_transaction({"date": TODAY, "amount": 25.0, "merchant": "X"}, "💸 Deudas", user_who_paid="Juanma")
+        self.assertEqual(self.loader.mirror.last_row, 4)
+
+        count = self.loader.mirror.query("SELECT COUNT(*), SUM(monto) FROM transactions")[0]
+        self.assertEqual(count, (3, 325.0))
+
+        # The next delta sync starts after our own row
+        self.loader.sync_interval = 0
+        self.assertEqual(self.total(), 325.0)
+        self.assertEqual(first_rows_read(self.sheet), {"5"})
+
+    def test_checksum_pass_catches_manual_edits(self):
+        self.total()
+        self.rows[0] = make_record(TODAY, "Juanma", "Personal", "Gasto", "💸 Deudas", "", 1000)
+        del self.rows[1]
+
+        self.assertTrue(self.loader.refresh_index())
+        self.assertEqual(self.total(), 1000.0)
+        self.assertEqual(self.loader.mirror.last_row, 2)
+
+    def test_offline_reads_served_from_mirror(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "mirror.db")
+            loader, _ = make_loader(self.rows, mirror_path=path)
+            loader.get_accumulated_total("💸 Deudas", "Personal", "Gasto")
+            loader.mirror.replace_recurring({123: [{"name": "AFP", "amount": 1.0, "category": "c", "scope": "Personal", "owner": "Juanma"}]})
+            loader.mirror.conn.close()
+
+            # Restart without Sheets access
+            offline, sheet = make_loader([], mirror_path=path)
+            sheet.batch_get.side_effect = Exception("network down")
+            sheet.spreadsheet.worksheet.side_effect = Exception("network down")
+
+            self.assertEqual(offline.get_accumulated_total("💸 Deudas", "Personal", "Gasto", user="Juanma"), 300.0)
+            self.assertEqual(offline.get_recurring_expenses()[123][0]["name"], "AFP")
+            offline.mirror.conn.close()
+
+class TestMirrorStore(unittest.TestCase):
+    def test_recurring_round_trip_keeps_order(self):
+        mirror = TransactionsMirror(":memory:")
+        config = {1: [{"name": "B", "amount": 2.0, "category": "x", "scope": "Personal", "owner": "U"},
+                      {"name": "A", "amount": 1.0, "category": "y", "scope": "Familiar", "owner": "U"}]}
+        mirror.replace_recurring(config)
+        self.assertEqual(mirror.recurring(), config)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.bot import TransactionsBot
+from src.recurring import RecurringConfigProvider, merge_recurring
+
+def item(name, amount, owner="Juanma"):
+    return {"name": name, "amount": amount, "category": "💸 Deudas", "scope": "Personal", "owner": owner}
+
+STATIC = {1: [item("AFP", 200000), item("Deudas", 497012)]}
+
+class TestMergeRecurring(unittest.TestCase):
+    def test_sheet_overrides_static_by_name(self):
+        merged = merge_recurring(STATIC, {1: [item("deudas ", 1.0), item("Netflix", 50000)], 2: [item("Seguro", 9, "Leydi")]})
+        self.assertEqual([(i["name"], i["amount"]) for i in merged[1]], [("AFP", 200000), ("deudas ", 1.0), ("Netflix", 50000)])
+        self.assertEqual(merged[2][0]["owner"], "Leydi")
+
+class TestRecurringConfigProvider(unittest.TestCase):
+    def make_provider(self, sheet_map, ttl=300):
+        loader = MagicMock()
+        loader.recurring_expenses = AsyncMock(return_value=sheet_map)
+        return RecurringConfigProvider(loader, static=STATIC, ttl=ttl), loader
+
+    def test_cached_within_ttl(self):
+        provider, loader = self.make_provider({1: [item("Netflix", 50000)]})
+
+        async def run():
+            first = await provider.get(1)
+            first[0]["amount"] = 0 # Callers may edit their copy
+            return await provider.get(1)
+
+        items = asyncio.run(run())
+        self.assertEqual([i["name"] for i in items], ["AFP", "Deudas", "Netflix"])
+        self.assertEqual(items[0]["amount"], 200000)
+        loader.recurring_expenses.assert_awaited_once()
+
+    def test_expired_ttl_serves_cache_and_refreshes_in_background(self):
+        provider, loader = self.make_provider({1: [item("Netflix", 50000)]}, ttl=0)
+
+        async def run():
+            await provider.get(1)
+            loader.recurring_expenses.return_value = {1: [item("Netflix", 60000)]}
+            stale = await provider.get(1)
+            await provider._refresh_task
+            return stale, await provider.get(1)
+
+        stale, fresh = asyncio.run(run())
+        self.assertEqual(stale[-1]["amount"], 50000)
+        self.assertEqual(fresh[-1]["amount"], 60000)
+
+    def test_unchanged_content_is_not_rebuilt(self):
+        provider, _ = self.make_provider({1: [item("Netflix", 50000)]})
+
+        async def run():
+            return await provider.refresh(), await provider.refresh()
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+
+    def test_failed_refresh_keeps_last_config(self):
+        provider, loader = self.make_provider({1: [item("Netflix", 50000)]})
+
+        async def run():
+            await provider.refresh()
+            loader.recurring_expenses.side_effect = Exception("quota")
+            changed = await provider.refresh()
+            return changed, await provider.get(1)
+
+        changed, items = asyncio.run(run())
+        self.assertFalse(changed)
+        self.assertEqual(len(items), 3)
+
+    def test_without_loader_uses_static_config(self):
+        provider = RecurringConfigProvider(static=STATIC)
+        self.assertEqual(len(asyncio.run(provider.get(1))), 2)
+
+class TestBulkRecurringFlow(unittest.TestCase):
+    def setUp(self):
+        with patch("src.bot.ApplicationBuilder"):
+            self.loader = MagicMock()
+            self.loader.append_many = AsyncMock(side_effect=lambda entries: [True] * len(entries))
+            self.loader.accumulated = AsyncMock(return_value=1000.0)
+            provider = RecurringConfigProvider(static={7: [item("AFP", 200000), item("Deudas", 497012), item("Netflix", 50000)]})
+            self.bot = TransactionsBot(token="fake", loader=self.loader, recurring=provider)
+        self.context = MagicMock()
+        self.context.bot.send_message = AsyncMock()
+
+    def make_update(self, data=None, text=None):
+        update = MagicMock()
+        update.effective_user.id = 1
+        update.effective_chat.id = 7
+        if data:
+            update.callback_query.data = data
+            update.callback_query.from_user.id = 1
+            update.callback_query.answer = AsyncMock()
+            update.callback_query.edit_message_text = AsyncMock()
+        else:
+            update.callback_query = None
+            update.message.text = text
+            update.message.reply_text = AsyncMock()
+        return update
+
+    def test_review_edit_and_save_all_in_one_write(self):
+        async def run():
+            await self.bot.start_recurring_flow(self.make_update(text="/fijos"), self.context)
+            await self.bot.button(self.make_update("REC|TOGGLE:2"), self.context) # Skip Netflix
+            await self.bot.button(self.make_update("REC|EDIT:0"), self.context)
+            await self.bot.handle_message(self.make_update(text="150k"), self.context)
+            await self.bot.button(self.make_update("REC|SAVEALL"), self.context)
+
+        asyncio.run(run())
+
+        self.loader.append_many.assert_awaited_once()
+        entries = self.loader.append_many.call_args.args[0]
+        self.assertEqual([(e[0]["merchant"], e[0]["amount"]) for e in entries], [("AFP", 150000.0), ("Deudas", 497012)])
+
+        # One summary message, one line per category
+        self.context.bot.send_message.assert_awaited_once()
+        text = self.context.bot.send_message.call_args.kwargs["text"]
+        self.assertIn("(2/2)", text)
+        self.assertIn("$647,012.00", text)
+        self.assertNotIn(1, self.bot.recurring_sessions)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from functools import partial
+from unittest.mock import AsyncMock, MagicMock
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import etl_loop
+from src.ledger import EmailLedger
+from src.scheduler import EMAIL, INTERACTIVE, TaskScheduler
+
+class TestTaskScheduler(unittest.TestCase):
+    def test_workers_bound_concurrency(self):
+        scheduler = TaskScheduler(workers=3, queue_size=100)
+        running = []
+        peak = []
+
+        async def job():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        async def run():
+            for _ in range(12):
+                await scheduler.submit(job)
+            await scheduler.join()
+            await scheduler.close()
+
+        asyncio.run(run())
+        self.assertEqual(len(peak), 12)
+        self.assertEqual(max(peak), 3)
+
+    def test_full_queue_blocks_submit(self):
+        scheduler = TaskScheduler(workers=1, queue_size=2)
+
+        async def run():
+            release = asyncio.Event()
+            for _ in range(3): # One running, two queued
+                await scheduler.submit(release.wait)
+            blocked = asyncio.create_task(scheduler.submit(release.wait))
+            await asyncio.sleep(0.01)
+            was_blocked = not blocked.done()
+            release.set()
+            await blocked
+            await scheduler.close()
+            return was_blocked
+
+        self.assertTrue(asyncio.run(run()))
+
+    def test_prompts_capped_per_chat(self):
+        scheduler = TaskScheduler(workers=1, queue_size=1, max_prompts_per_chat=2)
+
+        async def run():
+            answers = [asyncio.Event() for _ in range(3)]
+            third_started = asyncio.Event()
+
+            async def third():
+                third_started.set()
+
+            await scheduler.start_prompt("Juanma", answers[0].wait)
+            await scheduler.start_prompt("Juanma", answers[1].wait)
+            await scheduler.start_prompt("Juanma", third) # Parked
+            await scheduler.start_prompt("Leydi", answers[2].wait)
+            await asyncio.sleep(0.01)
+            stats = scheduler.stats()
+            state = (third_started.is_set(), stats["prompts"], stats["parked"])
+            answers[0].set()
+            await asyncio.wait_for(third_started.wait(), timeout=1)
+            await scheduler.close()
+            return state
+
+        self.assertEqual(asyncio.run(run()), (False, 3, 1))
+
+    def test_saturated_chat_does_not_block_other_chats(self):
+        scheduler = TaskScheduler(workers=2, queue_size=10, max_prompts_per_chat=1, reserved_workers=0)
+
+        async def run():
+            answer = asyncio.Event()
+            leydi_prompted = asyncio.Event()
+
+            async def leydi():
+                leydi_prompted.set()
+
+            # Juanma's backlog outnumbers the workers; all but the first prompt have to wait for his slot
+            for _ in range(5):
+                await scheduler.submit(partial(scheduler.start_prompt, "Juanma", answer.wait), lane=EMAIL)
+            await scheduler.submit(partial(scheduler.start_prompt, "Leydi", leydi), lane=EMAIL)
+            await asyncio.wait_for(leydi_prompted.wait(), timeout=1)
+            stats = scheduler.stats()
+            answer.set()
+            await scheduler.close()
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats["parked"], 4)
+        self.assertEqual(stats["lanes"][EMAIL]["started"], 6)
+
+class TestPriorityLanes(unittest.TestCase):
+    def test_interactive_jobs_go_first(self):
+        scheduler = TaskScheduler(workers=1, queue_size=100, reserved_workers=0)
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+                await asyncio.sleep(0)
+            return run
+
+        async def run():
+            gate = asyncio.Event()
+            await scheduler.submit(gate.wait) # Keeps the only worker busy while the lanes fill up
+            for i in range(3):
+                await scheduler.submit(job(f"email{i}"), lane=EMAIL)
+            await scheduler.submit(job("manual"), lane=INTERACTIVE)
+            gate.set()
+            await scheduler.join()
+            await scheduler.close()
+
+        asyncio.run(run())
+        self.assertEqual(order, ["manual", "email0", "email1", "email2"])
+
+    def test_manual_entry_never_waits_behind_blocked_email_workers(self):
+        scheduler = TaskScheduler(workers=2, queue_size=10, max_prompts_per_chat=1)
+
+        async def run():
+            answer = asyncio.Event()
+            # The first email prompt takes Juanma's slot; the others are parked
+            for _ in range(3):
+                await scheduler.submit(partial(scheduler.start_prompt, "Juanma", answer.wait), lane=EMAIL)
+            manual_started = asyncio.Event()
+
+            async def manual():
+                manual_started.set()
+                await answer.wait()
+
+            await scheduler.submit_prompt("manual:1", manual)
+            await asyncio.wait_for(manual_started.wait(), timeout=1)
+            stats = scheduler.stats()
+            answer.set()
+            await scheduler.close()
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats["lanes"][INTERACTIVE]["started"], 1)
+        self.assertLess(stats["lanes"][INTERACTIVE]["max_ms"], 100)
+        self.assertEqual(stats["lanes"][EMAIL]["started"], 3)
+
+    def test_end_to_end_latency_counts_work_before_submit(self):
+        scheduler = TaskScheduler(workers=1, queue_size=10)
+
+        async def run():
+            received_at = time.monotonic()
+            await asyncio.sleep(0.05) # e.g. parsing the Tasker text
+            await scheduler.submit_prompt("manual:1", AsyncMock(), since=received_at)
+            await scheduler.join()
+            stats = scheduler.stats()
+            await scheduler.close()
+            return stats
+
+        lane = asyncio.run(run())["lanes"][INTERACTIVE]
+        self.assertLess(lane["max_ms"], 50)
+        self.assertGreaterEqual(lane["total_max_ms"], 45)
+
+class TestBacklogBackpressure(unittest.TestCase):
+    def test_backlog_fetch_stalls_while_prompts_are_unanswered(self):
+        ids = [f"m{i}" for i in range(40)]
+        gmail = MagicMock()
+        gmail.unprocessed_filter = "is:unread"
+        gmail.new_message_ids = AsyncMock(return_value=ids)
+        gmail.get_messages = AsyncMock(side_effect=lambda chunk, wants_body=None: [{"id": i, "snippet": "Compra", "body": "Compra"} for i in chunk])
+        parser = MagicMock()
+        parser.parse_async = AsyncMock(return_value={"amount": 1000.0, "merchant": "TIENDA"})
+        bot = MagicMock()
+
+        async def never_answered(*args, **kwargs):
+            await asyncio.Event().wait()
+
+        bot.ask_user_for_category = AsyncMock(side_effect=never_answered)
+        scheduler = TaskScheduler(workers=2, queue_size=3, max_prompts_per_chat=2)
+
+        async def run():
+            task = asyncio.create_task(etl_loop({"Juanma": bot}, gmail, parser, MagicMock(), ledger=EmailLedger(":memory:"), scheduler=scheduler))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await scheduler.close()
+
+        asyncio.run(run())
+        self.assertEqual(bot.ask_user_for_category.await_count, 2)
+        # 2 prompting + 5 parked (the fetcher stops submitting at 3 parked; queued jobs still drain): 3 chunks of 3 downloaded, not 14
+        self.assertEqual(gmail.get_messages.await_count, 3)
+        self.assertEqual(parser.parse_async.await_count, 7)
+        self.assertEqual(scheduler.stats()["parked"], 0) # Dropped on close
+
+if __name__ == '__main__':
+    unittest.main()
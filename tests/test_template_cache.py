@@ -0,0 +1,129 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.parser import TransactionParser, amount_es_co
+from src.template_cache import Template, TemplateCache, induce_patterns
+
+# Wording none of the regex templates know
+FIRST = "Tu compra con la tarjeta Oro fue registrada. Valor: $45.900 Lugar: PANADERIA LA 80 Fecha: 2026-03-14 a las 09:12"
+SECOND = "Tu compra con la tarjeta Oro fue registrada. Valor: $1.250.000 Lugar: PANADERIA LA 80 Fecha: 2026-03-15 a las 18:40"
+LLM_FIRST = {"date": "14/03/2026 09:12", "amount": 45900.0, "merchant": "PANADERIA LA 80", "description": "PANADERIA LA 80"}
+# Same wording, another merchant (a different fingerprint)
+OTHER = "Tu compra con la tarjeta Oro fue registrada. Valor: $8.000 Lugar: TIENDA D1 Fecha: 2026-03-16 a las 11:05"
+
+class TestTemplate(unittest.TestCase):
+    def test_fingerprint_ignores_fields_only(self):
+        self.assertEqual(Template(FIRST).fingerprint, Template(SECOND).fingerprint)
+        self.assertEqual(Template(FIRST).fingerprint, Template(FIRST.replace(" ", "  ")).fingerprint)
+        self.assertNotEqual(Template(FIRST).fingerprint, Template(FIRST.replace("PANADERIA", "DROGUERIA")).fingerprint)
+
+    def test_position_mapping(self):
+        template = Template(FIRST)
+        start = FIRST.index("PANADERIA")
+        self.assertEqual(template.to_text(template.to_masked(start)), start)
+        self.assertIsNone(template.to_masked(FIRST.index("45.900")))
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemplateCache(":memory:")
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_replays_learned_positions(self):
+        self.assertIsNone(self.cache.lookup(FIRST))
+        self.assertTrue(self.cache.learn(FIRST, LLM_FIRST, amount_es_co))
+
+        fields = self.cache.lookup(SECOND)
+        self.assertEqual(fields, {"merchant": "PANADERIA LA 80", "amount": "$1.250.000", "date": "15/03/2026 18:40"})
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_results_it_cannot_locate_are_not_learned(self):
+        self.assertFalse(self.cache.learn(FIRST, dict(LLM_FIRST, merchant="PANADERÍA LA OCHENTA"), amount_es_co))
+        self.assertFalse(self.cache.learn(FIRST, dict(LLM_FIRST, amount=46000.0), amount_es_co))
+        self.assertFalse(self.cache.learn(FIRST, dict(LLM_FIRST, merchant="UNKNOWN"), amount_es_co))
+
+    def test_persists_across_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "templates.db")
+            cache = TemplateCache(path)
+            cache.learn(FIRST, LLM_FIRST, amount_es_co)
+            cache.close()
+            cache = TemplateCache(path)
+            self.assertEqual(cache.lookup(SECOND)["merchant"], "PANADERIA LA 80")
+            cache.close()
+
+class TestInduction(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemplateCache(":memory:")
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_candidates(self):
+        self.assertEqual(induce_patterns(FIRST, "PANADERIA LA 80")[0], r"Lugar:\s*([^\n]+?)\s+Fecha:")
+        # One-letter context words are skipped; numbers are generalized
+        glim = "Pagaste $17.600 con tu tarjeta de beneficios Glim el\n27/06/2026\na las\n18:46\nen\nILLY."
+        self.assertEqual(induce_patterns(glim, "ILLY"), [r"las\s+\d[\d\.,:]*\s+en\s*([^\n]+?)\."])
+        self.assertEqual(induce_patterns(FIRST, "OTRO"), [])
+
+    def test_promoted_after_min_support(self):
+        self.cache.add_sample(FIRST, "PANADERIA LA 80", "Oro")
+        self.assertIsNone(self.cache.induce(FIRST, "PANADERIA LA 80", "Oro"))
+        self.cache.add_sample(OTHER, "TIENDA D1", "Oro")
+        self.assertEqual(self.cache.induce(OTHER, "TIENDA D1", "Oro"), r"Lugar:\s*([^\n]+?)\s+Fecha:")
+        self.assertEqual(self.cache.promoted(), {"Oro": [r"Lugar:\s*([^\n]+?)\s+Fecha:"]})
+        # Other banks' emails are neither evidence nor counter-evidence
+        self.assertEqual(self.cache.promoted().get(None), None)
+
+    def test_candidate_wrong_on_corpus_is_not_used(self):
+        # A stored email where "Lugar: ... Fecha:" holds something that is not the merchant
+        self.cache.add_sample("Cita agendada. Lugar: SEDE NORTE Fecha: 2026-03-01. Pagaste $5.000 en PARQUEADERO", "PARQUEADERO")
+        self.cache.add_sample(FIRST, "PANADERIA LA 80")
+        self.cache.add_sample(OTHER, "TIENDA D1")
+        self.assertEqual(self.cache.induce(OTHER, "TIENDA D1"), r"\$\d[\d\.,:]*\s+Lugar:\s*([^\n]+?)\s+Fecha:")
+
+class TestParserWithTemplateCache(unittest.TestCase):
+    def test_llm_called_once_per_template(self):
+        parser = TransactionParser(api_key="", template_cache=TemplateCache(":memory:"))
+        parser.model = MagicMock()
+        parser.model.generate_content.return_value.text = '{"amount": 45900, "merchant": "Panaderia La 80", "date": "14/03/2026 09:12"}'
+
+        first = parser.parse(FIRST)
+        second = parser.parse(SECOND)
+
+        self.assertEqual(parser.model.generate_content.call_count, 1)
+        self.assertEqual(first["amount"], 45900.0)
+        self.assertEqual((second["amount"], second["merchant"], second["date"]), (1250000.0, "PANADERIA LA 80", "15/03/2026 18:40"))
+        parser.template_cache.close()
+
+    def test_induced_pattern_replaces_llm_calls(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TemplateCache(os.path.join(tmp, "templates.db"))
+            parser = TransactionParser(api_key="", template_cache=cache)
+            parser.model = MagicMock()
+            responses = iter(['{"amount": 45900, "merchant": "PANADERIA LA 80", "date": "14/03/2026 09:12"}',
+                              '{"amount": 8000, "merchant": "TIENDA D1", "date": "16/03/2026 11:05"}'])
+            parser.model.generate_content.side_effect = lambda prompt, **kwargs: MagicMock(text=next(responses))
+            parser.parse(FIRST)
+            parser.parse(OTHER)
+            self.assertEqual(parser.model.generate_content.call_count, 2)
+
+            third = OTHER.replace("TIENDA D1", "FARMATODO").replace("$8.000", "$23.500")
+            result = parser.parse(third)
+            self.assertEqual(parser.model.generate_content.call_count, 2)
+            self.assertEqual((result["amount"], result["merchant"]), (23500.0, "FARMATODO"))
+
+            # Promoted patterns survive a restart
+            restarted = TransactionParser(api_key="", template_cache=cache)
+            self.assertEqual(restarted._parse_regex(third)["merchant"], "FARMATODO")
+            cache.close()
+
+if __name__ == '__main__':
+    unittest.main()